@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import CarteRFID, HistoriqueStatutsCarte
+from .models import CarteRFID, HistoriqueStatutsCarte, LotEmissionCartes
 
 
 @admin.register(CarteRFID)
@@ -15,3 +15,10 @@ class HistoriqueStatutsCarteAdmin(admin.ModelAdmin):
     list_display = ['carte', 'ancien_statut', 'nouveau_statut', 'date_changement']
     list_filter = ['ancien_statut', 'nouveau_statut', 'date_changement']
     readonly_fields = ['id', 'date_changement']
+
+
+@admin.register(LotEmissionCartes)
+class LotEmissionCartesAdmin(admin.ModelAdmin):
+    list_display = ['id', 'entreprise', 'nombre', 'cartes_creees', 'type_carte', 'statut', 'date_creation']
+    list_filter = ['statut', 'type_carte', 'date_creation']
+    readonly_fields = ['id', 'cartes_creees', 'fichiers', 'date_creation', 'date_fin']
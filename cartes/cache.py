@@ -0,0 +1,121 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from .models import CarteRFID
+
+# Cache de lecture des cartes pour les passages sur terminal, par code_uid.
+# On ne garde qu'une projection compacte (statut, plafonds, titulaire), sans
+# la clé de chiffrement ni le solde : le solde est écrit par le moteur
+# d'autorisation en UPDATE direct, sans signal, et ne peut pas être mis en
+# cache sans risque. Chaque carte a une version dans le cache partagé,
+# changée à chaque enregistrement ou suppression ; une entrée (mémoire du
+# processus ou cache partagé) n'est servie que si elle porte la version
+# courante. La version d'une entrée en mémoire est revérifiée au plus toutes
+# les CARD_CACHE['RELECTURE'] secondes : un passage est servi sans aucun
+# aller-retour dans le cas courant, et un changement fait dans un autre
+# processus (blocage) y est vu au plus RELECTURE secondes plus tard. Le
+# statut servi n'est qu'indicatif : l'autorisation vérifie le statut de la
+# carte dans son UPDATE conditionnel.
+
+CHAMPS = [
+    'id', 'code_uid', 'numero_serie', 'type_carte', 'statut',
+    'plafond_quotidien', 'plafond_mensuel', 'solde_maximum',
+    'date_expiration', 'personne_id', 'entreprise_id',
+]
+
+_lock = threading.Lock()
+_locales = OrderedDict()  # code_uid -> (version, projection, verifiee_a)
+
+
+def version_key(code_uid):
+    return f'carte:{code_uid}:version'
+
+
+def entry_key(code_uid):
+    return f'carte:{code_uid}:projection'
+
+
+def card_version(code_uid):
+    """Version courante d'une carte dans le cache partagé, créée si absente"""
+    version = cache.get(version_key(code_uid))
+    if version is None:
+        cache.add(version_key(code_uid), uuid.uuid4().hex, timeout=settings.CARD_CACHE['DUREE'] * 2)
+        version = cache.get(version_key(code_uid))
+    return version
+
+
+def _remember(code_uid, version, projection):
+    with _lock:
+        _locales[code_uid] = (version, projection, time.monotonic())
+        _locales.move_to_end(code_uid)
+        while len(_locales) > settings.CARD_CACHE['TAILLE_LOCALE']:
+            _locales.popitem(last=False)
+
+
+def lookup_card(code_uid):
+    """Projection d'une carte par code_uid, ou None si la carte n'existe pas"""
+    with _lock:
+        locale = _locales.get(code_uid)
+    if locale is not None and time.monotonic() - locale[2] < settings.CARD_CACHE['RELECTURE']:
+        return locale[1]
+
+    # La version est lue avant la base : une modification concurrente
+    # change la version et rend l'entrée construite ici aussitôt périmée
+    version = card_version(code_uid)
+    if locale is not None and locale[0] == version:
+        _remember(code_uid, version, locale[1])
+        return locale[1]
+
+    partagee = cache.get(entry_key(code_uid))
+    if partagee is not None and partagee['version'] == version:
+        _remember(code_uid, version, partagee['projection'])
+        return partagee['projection']
+
+    projection = CarteRFID.objects.filter(code_uid=code_uid).values(*CHAMPS).first()
+    if projection is None:
+        return None
+    projection['id'] = str(projection['id'])
+    for champ in ('personne_id', 'entreprise_id'):
+        if projection[champ] is not None:
+            projection[champ] = str(projection[champ])
+
+    cache.set(
+        entry_key(code_uid), {'version': version, 'projection': projection},
+        timeout=settings.CARD_CACHE['DUREE']
+    )
+    _remember(code_uid, version, projection)
+    return projection
+
+
+def invalidate_cards(code_uids):
+    """Change la version de cartes, maintenant et au commit de la transaction en cours.
+
+    La seconde invalidation écarte une entrée reconstruite entre
+    l'enregistrement et le commit à partir de l'ancienne ligne. Les
+    modifications en masse (queryset.update) n'émettent pas de signal et
+    doivent appeler cette fonction.
+    """
+    code_uids = list(code_uids)
+    if not code_uids:
+        return
+
+    def publier_versions():
+        cache.set_many(
+            {version_key(code_uid): uuid.uuid4().hex for code_uid in code_uids},
+            timeout=settings.CARD_CACHE['DUREE'] * 2
+        )
+        with _lock:
+            for code_uid in code_uids:
+                _locales.pop(code_uid, None)
+
+    publier_versions()
+    transaction.on_commit(publier_versions)
+
+
+def invalidate_card(code_uid):
+    """Invalide une carte"""
+    invalidate_cards([code_uid])
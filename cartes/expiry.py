@@ -0,0 +1,93 @@
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from notifications.models import Notification
+from notifications.outbox import notifier
+from .models import CarteRFID
+from .status import change_status, owner_user_ids
+
+# Expiration des cartes. Chaque jour, les cartes actives dont la date
+# d'expiration est passée passent au statut EXPIREE par tranches bornées
+# (une transaction par tranche, via le changement de statut en masse) et
+# les titulaires des cartes qui expirent dans PREAVIS_JOURS jours sont
+# prévenus, une notification par titulaire. Toutes les lectures passent
+# par l'index (statut, date_expiration) : le coût dépend du nombre de
+# cartes concernées, pas du nombre de cartes actives.
+
+MOTIF_EXPIRATION = "Date d'expiration dépassée"
+
+
+def expire_cards(jour=None, taille=None, progression=None):
+    """Passe au statut EXPIREE les cartes actives expirées avant jour ; retourne le nombre de cartes"""
+    jour = jour or timezone.localdate()
+    taille = taille or settings.CARD_EXPIRY['TAILLE_TRANCHE']
+    expirees = CarteRFID.objects.filter(statut='ACTIVE', date_expiration__lt=jour)
+
+    total = 0
+    while True:
+        # Les cartes traitées sortent du filtre : on relit toujours le début de l'index
+        ids = list(expirees.order_by('date_expiration', 'id').values_list('id', flat=True)[:taille])
+        if not ids:
+            return total
+        total += change_status(expirees.filter(id__in=ids), 'EXPIREE', MOTIF_EXPIRATION)
+        if progression:
+            progression(total)
+
+
+def expiry_notifications(cartes, date_expiration):
+    """Une notification de préavis par titulaire pour ses cartes qui expirent à une date"""
+    titulaires = owner_user_ids(cartes)
+    par_titulaire = {}
+    for carte in cartes:
+        if carte.id in titulaires:
+            par_titulaire.setdefault(titulaires[carte.id], []).append(carte.numero_serie)
+
+    echeance = date_expiration.strftime('%d/%m/%Y')
+    notifications = []
+    for user_id, numeros in par_titulaire.items():
+        if len(numeros) == 1:
+            titre = 'Expiration prochaine de votre carte'
+            message = f'Votre carte {numeros[0]} expire le {echeance}. Pensez à la renouveler.'
+        else:
+            titre = 'Expiration prochaine de vos cartes'
+            message = f'Vos cartes {", ".join(numeros)} expirent le {echeance}. Pensez à les renouveler.'
+        notifications.append(Notification(
+            destinataire_id=user_id,
+            type_notification='WARNING',
+            canal='EMAIL',
+            titre=titre,
+            message=message,
+            priorite='NORMALE',
+            reference_objet=echeance,
+            type_objet='EXPIRATION_CARTE',
+        ))
+    return notifications
+
+
+def notify_upcoming_expiries(jour=None, taille=None):
+    """Prévient les titulaires des cartes qui expirent dans PREAVIS_JOURS jours ; retourne le nombre de notifications.
+
+    Une date d'échéance n'est traitée que le jour exact du préavis :
+    le balayage doit passer tous les jours.
+    """
+    jour = jour or timezone.localdate()
+    taille = taille or settings.CARD_EXPIRY['TAILLE_TRANCHE']
+
+    envoyees = 0
+    for delai in settings.CARD_EXPIRY['PREAVIS_JOURS']:
+        date_expiration = jour + timedelta(days=delai)
+        cartes = CarteRFID.objects.filter(statut='ACTIVE', date_expiration=date_expiration).only(
+            'id', 'numero_serie', 'personne_id', 'entreprise_id'
+        ).order_by('id')
+        dernier_id = None
+        while True:
+            tranche = cartes.filter(id__gt=dernier_id) if dernier_id else cartes
+            tranche = list(tranche[:taille])
+            if not tranche:
+                break
+            # Un titulaire réparti sur deux tranches reçoit deux notifications, dans la limite d'une par tranche
+            with transaction.atomic():
+                envoyees += len(notifier(expiry_notifications(tranche, date_expiration)))
+            dernier_id = tranche[-1].id
+    return envoyees
@@ -0,0 +1,176 @@
+import multiprocessing
+import os
+import secrets
+from concurrent.futures import ProcessPoolExecutor
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from .issuance_sheet import render_sheet
+from .models import CarteRFID, LotEmissionCartes
+
+# Émission en masse de cartes. Les numéros de série sont réservés par bloc
+# (préfixe unique réservé pour le lot + rang dans le lot) et les UID sont tirés au hasard
+# par bloc puis vérifiés contre la base en une requête. Les cartes sont
+# insérées par tranches (bulk_create) ; chaque tranche insérée part aussitôt
+# au rendu de sa planche PDF dans un pool de processus (mode spawn), en
+# parallèle de l'insertion des tranches suivantes.
+
+TENTATIVES_UID = 5
+TENTATIVES_PREFIXE = 5
+
+
+def issuance_directory(lot):
+    """Répertoire des planches d'un lot"""
+    return os.path.join(settings.MEDIA_ROOT, 'emissions', str(lot.id))
+
+
+def reserve_serial_prefix(lot):
+    """Réserve au lot un préfixe de numéros de série inutilisé (contrainte d'unicité du lot)"""
+    if lot.prefixe_serie:
+        return lot.prefixe_serie
+    for _ in range(TENTATIVES_PREFIXE):
+        prefixe = secrets.token_hex(4).upper()
+        try:
+            with transaction.atomic():
+                if LotEmissionCartes.objects.filter(id=lot.id, prefixe_serie__isnull=True).update(prefixe_serie=prefixe):
+                    lot.prefixe_serie = prefixe
+                    return prefixe
+        except IntegrityError:
+            # Préfixe déjà réservé par un autre lot
+            continue
+        # Préfixe réservé entre-temps par une exécution concurrente du même lot
+        lot.refresh_from_db(fields=['prefixe_serie'])
+        return lot.prefixe_serie
+    raise RuntimeError("Impossible de réserver un préfixe de numéros de série")
+
+
+def serial_prefix(lot):
+    """Préfixe des numéros de série d'un lot, réservé par reserve_serial_prefix"""
+    return lot.prefixe_serie
+
+
+def serial_width(lot):
+    """Chiffres du rang dans les numéros de série d'un lot.
+
+    La largeur est fixe pour tout le lot : l'ordre des numéros de série est
+    celui des rangs, dont dépend la reprise d'un lot interrompu.
+    """
+    return max(6, len(str(lot.nombre)))
+
+
+def serial_block(lot, debut, nombre):
+    """Numéros de série des rangs [debut, debut + nombre) d'un lot"""
+    prefixe = serial_prefix(lot)
+    largeur = serial_width(lot)
+    return [f'{prefixe}{rang:0{largeur}d}' for rang in range(debut + 1, debut + nombre + 1)]
+
+
+def uid_block(nombre):
+    """UID uniques en base pour un bloc de cartes (7 octets, format des puces ISO 14443)"""
+    uids = set()
+    for _ in range(TENTATIVES_UID):
+        while len(uids) < nombre:
+            uids.add(secrets.token_hex(7).upper())
+        pris = set(CarteRFID.objects.filter(code_uid__in=uids).values_list('code_uid', flat=True))
+        if not pris:
+            return list(uids)
+        uids -= pris
+    raise RuntimeError("Impossible de générer des UID uniques")
+
+
+def build_cards(lot, numeros, uids):
+    """Cartes non enregistrées d'une tranche"""
+    return [
+        CarteRFID(
+            code_uid=code_uid,
+            entreprise_id=lot.entreprise_id,
+            lot_id=lot.id,
+            numero_serie=numero_serie,
+            type_carte=lot.type_carte,
+            plafond_quotidien=lot.plafond_quotidien,
+            plafond_mensuel=lot.plafond_mensuel,
+            solde_maximum=lot.solde_maximum,
+            date_expiration=lot.date_expiration,
+            lieu_emission=lot.lieu_emission,
+            agent_emission_id=lot.agent_emission_id,
+            version_securite=lot.version_securite,
+            cle_chiffrement=secrets.token_hex(32),
+        )
+        for numero_serie, code_uid in zip(numeros, uids)
+    ]
+
+
+def insert_chunk(lot, debut, nombre):
+    """Insère une tranche de cartes et retourne [(numéro de série, UID)]"""
+    numeros = serial_block(lot, debut, nombre)
+    for tentative in range(TENTATIVES_UID):
+        uids = uid_block(nombre)
+        try:
+            with transaction.atomic():
+                CarteRFID.objects.bulk_create(build_cards(lot, numeros, uids), batch_size=1000)
+                LotEmissionCartes.objects.filter(id=lot.id).update(cartes_creees=debut + nombre)
+        except IntegrityError:
+            # UID pris par une émission concurrente entre la vérification et l'insertion
+            if tentative == TENTATIVES_UID - 1:
+                raise
+            continue
+        return list(zip(numeros, uids))
+
+
+def issue_cards(lot, workers=None, progression=None):
+    """Émet les cartes d'un lot et rend ses planches ; reprend après la dernière tranche insérée.
+
+    workers=0 rend les planches dans le processus courant (processus qui
+    ne peut pas avoir d'enfants, comme un worker Celery en pool prefork).
+    """
+    config = settings.CARD_ISSUANCE
+    taille = config['TAILLE_TRANCHE']
+    dossier = issuance_directory(lot)
+
+    LotEmissionCartes.objects.filter(id=lot.id).update(statut='EN_COURS')
+    lot.refresh_from_db()
+    reserve_serial_prefix(lot)
+
+    # Cartes déjà insérées par une exécution interrompue : leurs planches sont rendues à nouveau
+    deja_creees = list(
+        CarteRFID.objects.filter(lot=lot).order_by('numero_serie').values_list('numero_serie', 'code_uid')
+    ) if lot.cartes_creees else []
+
+    def planche(numero, cartes):
+        return {
+            'chemin': os.path.join(dossier, f'planche_{numero:04d}.pdf'),
+            'titre': f'Lot {lot.id} - planche {numero}',
+            'cartes': cartes,
+        }
+
+    def tranches():
+        for i in range(0, len(deja_creees), taille):
+            yield planche(i // taille + 1, deja_creees[i:i + taille])
+        for debut in range(lot.cartes_creees, lot.nombre, taille):
+            cartes = insert_chunk(lot, debut, min(taille, lot.nombre - debut))
+            if progression:
+                progression(debut + len(cartes), lot.nombre)
+            yield planche(debut // taille + 1, cartes)
+
+    fichiers = []
+    try:
+        if workers == 0:
+            for contenu in tranches():
+                fichiers.append(render_sheet(contenu))
+        else:
+            # Les processus du pool n'ouvrent aucune connexion à la base
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+                rendus = [pool.submit(render_sheet, contenu) for contenu in tranches()]
+                fichiers = [rendu.result() for rendu in rendus]
+    except Exception as exc:
+        LotEmissionCartes.objects.filter(id=lot.id).update(statut='ECHEC', message_erreur=str(exc))
+        raise
+
+    LotEmissionCartes.objects.filter(id=lot.id).update(
+        statut='TERMINE',
+        fichiers=[os.path.relpath(fichier, settings.MEDIA_ROOT) for fichier in fichiers],
+        message_erreur='',
+        date_fin=timezone.now(),
+    )
+    lot.refresh_from_db()
+    return lot
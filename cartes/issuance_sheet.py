@@ -0,0 +1,76 @@
+import os
+import qrcode
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import mm
+from reportlab.pdfgen import canvas
+
+# Rendu des planches d'impression d'un lot de cartes (QR code, numéro de
+# série, UID), sans dépendance à Django : ce module est importé par les
+# processus du pool d'émission.
+
+COLONNES = 3
+LIGNES = 8
+LARGEUR_CELLULE = 63.5 * mm
+HAUTEUR_CELLULE = 33.9 * mm
+MARGE_GAUCHE = (A4[0] - COLONNES * LARGEUR_CELLULE) / 2
+MARGE_HAUT = 13 * mm
+TAILLE_QR = 24 * mm
+MARGE_QR = 5 * mm  # Zone de silence autour du QR code (4 modules)
+
+
+def qr_payload(numero_serie, code_uid):
+    """Contenu du QR code imprimé sur une carte"""
+    return f'RFID:{numero_serie}:{code_uid}'
+
+
+def draw_qr(pdf, contenu, x, y, taille):
+    """Dessine un QR code en vectoriel, une ligne de modules contigus par rectangle.
+
+    Le masque est fixé : le choix du meilleur des huit masques coûte plus
+    que tout le reste du rendu, pour un gain de lisibilité négligeable.
+    """
+    qr = qrcode.QRCode(border=0, mask_pattern=0)
+    qr.add_data(contenu)
+    qr.make(fit=True)
+    matrice = qr.get_matrix()
+    cote = len(matrice)
+    module = taille / cote
+
+    chemin = pdf.beginPath()
+    for ligne, modules in enumerate(matrice):
+        colonne = 0
+        while colonne < cote:
+            if not modules[colonne]:
+                colonne += 1
+                continue
+            fin = colonne
+            while fin < cote and modules[fin]:
+                fin += 1
+            chemin.rect(x + colonne * module, y + taille - (ligne + 1) * module, (fin - colonne) * module, module)
+            colonne = fin
+    pdf.drawPath(chemin, stroke=0, fill=1)
+
+
+def render_sheet(planche):
+    """Rend une planche PDF d'étiquettes (exécuté dans un processus du pool)"""
+    os.makedirs(os.path.dirname(planche['chemin']), exist_ok=True)
+    pdf = canvas.Canvas(planche['chemin'], pagesize=A4)
+    pdf.setTitle(planche['titre'])
+    hauteur = A4[1]
+    par_page = COLONNES * LIGNES
+
+    for i, (numero_serie, code_uid) in enumerate(planche['cartes']):
+        if i and i % par_page == 0:
+            pdf.showPage()
+        position = i % par_page
+        x = MARGE_GAUCHE + (position % COLONNES) * LARGEUR_CELLULE
+        y = hauteur - MARGE_HAUT - (position // COLONNES + 1) * HAUTEUR_CELLULE
+
+        draw_qr(pdf, qr_payload(numero_serie, code_uid), x + MARGE_QR, y + (HAUTEUR_CELLULE - TAILLE_QR) / 2, TAILLE_QR)
+        pdf.setFont('Helvetica-Bold', 8)
+        pdf.drawString(x + MARGE_QR + TAILLE_QR + 3 * mm, y + HAUTEUR_CELLULE / 2 + 2 * mm, numero_serie)
+        pdf.setFont('Helvetica', 7)
+        pdf.drawString(x + MARGE_QR + TAILLE_QR + 3 * mm, y + HAUTEUR_CELLULE / 2 - 3 * mm, f'UID {code_uid}')
+
+    pdf.save()
+    return planche['chemin']
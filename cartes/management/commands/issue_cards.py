@@ -0,0 +1,84 @@
+import time
+from datetime import date
+from decimal import Decimal, InvalidOperation
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from cartes.issuance import issue_cards
+from cartes.models import CarteRFID, LotEmissionCartes
+from identites.models import Entreprise
+
+
+class Command(BaseCommand):
+    help = "Émet un lot de cartes en masse et génère ses planches d'impression (QR codes)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--nombre', type=int, default=None, help='Nombre de cartes à émettre')
+        parser.add_argument('--entreprise', default=None, help="Identifiant de l'entreprise cliente")
+        parser.add_argument(
+            '--type-carte', default='ENTREPRISE', choices=[choix for choix, _ in CarteRFID.TYPE_CARTE_CHOICES]
+        )
+        parser.add_argument('--plafond-quotidien', default='1000')
+        parser.add_argument('--plafond-mensuel', default='10000')
+        parser.add_argument('--solde-maximum', default='50000')
+        parser.add_argument('--date-expiration', default=None, help='AAAA-MM-JJ (défaut: dans 5 ans)')
+        parser.add_argument('--lieu-emission', default='Siège')
+        parser.add_argument('--workers', type=int, default=None, help='Processus de rendu (défaut: nombre de CPU)')
+        parser.add_argument('--reprendre', default=None, help="Identifiant d'un lot interrompu à reprendre")
+
+    def handle(self, *args, **options):
+        if options['reprendre']:
+            try:
+                lot = LotEmissionCartes.objects.get(id=options['reprendre'])
+            except (LotEmissionCartes.DoesNotExist, ValueError):
+                raise CommandError(f"Lot {options['reprendre']} introuvable")
+        else:
+            lot = self.create_lot(options)
+
+        self.stdout.write(f'🪪 Émission du lot {lot.id}: {lot.nombre} cartes...')
+        debut = time.monotonic()
+        lot = issue_cards(
+            lot,
+            workers=options['workers'],
+            progression=lambda creees, total: self.stdout.write(f'  ... {creees}/{total} cartes insérées', ending='\r'),
+        )
+
+        self.stdout.write('')
+        for fichier in lot.fichiers:
+            self.stdout.write(f'  {fichier}')
+        self.stdout.write(self.style.SUCCESS(
+            f'✅ {lot.cartes_creees} cartes émises, {len(lot.fichiers)} planches en {time.monotonic() - debut:.1f}s'
+        ))
+
+    def create_lot(self, options):
+        if not options['nombre'] or options['nombre'] < 1:
+            raise CommandError('--nombre est requis pour un nouveau lot')
+        maximum = settings.CARD_ISSUANCE['NOMBRE_MAX']
+        if options['nombre'] > maximum:
+            raise CommandError(f'--nombre ne peut pas dépasser {maximum} cartes par lot')
+        try:
+            plafonds = {
+                champ: Decimal(options[champ])
+                for champ in ('plafond_quotidien', 'plafond_mensuel', 'solde_maximum')
+            }
+            date_expiration = (
+                date.fromisoformat(options['date_expiration']) if options['date_expiration']
+                else date.today().replace(year=date.today().year + 5)
+            )
+        except (InvalidOperation, ValueError) as exc:
+            raise CommandError(f'Paramètre invalide: {exc}')
+
+        entreprise = None
+        if options['entreprise']:
+            try:
+                entreprise = Entreprise.objects.get(id=options['entreprise'])
+            except (Entreprise.DoesNotExist, ValueError):
+                raise CommandError(f"Entreprise {options['entreprise']} introuvable")
+
+        return LotEmissionCartes.objects.create(
+            entreprise=entreprise,
+            nombre=options['nombre'],
+            type_carte=options['type_carte'],
+            date_expiration=date_expiration,
+            lieu_emission=options['lieu_emission'],
+            **plafonds,
+        )
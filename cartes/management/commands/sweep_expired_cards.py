@@ -0,0 +1,33 @@
+import time
+from datetime import date
+from django.core.management.base import BaseCommand, CommandError
+from cartes.expiry import expire_cards, notify_upcoming_expiries
+
+
+class Command(BaseCommand):
+    help = "Passe les cartes expirées au statut EXPIREE et prévient les titulaires des expirations prochaines"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--jour', default=None, help='Date de référence AAAA-MM-JJ (défaut: aujourd\'hui)')
+        parser.add_argument('--taille-tranche', type=int, default=None, help='Cartes par transaction')
+        parser.add_argument('--sans-preavis', action='store_true', help="N'envoie pas les préavis d'expiration")
+
+    def handle(self, *args, **options):
+        try:
+            jour = date.fromisoformat(options['jour']) if options['jour'] else None
+        except ValueError as exc:
+            raise CommandError(f'Paramètre invalide: {exc}')
+
+        self.stdout.write('⏳ Balayage des cartes expirées...')
+        debut = time.monotonic()
+        expirees = expire_cards(
+            jour=jour,
+            taille=options['taille_tranche'],
+            progression=lambda total: self.stdout.write(f'  ... {total} cartes expirées', ending='\r'),
+        )
+        self.stdout.write('')
+        self.stdout.write(self.style.SUCCESS(f'✅ {expirees} cartes expirées en {time.monotonic() - debut:.1f}s'))
+
+        if not options['sans_preavis']:
+            notifications = notify_upcoming_expiries(jour=jour, taille=options['taille_tranche'])
+            self.stdout.write(self.style.SUCCESS(f"📧 {notifications} préavis d'expiration envoyés"))
@@ -4,9 +4,8 @@ from django.db.models import JSONField
 from identites.models import Personne, Entreprise, Utilisateur
 
 # Ajouter ces imports en haut du fichier
-from django.db.models.signals import post_save, pre_save
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
-from django.utils import timezone
 
 
 class CarteRFID(models.Model):
@@ -41,6 +40,10 @@ class CarteRFID(models.Model):
     date_expiration = models.DateField()
     lieu_emission = models.CharField(max_length=255)
     agent_emission = models.ForeignKey(Utilisateur, on_delete=models.SET_NULL, null=True)
+    # Lot d'émission en masse (cartes.issuance), absent pour une carte émise à l'unité
+    lot = models.ForeignKey(
+        'LotEmissionCartes', on_delete=models.SET_NULL, null=True, blank=True, related_name='cartes'
+    )
     derniere_utilisation = models.DateTimeField(null=True, blank=True)
     nombre_transactions = models.IntegerField(default=0)
     version_securite = models.CharField(max_length=20)
@@ -48,14 +51,51 @@ class CarteRFID(models.Model):
     date_creation = models.DateTimeField(auto_now_add=True)
     date_modification = models.DateTimeField(auto_now=True)
 
+    # Champs dont la valeur chargée est gardée : leurs changements sont
+    # détectés à l'enregistrement sans relire la ligne
+    CHAMPS_SUIVIS = ['statut', 'motif_blocage']
+
     class Meta:
         db_table = 'cartes_rfid'
         verbose_name = 'Carte RFID'
         verbose_name_plural = 'Cartes RFID'
+        indexes = [
+            # Balayage des cartes expirées (cartes.expiry)
+            models.Index(fields=['statut', 'date_expiration']),
+        ]
 
     def __str__(self):
         return f"Carte {self.numero_serie}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.memoriser_valeurs()
+        return instance
+
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        self.memoriser_valeurs()
+
+    def memoriser_valeurs(self):
+        """Mémorise la valeur courante des champs suivis chargés"""
+        differes = self.get_deferred_fields()
+        self._valeurs_chargees = {
+            champ: getattr(self, champ) for champ in self.CHAMPS_SUIVIS if champ not in differes
+        }
+
+    def valeur_chargee(self, champ, defaut=None):
+        """Valeur d'un champ suivi au chargement (ou au dernier enregistrement)"""
+        return getattr(self, '_valeurs_chargees', {}).get(champ, defaut)
+
+    def champs_modifies(self):
+        """Champs suivis modifiés depuis le chargement : {champ: (ancienne valeur, nouvelle valeur)}"""
+        return {
+            champ: (ancienne, getattr(self, champ))
+            for champ, ancienne in getattr(self, '_valeurs_chargees', {}).items()
+            if getattr(self, champ) != ancienne
+        }
+
 
 class HistoriqueStatutsCarte(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -65,8 +105,8 @@ class HistoriqueStatutsCarte(models.Model):
     motif_changement = models.TextField()
     commentaire = models.TextField(blank=True)
     agent_modificateur = models.ForeignKey(Utilisateur, on_delete=models.SET_NULL, null=True)
-    adresse_ip = models.GenericIPAddressField()
-    user_agent = models.TextField()
+    adresse_ip = models.GenericIPAddressField(null=True, blank=True)
+    user_agent = models.TextField(blank=True)
     date_changement = models.DateTimeField(auto_now_add=True)
     donnees_supplementaires = JSONField(default=dict, blank=True)
 
@@ -74,49 +114,86 @@ class HistoriqueStatutsCarte(models.Model):
         db_table = 'historique_statuts_cartes'
         verbose_name = 'Historique Statut Carte'
         verbose_name_plural = 'Historiques Statuts Cartes'
+        indexes = [
+            models.Index(fields=['date_changement', 'id']),
+        ]
 
     def __str__(self):
         return f"Changement {self.ancien_statut} -> {self.nouveau_statut}"
 
 
+class LotEmissionCartes(models.Model):
+    """Émission en masse de cartes (commande issue_cards ou API)"""
+    STATUT_CHOICES = [
+        ('EN_ATTENTE', 'En attente'),
+        ('EN_COURS', 'En cours'),
+        ('TERMINE', 'Terminé'),
+        ('ECHEC', 'Échec'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    entreprise = models.ForeignKey(Entreprise, on_delete=models.CASCADE, null=True, blank=True)
+    nombre = models.IntegerField()
+    type_carte = models.CharField(max_length=20, choices=CarteRFID.TYPE_CARTE_CHOICES)
+    plafond_quotidien = models.DecimalField(max_digits=15, decimal_places=2)
+    plafond_mensuel = models.DecimalField(max_digits=15, decimal_places=2)
+    solde_maximum = models.DecimalField(max_digits=15, decimal_places=2)
+    date_expiration = models.DateField()
+    lieu_emission = models.CharField(max_length=255)
+    version_securite = models.CharField(max_length=20, default='1')
+    agent_emission = models.ForeignKey(Utilisateur, on_delete=models.SET_NULL, null=True, blank=True)
+    # Préfixe des numéros de série, réservé au démarrage de l'émission
+    prefixe_serie = models.CharField(max_length=8, unique=True, null=True, blank=True)
+    statut = models.CharField(max_length=20, choices=STATUT_CHOICES, default='EN_ATTENTE')
+    cartes_creees = models.IntegerField(default=0)
+    fichiers = JSONField(default=list, blank=True)
+    message_erreur = models.TextField(blank=True)
+    date_creation = models.DateTimeField(auto_now_add=True)
+    date_fin = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'lots_emission_cartes'
+        verbose_name = "Lot d'émission de cartes"
+        verbose_name_plural = "Lots d'émission de cartes"
+        indexes = [
+            models.Index(fields=['date_creation', 'id']),
+        ]
+
+    def __str__(self):
+        return f"Lot {self.id} - {self.nombre} cartes ({self.statut})"
+
+
 # Ajouter à la fin du fichier, après les classes existantes
 
 @receiver(pre_save, sender=CarteRFID)
-def carte_status_change_handler(sender, instance, **kwargs):
+def carte_status_change_handler(sender, instance, update_fields=None, **kwargs):
     """Gère les changements de statut des cartes"""
-    if instance.pk:  # Si la carte existe déjà
-        try:
-            old_instance = CarteRFID.objects.get(pk=instance.pk)
-            if old_instance.statut != instance.statut:
-                # Créer un historique de changement de statut
-                HistoriqueStatutsCarte.objects.create(
-                    carte=instance,
-                    ancien_statut=old_instance.statut,
-                    nouveau_statut=instance.statut,
-                    motif_changement=instance.motif_blocage or "Changement automatique",
-                    date_changement=timezone.now()
-                )
-                
-                # Notification asynchrone du changement
-                if instance.statut == 'BLOQUEE':
-                    from transactions.tasks import create_notification_task
-                    user_id = None
-                    if instance.personne:
-                        user = instance.personne.utilisateur_set.first()
-                        if user:
-                            user_id = str(user.id)
-                    elif instance.entreprise:
-                        user = instance.entreprise.utilisateur_set.first()
-                        if user:
-                            user_id = str(user.id)
-                    
-                    if user_id:
-                        create_notification_task.delay(
-                            user_id,
-                            'WARNING',
-                            'Carte bloquée',
-                            f'Votre carte {instance.numero_serie} a été bloquée. Motif: {instance.motif_blocage}',
-                            'SMS'
-                        )
-        except CarteRFID.DoesNotExist:
-            pass
+    if update_fields is not None and 'statut' not in update_fields:
+        return
+
+    ancien_statut = instance.valeur_chargee('statut')
+    if ancien_statut is None:
+        if instance._state.adding:
+            return  # Nouvelle carte
+        # Statut non chargé (queryset.only/defer) : seul cas où la ligne est relue
+        ancien_statut = CarteRFID.objects.filter(pk=instance.pk).values_list('statut', flat=True).first()
+        if ancien_statut is None:
+            return
+
+    if ancien_statut != instance.statut:
+        from .status import record_status_changes
+        # Historique et notification du changement, envoyée par l'outbox après le commit
+        record_status_changes([(instance, ancien_statut)])
+
+
+@receiver(post_save, sender=CarteRFID)
+def carte_snapshot_handler(sender, instance, **kwargs):
+    """Les valeurs enregistrées deviennent la référence des prochains changements"""
+    instance.memoriser_valeurs()
+
+
+@receiver([post_save, post_delete], sender=CarteRFID)
+def carte_cache_invalidation_handler(sender, instance, **kwargs):
+    """Invalide la projection en cache de la carte"""
+    from .cache import invalidate_card
+    invalidate_card(instance.code_uid)
@@ -1,5 +1,6 @@
+from django.conf import settings
 from rest_framework import serializers
-from .models import CarteRFID, HistoriqueStatutsCarte
+from .models import CarteRFID, HistoriqueStatutsCarte, LotEmissionCartes
 
 
 class CarteRFIDSerializer(serializers.ModelSerializer):
@@ -12,3 +13,33 @@ class HistoriqueStatutsCarteSerializer(serializers.ModelSerializer):
     class Meta:
         model = HistoriqueStatutsCarte
         fields = '__all__'
+
+
+class LotEmissionCartesSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = LotEmissionCartes
+        fields = '__all__'
+        read_only_fields = [
+            'agent_emission', 'prefixe_serie', 'statut', 'cartes_creees', 'fichiers', 'message_erreur', 'date_fin',
+        ]
+
+    def validate_nombre(self, value):
+        maximum = settings.CARD_ISSUANCE['NOMBRE_MAX']
+        if not 1 <= value <= maximum:
+            raise serializers.ValidationError(f'Le nombre de cartes doit être compris entre 1 et {maximum}')
+        return value
+
+
+class ChangementStatutMasseSerializer(serializers.Serializer):
+    """Changement de statut d'un ensemble de cartes, désignées par identifiants, entreprise ou lot d'émission"""
+    statut = serializers.ChoiceField(choices=CarteRFID.STATUT_CHOICES)
+    motif = serializers.CharField()
+    commentaire = serializers.CharField(required=False, allow_blank=True, default='')
+    cartes = serializers.ListField(child=serializers.UUIDField(), required=False, max_length=100000)
+    entreprise = serializers.UUIDField(required=False)
+    lot = serializers.UUIDField(required=False)
+
+    def validate(self, attrs):
+        if not any(attrs.get(champ) for champ in ('cartes', 'entreprise', 'lot')):
+            raise serializers.ValidationError('Désigner les cartes par cartes, entreprise ou lot')
+        return attrs
@@ -0,0 +1,141 @@
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from identites.models import Utilisateur
+from notifications.models import Notification
+from notifications.outbox import notifier
+from .cache import invalidate_cards
+from .models import CarteRFID, HistoriqueStatutsCarte
+
+# Changements de statut des cartes : historique et notifications des
+# titulaires, pour une carte (signal pre_save) comme pour un lot de cartes.
+# L'ancien statut vient des valeurs mémorisées au chargement de la carte
+# (CarteRFID.from_db) : aucune relecture de la ligne.
+
+MOTIF_DEFAUT = 'Changement automatique'
+TAILLE_UPDATE = 10000  # Cartes par UPDATE (limite des paramètres de requête)
+
+
+def owner_user_ids(cartes):
+    """Utilisateur titulaire de chaque carte : {carte_id: user_id}, en une requête"""
+    personnes = {carte.personne_id for carte in cartes if carte.personne_id}
+    entreprises = {carte.entreprise_id for carte in cartes if carte.entreprise_id}
+    if not personnes and not entreprises:
+        return {}
+
+    par_personne = {}
+    par_entreprise = {}
+    # Ordre décroissant : le premier utilisateur (plus petit identifiant) est retenu
+    for user_id, personne_id, entreprise_id in Utilisateur.objects.filter(
+        Q(personne_id__in=personnes) | Q(entreprise_id__in=entreprises)
+    ).order_by('-pk').values_list('id', 'personne_id', 'entreprise_id'):
+        if personne_id in personnes:
+            par_personne[personne_id] = str(user_id)
+        if entreprise_id in entreprises:
+            par_entreprise[entreprise_id] = str(user_id)
+
+    titulaires = {}
+    for carte in cartes:
+        user_id = par_personne.get(carte.personne_id) if carte.personne_id else par_entreprise.get(carte.entreprise_id)
+        if user_id:
+            titulaires[carte.id] = user_id
+    return titulaires
+
+
+def blocked_notifications(cartes):
+    """Une notification par titulaire pour ses cartes bloquées"""
+    titulaires = owner_user_ids(cartes)
+    par_titulaire = {}
+    for carte in cartes:
+        if carte.id in titulaires:
+            par_titulaire.setdefault(titulaires[carte.id], []).append(carte)
+
+    notifications = []
+    for user_id, cartes_titulaire in par_titulaire.items():
+        if len(cartes_titulaire) == 1:
+            carte = cartes_titulaire[0]
+            message = f'Votre carte {carte.numero_serie} a été bloquée. Motif: {carte.motif_blocage}'
+        else:
+            numeros = ', '.join(carte.numero_serie for carte in cartes_titulaire)
+            message = f'Vos cartes {numeros} ont été bloquées. Motif: {cartes_titulaire[0].motif_blocage}'
+        notifications.append(Notification(
+            destinataire_id=user_id,
+            type_notification='WARNING',
+            canal='SMS',
+            titre='Carte bloquée' if len(cartes_titulaire) == 1 else 'Cartes bloquées',
+            message=message,
+            priorite='NORMALE',
+        ))
+    return notifications
+
+
+def record_status_changes(changements, motif=None, commentaire='', agent=None, adresse_ip=None, user_agent=''):
+    """Historise des changements de statut et notifie les titulaires des cartes bloquées.
+
+    changements : liste de (carte, ancien statut), la carte portant son
+    nouveau statut. À appeler dans la transaction qui enregistre les cartes.
+    """
+    if not changements:
+        return []
+
+    now = timezone.now()
+    historique = HistoriqueStatutsCarte.objects.bulk_create([
+        HistoriqueStatutsCarte(
+            carte=carte,
+            ancien_statut=ancien_statut,
+            nouveau_statut=carte.statut,
+            motif_changement=motif or carte.motif_blocage or MOTIF_DEFAUT,
+            commentaire=commentaire,
+            agent_modificateur=agent,
+            adresse_ip=adresse_ip,
+            user_agent=user_agent,
+            date_changement=now,
+        )
+        for carte, ancien_statut in changements
+    ], batch_size=1000)
+
+    bloquees = [carte for carte, _ in changements if carte.statut == 'BLOQUEE']
+    if bloquees:
+        notifier(blocked_notifications(bloquees))
+    return historique
+
+
+def change_status(queryset, statut, motif, commentaire='', agent=None, adresse_ip=None, user_agent=''):
+    """Change le statut d'un ensemble de cartes de manière ensembliste.
+
+    Les cartes concernées sont verrouillées et lues une fois (colonnes
+    utiles uniquement), mises à jour par UPDATE sans passer par save(),
+    puis historisées en un bulk_create ; chaque titulaire reçoit une seule
+    notification pour toutes ses cartes. Retourne le nombre de cartes
+    modifiées.
+    """
+    with transaction.atomic():
+        cartes = list(
+            queryset.exclude(statut=statut).select_for_update(of=('self',)).only(
+                'id', 'code_uid', 'numero_serie', 'statut', 'motif_blocage', 'personne_id', 'entreprise_id'
+            ).order_by('id')
+        )
+        if not cartes:
+            return 0
+
+        now = timezone.now()
+        ids = [carte.id for carte in cartes]
+        for i in range(0, len(ids), TAILLE_UPDATE):
+            CarteRFID.objects.filter(id__in=ids[i:i + TAILLE_UPDATE]).update(
+                statut=statut, motif_blocage=motif, date_modification=now
+            )
+
+        changements = []
+        for carte in cartes:
+            changements.append((carte, carte.statut))
+            carte.statut = statut
+            carte.motif_blocage = motif
+            carte.memoriser_valeurs()
+        record_status_changes(
+            changements, motif=motif, commentaire=commentaire, agent=agent,
+            adresse_ip=adresse_ip, user_agent=user_agent,
+        )
+        # queryset.update n'émet pas de signal : invalidation explicite du cache des cartes
+        invalidate_cards(carte.code_uid for carte in cartes)
+
+    return len(cartes)
@@ -0,0 +1,44 @@
+from celery import shared_task
+from django.conf import settings
+import logging
+from .expiry import expire_cards, notify_upcoming_expiries
+from .issuance import issue_cards
+from .models import LotEmissionCartes
+
+logger = logging.getLogger(__name__)
+
+@shared_task
+def issue_cards_task(lot_id):
+    """Émet les cartes d'un lot demandé par l'API"""
+    try:
+        lot = LotEmissionCartes.objects.get(id=lot_id)
+        if lot.statut == 'TERMINE':
+            return f"Lot {lot_id} déjà émis"
+        
+        # Tâche routée vers le worker d'émission (pool solo) : elle s'exécute dans
+        # le processus principal du worker, qui peut lancer le pool de rendu
+        lot = issue_cards(lot, workers=settings.CARD_ISSUANCE['WORKERS'])
+        
+        logger.info(f"Lot {lot_id}: {lot.cartes_creees} cartes émises, {len(lot.fichiers)} planches")
+        return f"{lot.cartes_creees} cartes émises"
+        
+    except LotEmissionCartes.DoesNotExist:
+        logger.error(f"Lot d'émission {lot_id} introuvable")
+        return f"Lot {lot_id} introuvable"
+    except Exception as exc:
+        logger.error(f"Erreur lors de l'émission du lot {lot_id}: {exc}")
+        return f"Erreur: {exc}"
+
+@shared_task
+def sweep_expired_cards():
+    """Passe les cartes expirées au statut EXPIREE et prévient les titulaires des expirations prochaines"""
+    try:
+        expirees = expire_cards()
+        notifications = notify_upcoming_expiries()
+        
+        logger.info(f"{expirees} cartes expirées, {notifications} préavis d'expiration envoyés")
+        return f"{expirees} cartes expirées, {notifications} préavis"
+        
+    except Exception as exc:
+        logger.error(f"Erreur lors du balayage des cartes expirées: {exc}")
+        return f"Erreur: {exc}"
@@ -5,6 +5,7 @@ from . import views
 router = DefaultRouter()
 router.register(r'cartes', views.CarteRFIDViewSet)
 router.register(r'historique-statuts', views.HistoriqueStatutsCarteViewSet)
+router.register(r'lots-emission', views.LotEmissionCartesViewSet)
 
 urlpatterns = [
     path('', include(router.urls)),
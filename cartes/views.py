@@ -1,7 +1,17 @@
-from rest_framework import viewsets
+from django.conf import settings
+from django.db import transaction
+from rest_framework import mixins, status, viewsets
+from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
-from .models import CarteRFID, HistoriqueStatutsCarte
-from .serializers import CarteRFIDSerializer, HistoriqueStatutsCarteSerializer
+from rest_framework.response import Response
+from .cache import lookup_card
+from .status import change_status
+from notifications.outbox import publier
+from .models import CarteRFID, HistoriqueStatutsCarte, LotEmissionCartes
+from .serializers import (
+    CarteRFIDSerializer, ChangementStatutMasseSerializer, HistoriqueStatutsCarteSerializer, LotEmissionCartesSerializer
+)
+from rfid_system.pagination import KeysetPagination
 
 
 class CarteRFIDViewSet(viewsets.ModelViewSet):
@@ -9,8 +19,75 @@ class CarteRFIDViewSet(viewsets.ModelViewSet):
     serializer_class = CarteRFIDSerializer
     permission_classes = [IsAuthenticated]
 
+    @action(detail=False, methods=['get'], url_path=r'uid/(?P<code_uid>[^/]+)')
+    def par_uid(self, request, code_uid=None):
+        """Projection d'une carte lue au passage sur terminal, servie par le cache des cartes"""
+        projection = lookup_card(code_uid)
+        if projection is None:
+            return Response({'error': 'Carte inconnue'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(projection)
+
+    @action(detail=False, methods=['post'], url_path='changer-statut')
+    def changer_statut(self, request):
+        """Change le statut d'un ensemble de cartes (lot perdu, entreprise suspendue) en une opération"""
+        serializer = ChangementStatutMasseSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        donnees = serializer.validated_data
+
+        queryset = CarteRFID.objects.all()
+        if donnees.get('cartes'):
+            queryset = queryset.filter(id__in=donnees['cartes'])
+        if donnees.get('entreprise'):
+            queryset = queryset.filter(entreprise_id=donnees['entreprise'])
+        if donnees.get('lot'):
+            try:
+                lot = LotEmissionCartes.objects.get(id=donnees['lot'])
+            except LotEmissionCartes.DoesNotExist:
+                return Response({'error': "Lot d'émission introuvable"}, status=status.HTTP_404_NOT_FOUND)
+            queryset = queryset.filter(lot=lot)
+
+        modifiees = change_status(
+            queryset,
+            donnees['statut'],
+            donnees['motif'],
+            commentaire=donnees['commentaire'],
+            agent=request.user,
+            adresse_ip=self.get_client_ip(request),
+            user_agent=request.META.get('HTTP_USER_AGENT', ''),
+        )
+        return Response({
+            'message': f'{modifiees} cartes passées au statut {donnees["statut"]}',
+            'cartes_modifiees': modifiees,
+        })
+
+    def get_client_ip(self, request):
+        x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
+        if x_forwarded_for:
+            ip = x_forwarded_for.split(',')[0]
+        else:
+            ip = request.META.get('REMOTE_ADDR')
+        return ip
+
 
 class HistoriqueStatutsCarteViewSet(viewsets.ModelViewSet):
     queryset = HistoriqueStatutsCarte.objects.all()
     serializer_class = HistoriqueStatutsCarteSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
+    keyset_field = 'date_changement'
+
+
+class LotEmissionCartesViewSet(
+    mixins.CreateModelMixin, mixins.ListModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet
+):
+    queryset = LotEmissionCartes.objects.all()
+    serializer_class = LotEmissionCartesSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
+    keyset_field = 'date_creation'
+
+    def perform_create(self, serializer):
+        """Enregistre le lot et demande son émission, traitée en tâche de fond"""
+        with transaction.atomic():
+            lot = serializer.save(agent_emission=self.request.user)
+            publier('cartes.tasks.issue_cards_task', [str(lot.id)], file=settings.CARD_ISSUANCE['FILE'])
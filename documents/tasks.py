@@ -6,10 +6,11 @@ from PIL import Image
 import json
 import hashlib
 from .models import DocumentIdentite
+from logs.retry import retry_or_dead_letter
 
 logger = logging.getLogger(__name__)
 
-@shared_task(bind=True, max_retries=3)
+@shared_task(bind=True)
 def process_document_ocr(self, document_id):
     """Traite un document avec OCR pour extraire les données"""
     try:
@@ -72,18 +73,16 @@ def process_document_ocr(self, document_id):
     except Exception as exc:
         logger.error(f"Erreur lors du traitement OCR du document {document_id}: {exc}")
         
-        if self.request.retries < self.max_retries:
-            raise self.retry(countdown=60 * (2 ** self.request.retries), exc=exc)
-        else:
-            # Marquer comme rejeté après épuisement des tentatives
-            try:
-                document = DocumentIdentite.objects.get(id=document_id)
-                document.statut_verification = 'REJETE'
-                document.commentaire_verification = f"Erreur OCR: {exc}"
-                document.save()
-            except:
-                pass
-            return f"Échec définitif du traitement OCR après {self.max_retries} tentatives"
+        retry_or_dead_letter(self, exc)
+        # Marquer comme rejeté après épuisement des tentatives
+        try:
+            document = DocumentIdentite.objects.get(id=document_id)
+            document.statut_verification = 'REJETE'
+            document.commentaire_verification = f"Erreur OCR: {exc}"
+            document.save()
+        except:
+            pass
+        return f"Échec définitif du traitement OCR après {self.request.retries + 1} tentatives"
 
 def analyze_document_text(text, document_type):
     """Analyse le texte extrait selon le type de document"""
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import LogSysteme
+from .models import LogSysteme, TacheEchouee
 
 
 @admin.register(LogSysteme)
@@ -9,3 +9,12 @@ class LogSystemeAdmin(admin.ModelAdmin):
     search_fields = ['action', 'message', 'trace_id']
     readonly_fields = ['id', 'date_creation']
     date_hierarchy = 'date_creation'
+
+
+@admin.register(TacheEchouee)
+class TacheEchoueeAdmin(admin.ModelAdmin):
+    list_display = ['tache', 'exception', 'tentatives', 'statut', 'nombre_rejeux', 'date_echec']
+    list_filter = ['statut', 'tache', 'date_echec']
+    search_fields = ['tache', 'tache_id', 'message']
+    readonly_fields = ['id', 'date_echec']
+    date_hierarchy = 'date_echec'
@@ -0,0 +1,85 @@
+import time
+from celery import current_app
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import F
+from django.utils import timezone
+from logs.models import TacheEchouee
+
+
+class Command(BaseCommand):
+    help = 'Rejoue (ou abandonne) les tâches Celery en lettre morte, à débit contrôlé'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tache', default=None, help='Nom complet de la tâche (ex: transactions.tasks.process_transaction)')
+        parser.add_argument('--ids', nargs='+', default=None, help='Identifiants des lettres mortes à traiter')
+        parser.add_argument('--limite', type=int, default=1000, help='Nombre maximal de tâches traitées')
+        parser.add_argument('--debit', type=float, default=20.0, help='Tâches renvoyées par seconde (0: sans limite)')
+        parser.add_argument('--taille-lot', type=int, default=100, help='Tâches marquées rejouées par écriture')
+        parser.add_argument('--abandonner', action='store_true', help='Marque les tâches abandonnées sans les rejouer')
+        parser.add_argument('--dry-run', action='store_true', help='Liste les tâches sans les renvoyer')
+
+    def handle(self, *args, **options):
+        if options['debit'] < 0:
+            raise CommandError('Le débit doit être positif')
+
+        queryset = TacheEchouee.objects.filter(statut='EN_ATTENTE')
+        if options['tache']:
+            queryset = queryset.filter(tache=options['tache'])
+        if options['ids']:
+            queryset = queryset.filter(id__in=options['ids'])
+        taches = list(queryset.order_by('date_echec').values(
+            'id', 'tache', 'file', 'arguments', 'arguments_nommes'
+        )[:options['limite']])
+
+        if not taches:
+            self.stdout.write('Aucune tâche en lettre morte à traiter')
+            return
+
+        if options['dry_run']:
+            for tache in taches:
+                self.stdout.write(f"  {tache['id']} {tache['tache']} {tache['arguments']} {tache['arguments_nommes']}")
+            self.stdout.write(f'{len(taches)} tâches seraient traitées')
+            return
+
+        if options['abandonner']:
+            abandonnees = TacheEchouee.objects.filter(
+                id__in=[tache['id'] for tache in taches], statut='EN_ATTENTE'
+            ).update(statut='ABANDONNEE')
+            self.stdout.write(self.style.SUCCESS(f'🗑️ {abandonnees} tâches abandonnées'))
+            return
+
+        intervalle = 1 / options['debit'] if options['debit'] else 0
+        prochain_envoi = time.monotonic()
+        rejouees = []
+        total = 0
+        for tache in taches:
+            # Débit lissé : un envoi toutes les `intervalle` secondes
+            attente = prochain_envoi - time.monotonic()
+            if attente > 0:
+                time.sleep(attente)
+            prochain_envoi = max(prochain_envoi, time.monotonic()) + intervalle
+
+            current_app.send_task(
+                tache['tache'],
+                args=tache['arguments'],
+                kwargs=tache['arguments_nommes'],
+                queue=tache['file'] or None,
+            )
+            rejouees.append(tache['id'])
+            if len(rejouees) >= options['taille_lot']:
+                total += self.mark_replayed(rejouees)
+                rejouees = []
+                self.stdout.write(f'  ... {total} rejouées', ending='\r')
+        total += self.mark_replayed(rejouees)
+
+        self.stdout.write(self.style.SUCCESS(f'🔁 {total} tâches rejouées'))
+
+    def mark_replayed(self, ids):
+        """Marque un lot de tâches rejouées en une seule écriture"""
+        if not ids:
+            return 0
+        return TacheEchouee.objects.filter(id__in=ids).update(
+            statut='REJOUEE',
+            nombre_rejeux=F('nombre_rejeux') + 1,
+            date_rejeu=timezone.now(),
+        )
@@ -30,7 +30,7 @@ class LogSysteme(models.Model):
     donnees_avant = JSONField(default=dict, blank=True)
     donnees_apres = JSONField(default=dict, blank=True)
     duree_execution = models.IntegerField(null=True, blank=True)  # en millisecondes
-    code_retour = models.CharField(max_length=20, blank=True)
+    code_retour = models.CharField(max_length=50, blank=True)
     erreur_details = models.TextField(blank=True)
     date_creation = models.DateTimeField(auto_now_add=True)
     serveur_origine = models.CharField(max_length=100, blank=True)
@@ -44,7 +44,44 @@ class LogSysteme(models.Model):
             models.Index(fields=['niveau', 'date_creation']),
             models.Index(fields=['utilisateur', 'date_creation']),
             models.Index(fields=['action', 'date_creation']),
+            models.Index(fields=['date_creation', 'id']),
         ]
 
     def __str__(self):
         return f"{self.niveau} - {self.action} - {self.date_creation}"
+
+
+class TacheEchouee(models.Model):
+    """Tâche Celery arrivée au bout de ses tentatives (file de lettres mortes)"""
+    STATUT_CHOICES = [
+        ('EN_ATTENTE', 'En attente'),
+        ('REJOUEE', 'Rejouée'),
+        ('ABANDONNEE', 'Abandonnée'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    tache = models.CharField(max_length=255)
+    tache_id = models.CharField(max_length=255)
+    file = models.CharField(max_length=255, blank=True)
+    arguments = JSONField(default=list, blank=True)
+    arguments_nommes = JSONField(default=dict, blank=True)
+    exception = models.CharField(max_length=255)
+    message = models.TextField(blank=True)
+    trace = models.TextField(blank=True)
+    tentatives = models.IntegerField(default=0)
+    date_premier_echec = models.DateTimeField(null=True, blank=True)
+    date_echec = models.DateTimeField(auto_now_add=True)
+    statut = models.CharField(max_length=20, choices=STATUT_CHOICES, default='EN_ATTENTE')
+    nombre_rejeux = models.IntegerField(default=0)
+    date_rejeu = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'taches_echouees'
+        verbose_name = 'Tâche échouée'
+        verbose_name_plural = 'Tâches échouées'
+        indexes = [
+            models.Index(fields=['statut', 'tache', 'date_echec']),
+        ]
+
+    def __str__(self):
+        return f"{self.tache} ({self.tache_id}) - {self.statut}"
@@ -0,0 +1,81 @@
+import logging
+import random
+import time
+import traceback
+from datetime import datetime, timezone as dt_timezone
+from django.conf import settings
+from django.core.cache import cache
+from .models import TacheEchouee
+
+# Politique de nouvelles tentatives commune aux tâches Celery.
+#
+# Le délai suit un « decorrelated jitter » : chaque délai est tiré au hasard
+# entre le délai de base et trois fois le délai précédent, plafonné. Les
+# tâches échouées ensemble (panne d'un fournisseur, de la base) ne sont donc
+# pas relancées ensemble. Le délai précédent et l'heure du premier échec
+# sont gardés dans le cache, par identifiant de tâche (inchangé d'une
+# tentative à l'autre). Chaque tâche a un budget : un nombre de tentatives
+# et une durée totale. Au-delà, la tâche est enregistrée dans la table des
+# lettres mortes (TacheEchouee) pour être rejouée plus tard.
+
+logger = logging.getLogger(__name__)
+
+
+def retry_policy(nom_tache):
+    """Politique d'une tâche, complétée par la politique par défaut"""
+    politiques = settings.TASK_RETRY_POLICIES
+    return {**politiques['DEFAUT'], **politiques.get(nom_tache, {})}
+
+
+def next_delay(politique, delai_precedent):
+    """Délai avant la prochaine tentative (decorrelated jitter)"""
+    return min(politique['PLAFOND'], random.uniform(politique['BASE'], delai_precedent * 3))
+
+
+def retry_or_dead_letter(task, exc):
+    """À appeler dans le bloc except d'une tâche liée (bind=True).
+
+    Lève l'exception Retry de Celery tant que le budget de la tâche le
+    permet ; sinon enregistre la tâche en lettre morte et rend la main pour
+    que la tâche applique son traitement d'échec définitif.
+    """
+    politique = retry_policy(task.name)
+    cle = f'retry:{task.request.id}'
+    etat = cache.get(cle) or {'delai': politique['BASE'], 'premier_echec': time.time()}
+    ecoule = time.time() - etat['premier_echec']
+
+    if task.request.retries < politique['TENTATIVES'] and ecoule < politique['BUDGET']:
+        delai = next_delay(politique, etat['delai'])
+        cache.set(
+            cle, {'delai': delai, 'premier_echec': etat['premier_echec']},
+            timeout=int(politique['BUDGET'] + politique['PLAFOND'])
+        )
+        raise task.retry(countdown=delai, exc=exc, max_retries=politique['TENTATIVES'])
+
+    cache.delete(cle)
+    record_dead_letter(task, exc, premier_echec=etat['premier_echec'])
+
+
+def record_dead_letter(task, exc, premier_echec=None):
+    """Enregistre une tâche arrivée au bout de ses tentatives"""
+    try:
+        delivery_info = task.request.delivery_info or {}
+        TacheEchouee.objects.create(
+            tache=task.name,
+            tache_id=task.request.id or '',
+            file=delivery_info.get('routing_key') or '',
+            arguments=list(task.request.args or []),
+            arguments_nommes=dict(task.request.kwargs or {}),
+            exception=type(exc).__name__,
+            message=str(exc),
+            trace=''.join(traceback.format_exception(type(exc), exc, exc.__traceback__)),
+            tentatives=task.request.retries + 1,
+            date_premier_echec=(
+                datetime.fromtimestamp(premier_echec, tz=dt_timezone.utc) if premier_echec else None
+            ),
+        )
+    except Exception as erreur:
+        # L'enregistrement ne doit pas masquer l'échec d'origine
+        logger.error(f"Impossible d'enregistrer la tâche {task.name} en lettre morte: {erreur}")
+    else:
+        logger.warning(f"Tâche {task.name} ({task.request.id}) en lettre morte après {task.request.retries + 1} tentatives")
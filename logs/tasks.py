@@ -7,6 +7,7 @@ import json
 from .models import LogSysteme
 from cartes.models import CarteRFID
 from transactions.models import Transaction
+from transactions.periods import day_bounds
 
 logger = logging.getLogger(__name__)
 
@@ -16,10 +17,13 @@ def generate_daily_reports():
     try:
         today = timezone.now().date()
         yesterday = today - timedelta(days=1)
+        # Intervalle sur la colonne brute : usage des index
+        debut, fin = day_bounds(yesterday)
         
         # Statistiques des transactions
         daily_transactions = Transaction.objects.filter(
-            date_transaction__date=yesterday
+            date_transaction__gte=debut,
+            date_transaction__lt=fin
         ).aggregate(
             total_count=Count('id'),
             validated_count=Count('id', filter=Q(statut='VALIDEE')),
@@ -32,7 +36,8 @@ def generate_daily_reports():
         
         # Statistiques des logs
         error_logs = LogSysteme.objects.filter(
-            date_creation__date=yesterday,
+            date_creation__gte=debut,
+            date_creation__lt=fin,
             niveau__in=['ERROR', 'CRITICAL']
         ).count()
         
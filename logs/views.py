@@ -2,9 +2,12 @@ from rest_framework import viewsets
 from rest_framework.permissions import IsAuthenticated
 from .models import LogSysteme
 from .serializers import LogSystemeSerializer
+from rfid_system.pagination import KeysetPagination
 
 
 class LogSystemeViewSet(viewsets.ModelViewSet):
     queryset = LogSysteme.objects.all()
     serializer_class = LogSystemeSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
+    keyset_field = 'date_creation'
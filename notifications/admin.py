@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Notification
+from .models import EvenementSortant, Notification
 
 
 @admin.register(Notification)
@@ -9,3 +9,12 @@ class NotificationAdmin(admin.ModelAdmin):
     search_fields = ['titre', 'message', 'destinataire__username']
     readonly_fields = ['id', 'date_creation']
     date_hierarchy = 'date_creation'
+
+
+@admin.register(EvenementSortant)
+class EvenementSortantAdmin(admin.ModelAdmin):
+    list_display = ['tache', 'file', 'statut', 'tentatives', 'date_creation']
+    list_filter = ['statut', 'tache']
+    search_fields = ['tache', 'derniere_erreur']
+    readonly_fields = ['id', 'date_creation']
+    date_hierarchy = 'date_creation'
@@ -0,0 +1,37 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from notifications.outbox import relay_outbox
+
+
+class Command(BaseCommand):
+    help = "Relais de l'outbox : publie sur le broker les tâches écrites par les transactions validées"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--taille-lot', type=int, default=None, help='Événements publiés par lot')
+        parser.add_argument('--intervalle', type=float, default=None, help='Secondes entre deux lectures quand l\'outbox est vide')
+        parser.add_argument('--une-fois', action='store_true', help="Vide l'outbox puis s'arrête")
+
+    def handle(self, *args, **options):
+        taille_lot = options['taille_lot'] or settings.OUTBOX['TAILLE_LOT']
+        intervalle = options['intervalle'] if options['intervalle'] is not None else settings.OUTBOX['INTERVALLE']
+        self.stdout.write(f"📤 Relais de l'outbox (lots de {taille_lot}, Ctrl+C pour arrêter)")
+
+        total = 0
+        try:
+            while True:
+                publies, echecs = relay_outbox(taille_lot)
+                total += publies
+                if publies:
+                    self.stdout.write(f'  ... {total} événements publiés', ending='\r')
+                if echecs:
+                    self.stdout.write(self.style.WARNING(f'  {echecs} événements abandonnés après trop de tentatives'))
+                if publies < taille_lot:
+                    # Outbox vide (ou broker indisponible) : on attend avant de relire
+                    if options['une_fois']:
+                        break
+                    time.sleep(intervalle)
+        except KeyboardInterrupt:
+            pass
+
+        self.stdout.write(self.style.SUCCESS(f'✅ {total} événements publiés'))
@@ -61,3 +61,32 @@ class Notification(models.Model):
 
     def __str__(self):
         return f"{self.titre} - {self.destinataire.username}"
+
+
+class EvenementSortant(models.Model):
+    """Tâche Celery à publier, écrite dans la transaction qui la déclenche (outbox)"""
+    STATUT_CHOICES = [
+        ('EN_ATTENTE', 'En attente'),
+        ('ECHEC', 'Échec'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    tache = models.CharField(max_length=255)
+    arguments = JSONField(default=list, blank=True)
+    arguments_nommes = JSONField(default=dict, blank=True)
+    file = models.CharField(max_length=255, blank=True)
+    statut = models.CharField(max_length=20, choices=STATUT_CHOICES, default='EN_ATTENTE')
+    tentatives = models.IntegerField(default=0)
+    derniere_erreur = models.TextField(blank=True)
+    date_creation = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'evenements_sortants'
+        verbose_name = 'Événement sortant'
+        verbose_name_plural = 'Événements sortants'
+        indexes = [
+            models.Index(fields=['statut', 'date_creation']),
+        ]
+
+    def __str__(self):
+        return f"{self.tache} - {self.statut}"
@@ -0,0 +1,99 @@
+import logging
+from celery import current_app
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from .models import EvenementSortant, Notification
+
+# Outbox transactionnelle : au lieu d'appeler .delay() pendant une
+# transaction (verrous tenus pendant l'appel au broker, tâche publiée même
+# si la transaction est annulée), on écrit une ligne dans la même
+# transaction. Un relais lit les lignes par lots (FOR UPDATE SKIP LOCKED,
+# plusieurs relais possibles) et les publie sur une seule connexion au
+# broker. Livraison « au moins une fois » : une tâche peut être publiée
+# deux fois si le relais s'arrête entre la publication et le commit.
+
+logger = logging.getLogger(__name__)
+
+TACHES_ENVOI = {
+    'EMAIL': 'notifications.tasks.send_email_notification',
+    'SMS': 'notifications.tasks.send_sms_notification',
+    'PUSH': 'notifications.tasks.send_push_notification',
+}
+
+
+def evenement(tache, args=None, kwargs=None, file=''):
+    """Construit un événement sortant, sans l'écrire"""
+    return EvenementSortant(tache=tache, arguments=list(args or []), arguments_nommes=kwargs or {}, file=file)
+
+
+def publier(tache, args=None, kwargs=None, file=''):
+    """Publie une tâche au commit de la transaction en cours"""
+    return publier_lot([evenement(tache, args, kwargs, file)])
+
+
+def publier_lot(evenements):
+    """Écrit un lot d'événements sortants en une requête"""
+    return EvenementSortant.objects.bulk_create(evenements)
+
+
+def notifier(notifications):
+    """Crée des notifications et publie leur envoi dans la transaction en cours.
+
+    notifications : liste de Notification non enregistrées. Les
+    notifications internes ne sont pas publiées.
+    """
+    Notification.objects.bulk_create(notifications)
+    publier_lot([
+        evenement(TACHES_ENVOI[notification.canal], [str(notification.id)])
+        for notification in notifications if notification.canal in TACHES_ENVOI
+    ])
+    return notifications
+
+
+def relay_outbox(taille_lot=None):
+    """Publie un lot d'événements en attente ; retourne (publiés, en échec)"""
+    config = settings.OUTBOX
+    taille_lot = taille_lot or config['TAILLE_LOT']
+
+    with transaction.atomic():
+        evenements = list(
+            EvenementSortant.objects.select_for_update(skip_locked=True).filter(
+                statut='EN_ATTENTE'
+            ).order_by('date_creation')[:taille_lot]
+        )
+        if not evenements:
+            return 0, 0
+
+        publies = []
+        erreur = None
+        with current_app.producer_or_acquire() as producer:
+            for evenement_sortant in evenements:
+                try:
+                    current_app.send_task(
+                        evenement_sortant.tache,
+                        args=evenement_sortant.arguments,
+                        kwargs=evenement_sortant.arguments_nommes,
+                        queue=evenement_sortant.file or None,
+                        producer=producer,
+                    )
+                except Exception as exc:
+                    # Broker indisponible : le reste du lot attend le prochain passage
+                    erreur = exc
+                    break
+                publies.append(evenement_sortant.id)
+
+        EvenementSortant.objects.filter(id__in=publies).delete()
+
+        echecs = 0
+        if erreur is not None:
+            restants = [e.id for e in evenements[len(publies):]]
+            EvenementSortant.objects.filter(id__in=restants).update(
+                tentatives=F('tentatives') + 1, derniere_erreur=str(erreur)
+            )
+            echecs = EvenementSortant.objects.filter(
+                id__in=restants, tentatives__gte=config['TENTATIVES_MAX']
+            ).update(statut='ECHEC')
+            logger.warning(f"Relais de l'outbox interrompu après {len(publies)} publications: {erreur}")
+
+    return len(publies), echecs
@@ -6,10 +6,12 @@ from datetime import timedelta
 import logging
 import requests
 from .models import Notification
+from .outbox import relay_outbox
+from logs.retry import retry_or_dead_letter
 
 logger = logging.getLogger(__name__)
 
-@shared_task(bind=True, max_retries=3)
+@shared_task(bind=True)
 def send_email_notification(self, notification_id):
     """Envoie une notification par email"""
     try:
@@ -50,14 +52,12 @@ def send_email_notification(self, notification_id):
         notification.tentatives_envoi += 1
         notification.save()
         
-        if self.request.retries < self.max_retries:
-            raise self.retry(countdown=60 * (2 ** self.request.retries), exc=exc)
-        else:
-            notification.statut = 'ECHEC'
-            notification.save()
-            return f"Échec définitif de l'envoi après {self.max_retries} tentatives"
+        retry_or_dead_letter(self, exc)
+        notification.statut = 'ECHEC'
+        notification.save()
+        return f"Échec définitif de l'envoi après {self.request.retries + 1} tentatives"
 
-@shared_task(bind=True, max_retries=3)
+@shared_task(bind=True)
 def send_sms_notification(self, notification_id):
     """Envoie une notification par SMS via Twilio"""
     try:
@@ -103,12 +103,10 @@ def send_sms_notification(self, notification_id):
         notification.tentatives_envoi += 1
         notification.save()
         
-        if self.request.retries < self.max_retries:
-            raise self.retry(countdown=60 * (2 ** self.request.retries), exc=exc)
-        else:
-            notification.statut = 'ECHEC'
-            notification.save()
-            return f"Échec définitif de l'envoi après {self.max_retries} tentatives"
+        retry_or_dead_letter(self, exc)
+        notification.statut = 'ECHEC'
+        notification.save()
+        return f"Échec définitif de l'envoi après {self.request.retries + 1} tentatives"
 
 @shared_task
 def send_push_notification(notification_id):
@@ -178,3 +176,19 @@ def process_notification_queue():
     except Exception as exc:
         logger.error(f"Erreur lors du traitement des notifications: {exc}")
         return f"Erreur: {exc}"
+
+@shared_task
+def relay_outbox_task():
+    """Publie les événements en attente de l'outbox jusqu'à la vider (relais de secours du beat)"""
+    try:
+        total = 0
+        while True:
+            publies, echecs = relay_outbox()
+            total += publies
+            if echecs or publies < settings.OUTBOX['TAILLE_LOT']:
+                break
+        return f"{total} événements publiés"
+        
+    except Exception as exc:
+        logger.error(f"Erreur lors du relais de l'outbox: {exc}")
+        return f"Erreur: {exc}"
@@ -0,0 +1,58 @@
+import time
+import uuid
+from django.core.cache import cache
+from .models import ParametreSysteme
+
+# Les paramètres d'une catégorie sont gardés en mémoire dans chaque
+# processus. Une modification change la version partagée dans le cache ;
+# chaque processus la relit au plus toutes les RELECTURE secondes et
+# recharge ses catégories si elle a changé.
+
+VERSION_KEY = 'parametres:version'
+RELECTURE = 5  # Secondes entre deux vérifications de la version
+
+_categories = {}  # categorie -> (version, valeurs)
+_version = {'valeur': None, 'verifiee_a': 0.0}
+
+
+def parametres_version():
+    """Version courante des paramètres, relue dans le cache au plus toutes les RELECTURE secondes"""
+    maintenant = time.monotonic()
+    if maintenant - _version['verifiee_a'] >= RELECTURE:
+        version = cache.get(VERSION_KEY)
+        if version is None:
+            version = uuid.uuid4().hex
+            cache.add(VERSION_KEY, version, timeout=None)
+            version = cache.get(VERSION_KEY, version)
+        _version.update(valeur=version, verifiee_a=maintenant)
+    return _version['valeur']
+
+
+def get_parametres(categorie):
+    """Valeurs typées des paramètres d'une catégorie, indexées par clé"""
+    version = parametres_version()
+    en_memoire = _categories.get(categorie)
+    if en_memoire is not None and en_memoire[0] == version:
+        return en_memoire[1]
+
+    valeurs = load_parametres(categorie)
+    _categories[categorie] = (version, valeurs)
+    return valeurs
+
+
+def load_parametres(categorie):
+    """Valeurs typées des paramètres d'une catégorie, lues en base sans passer par le cache"""
+    valeurs = {}
+    for parametre in ParametreSysteme.objects.filter(categorie=categorie):
+        try:
+            valeurs[parametre.cle] = parametre.valeur_typee()
+        except (ValueError, TypeError, ArithmeticError):
+            # Valeur mal saisie : le défaut du code s'applique
+            continue
+    return valeurs
+
+
+def invalidate_parametres():
+    """Publie une nouvelle version des paramètres"""
+    cache.set(VERSION_KEY, uuid.uuid4().hex, timeout=None)
+    _version['verifiee_a'] = 0.0
@@ -1,5 +1,10 @@
+import json
 import uuid
+from datetime import date, datetime
+from decimal import Decimal
 from django.db import models
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from identites.models import Utilisateur
 
 
@@ -37,3 +42,27 @@ class ParametreSysteme(models.Model):
 
     def __str__(self):
         return f"{self.cle} = {self.valeur}"
+
+    def valeur_typee(self):
+        """Retourne la valeur convertie selon type_valeur"""
+        valeur = self.valeur if self.valeur != '' else self.valeur_par_defaut
+        if self.type_valeur == 'INTEGER':
+            return int(valeur)
+        if self.type_valeur == 'DECIMAL':
+            return Decimal(valeur)
+        if self.type_valeur == 'BOOLEAN':
+            return valeur.strip().lower() in ('1', 'true', 'oui', 'vrai')
+        if self.type_valeur == 'JSON':
+            return json.loads(valeur)
+        if self.type_valeur == 'DATE':
+            return date.fromisoformat(valeur)
+        if self.type_valeur == 'DATETIME':
+            return datetime.fromisoformat(valeur)
+        return valeur
+
+
+@receiver([post_save, post_delete], sender=ParametreSysteme)
+def parametre_change_handler(sender, instance, **kwargs):
+    """Invalide les paramètres mis en cache par les processus"""
+    from .cache import invalidate_parametres
+    invalidate_parametres()
@@ -0,0 +1,124 @@
+import base64
+import json
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """Pagination par curseur sur (date, id), sans COUNT(*) ni OFFSET.
+
+    La vue déclare le champ date avec l'attribut keyset_field ; un index
+    composite (date, id) doit exister sur la table : les pages profondes
+    le parcourent à partir du curseur. Le total exact n'est
+    pas calculé : ?estimate_count=1 renvoie l'estimation du planificateur.
+    """
+    page_size = settings.REST_FRAMEWORK['PAGE_SIZE']
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Curseur invalide.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.field = getattr(view, 'keyset_field', 'date_creation')
+        page_size = self.get_page_size(request)
+
+        queryset = queryset.order_by(f'-{self.field}', '-id')
+        self.estimated_count = None
+        if request.query_params.get('estimate_count') in ('1', 'true'):
+            self.estimated_count = estimate_count(queryset)
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            date, pk = self.decode_cursor(cursor)
+            try:
+                pk = queryset.model._meta.pk.to_python(pk)
+            except ValidationError:
+                raise NotFound(self.invalid_cursor_message)
+            # (date, id) < (curseur) ; la borne date <= curseur, redondante, donne
+            # au planificateur un intervalle sur l'index (date, id) que le OR seul
+            # ne permet pas d'exploiter
+            queryset = queryset.filter(
+                Q(**{f'{self.field}__lte': date}),
+                Q(**{f'{self.field}__lt': date}) | Q(**{self.field: date, 'id__lt': pk}),
+            )
+
+        rows = list(queryset[:page_size + 1])
+        self.has_next = len(rows) > page_size
+        self.page = rows[:page_size]
+        return self.page
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        last = self.page[-1]
+        cursor = self.encode_cursor(getattr(last, self.field), last.pk)
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        payload = {'next': self.get_next_link()}
+        if self.estimated_count is not None:
+            payload['count_estime'] = self.estimated_count
+        payload['results'] = data
+        return Response(payload)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'count_estime': {'type': 'integer'},
+                'results': schema,
+            },
+        }
+
+    def encode_cursor(self, date, pk):
+        position = json.dumps({'d': date.isoformat(), 'i': str(pk)})
+        return base64.urlsafe_b64encode(position.encode()).decode()
+
+    def decode_cursor(self, cursor):
+        try:
+            position = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+            date = parse_datetime(position['d'])
+            pk = position['i']
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        if date is None:
+            raise NotFound(self.invalid_cursor_message)
+        return date, pk
+
+
+def estimate_count(queryset):
+    """Nombre de lignes estimé par le planificateur PostgreSQL, None si indisponible"""
+    if connection.vendor != 'postgresql':
+        return None
+    try:
+        if not queryset.query.where:
+            # Table entière : statistiques de pg_class
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT reltuples::bigint FROM pg_class WHERE relname = %s',
+                    [queryset.model._meta.db_table]
+                )
+                row = cursor.fetchone()
+            return max(row[0], 0) if row else None
+        plan = json.loads(queryset.order_by().explain(format='json'))
+        if isinstance(plan, list):
+            plan = plan[0]
+        return plan['Plan']['Plan Rows']
+    except Exception:
+        return None
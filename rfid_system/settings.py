@@ -187,6 +187,15 @@ CORS_ALLOW_ALL_ORIGINS = DEBUG  # Only in development
 
 # Configuration Celery
 REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+REDIS_CACHE_URL = os.getenv('REDIS_CACHE_URL', 'redis://localhost:6379/1')
+
+# Cache partagé (métriques, compteurs)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_CACHE_URL,
+    }
+}
 
 # Configuration Celery
 CELERY_BROKER_URL = REDIS_URL
@@ -208,6 +217,165 @@ CELERY_BEAT_SCHEDULE = {
         'task': 'logs.tasks.generate_daily_reports',
         'schedule': 86400.0,  # Tous les jours
     },
+    'reconcile-balances': {
+        'task': 'transactions.tasks.reconcile_balances',
+        'schedule': 86400.0,  # Tous les jours
+    },
+    'detect-impossible-travel': {
+        'task': 'transactions.tasks.detect_impossible_travel_task',
+        'schedule': 86400.0,  # Tous les jours
+    },
+    'refresh-merchant-rollups': {
+        'task': 'transactions.tasks.refresh_merchant_rollups',
+        'schedule': 300.0,  # Toutes les 5 minutes
+    },
+    'verify-pending-recharges': {
+        'task': 'transactions.tasks.verify_pending_recharges',
+        'schedule': 60.0,  # Toutes les minutes
+    },
+    'sweep-expired-cards': {
+        'task': 'cartes.tasks.sweep_expired_cards',
+        'schedule': 86400.0,  # Tous les jours (les préavis ne portent que sur le jour exact)
+    },
+    'flush-card-usage': {
+        'task': 'transactions.tasks.flush_card_usage',
+        'schedule': 30.0,  # Toutes les 30 secondes
+    },
+    'relay-outbox': {
+        'task': 'notifications.tasks.relay_outbox_task',
+        'schedule': 10.0,  # Toutes les 10 secondes, en secours de la commande relay_outbox
+    },
+    'ensure-transaction-partitions': {
+        'task': 'transactions.tasks.ensure_transaction_partitions',
+        'schedule': 86400.0,  # Tous les jours
+    },
+}
+
+# Mode d'autorisation des transactions de terminal : ASYNC (Celery) ou INLINE (synchrone)
+# Peut être surchargé par requête avec ?mode=inline
+TRANSACTION_AUTHORIZATION_MODE = os.getenv('TRANSACTION_AUTHORIZATION_MODE', 'ASYNC')
+
+# Nombre maximal de transactions par requête d'ingestion hors ligne
+TRANSACTION_INGESTION_MAX = int(os.getenv('TRANSACTION_INGESTION_MAX', '1000'))
+
+# Files de traitement par carte : chaque file est consommée par un worker de concurrence 1
+TRANSACTION_LANES = {
+    'NOMBRE': int(os.getenv('TRANSACTION_LANES', '8')),
+    'PREFIXE_FILE': 'transactions.lane',
+}
+
+# Traitement par lots des transactions en attente (FOR UPDATE SKIP LOCKED)
+TRANSACTION_BATCH = {
+    'TAILLE_LOT': int(os.getenv('TRANSACTION_BATCH_SIZE', '50')),
+    'TAILLE_LOT_MAX': int(os.getenv('TRANSACTION_BATCH_MAX_SIZE', '1000')),
+    'FACTEUR_DRAIN': 10,  # Mode drain au-delà de TAILLE_LOT * FACTEUR_DRAIN transactions en attente
+    'WORKERS_DRAIN': int(os.getenv('TRANSACTION_DRAIN_WORKERS', '4')),
+    'DUREE_MAX': 240,  # Secondes par tâche de drain, inférieur à l'intervalle du beat
+    'DELAI_MIN': 30,  # Secondes laissées à la tâche unitaire avant reprise par lot
+    'FENETRE_JOURS': 35,  # Ancienneté maximale reprise, borne basse de l'intervalle parcouru
+}
+
+# Partitions mensuelles de la table des transactions (commande partition_transactions, PostgreSQL)
+TRANSACTION_PARTITIONS = {
+    'MOIS_AVANCE': 3,  # Mois créés à l'avance par la tâche ensure_transaction_partitions
+}
+
+# Scoring de fraude avant débit : fenêtres glissantes dans Redis (REDIS) ou en mémoire (LOCAL)
+# Les règles sont des paramètres système de la catégorie FRAUDE
+FRAUD_DETECTION = {
+    'STORE': os.getenv('FRAUD_WINDOW_STORE', 'REDIS'),
+    'REDIS_URL': os.getenv('FRAUD_REDIS_URL', REDIS_CACHE_URL),
+}
+
+# Outbox des tâches publiées après commit (commande relay_outbox en continu, beat en secours)
+OUTBOX = {
+    'TAILLE_LOT': int(os.getenv('OUTBOX_BATCH_SIZE', '500')),
+    'INTERVALLE': 0.5,  # Secondes entre deux lectures d'une outbox vide
+    'TENTATIVES_MAX': 20,  # Publications échouées avant abandon (statut ECHEC)
+}
+
+# Cache des cartes lues au passage sur terminal (par code_uid)
+CARD_CACHE = {
+    'TAILLE_LOCALE': int(os.getenv('CARD_CACHE_LOCAL_SIZE', '10000')),  # Cartes gardées en mémoire par processus
+    'DUREE': 300,  # Secondes de conservation dans le cache partagé
+    'RELECTURE': 2,  # Secondes entre deux vérifications de la version d'une carte en mémoire
+}
+
+# Émission en masse de cartes (commande issue_cards, POST /api/cartes/lots-emission/)
+CARD_ISSUANCE = {
+    'TAILLE_TRANCHE': 1000,  # Cartes insérées par transaction et par planche PDF
+    'NOMBRE_MAX': 100000,  # Cartes par lot
+    'WORKERS': int(os.getenv('CARD_ISSUANCE_WORKERS', '4')),  # Processus de rendu des lots demandés par l'API
+    'FILE': 'cartes.emission',  # File du worker d'émission (pool solo, voir start_celery.sh)
+}
+
+# Expiration des cartes (tâche sweep_expired_cards, commande sweep_expired_cards)
+CARD_EXPIRY = {
+    'TAILLE_TRANCHE': 5000,  # Cartes par transaction
+    'PREAVIS_JOURS': [30, 7],  # Jours avant l'expiration où le titulaire est prévenu
+}
+
+# Compteurs d'utilisation des cartes (nombre de transactions, dernière utilisation)
+# cumulés dans Redis (REDIS) ou en mémoire (LOCAL) et reportés en base par lots
+CARD_USAGE = {
+    'STORE': os.getenv('CARD_USAGE_STORE', 'REDIS'),
+    'REDIS_URL': os.getenv('CARD_USAGE_REDIS_URL', REDIS_CACHE_URL),
+    'TAILLE_LOT': 500,  # Cartes mises à jour par UPDATE
+}
+
+# Agrégats horaires et journaliers par marchand et terminal
+TRANSACTION_ROLLUPS = {
+    'RECOUVREMENT': 300,  # Secondes relues avant le filigrane (transactions finalisées avant la lecture, engagées après)
+    'HEURES_INITIALES': 24,  # Profondeur du premier calcul ; au-delà, commande rebuild_merchant_rollups
+}
+
+# Fournisseurs de paiement des rechargements, par mode de paiement
+# Sans URL, le paiement est accepté sans vérification (espèces, développement)
+PAYMENT_PROVIDERS = {
+    'MOBILE_MONEY': {
+        'URL': os.getenv('MOBILE_MONEY_API_URL', ''),
+        'CLE_API': os.getenv('MOBILE_MONEY_API_KEY', ''),
+        'TIMEOUT': 5,
+        'TAILLE_LOT': 100,  # Références par appel
+    },
+    'CARTE_BANCAIRE': {
+        'URL': os.getenv('BANK_API_URL', ''),
+        'CLE_API': os.getenv('BANK_API_KEY', ''),
+        'TIMEOUT': 5,
+        'TAILLE_LOT': 100,
+    },
+    'VIREMENT': {
+        'URL': os.getenv('BANK_TRANSFER_API_URL', ''),
+        'CLE_API': os.getenv('BANK_API_KEY', ''),
+        'TIMEOUT': 10,
+        'TAILLE_LOT': 100,
+    },
+}
+
+PAYMENT_VERIFICATION = {
+    'WORKERS': int(os.getenv('PAYMENT_VERIFICATION_WORKERS', '8')),  # Appels simultanés aux fournisseurs
+    'TAILLE_CYCLE': 1000,  # Rechargements en attente vérifiés par cycle
+    'INTERVALLE_RELANCE': 300,  # Secondes avant de revérifier un paiement toujours en attente
+}
+
+# Nouvelles tentatives des tâches Celery (logs.retry) : délai aléatoire
+# décorrélé entre BASE et PLAFOND secondes, au plus TENTATIVES relances et
+# BUDGET secondes depuis le premier échec ; au-delà, la tâche est
+# enregistrée en lettre morte (commande replay_dead_letters)
+TASK_RETRY_POLICIES = {
+    'DEFAUT': {'TENTATIVES': 3, 'BASE': 30, 'PLAFOND': 900, 'BUDGET': 3600},
+    'transactions.tasks.process_transaction': {'TENTATIVES': 5, 'BASE': 2, 'PLAFOND': 120, 'BUDGET': 600},
+    'transactions.tasks.process_rechargement': {'TENTATIVES': 5, 'BASE': 30, 'PLAFOND': 600, 'BUDGET': 3600},
+    'notifications.tasks.send_email_notification': {'TENTATIVES': 4, 'BASE': 60, 'PLAFOND': 1800, 'BUDGET': 6 * 3600},
+    'notifications.tasks.send_sms_notification': {'TENTATIVES': 4, 'BASE': 30, 'PLAFOND': 900, 'BUDGET': 2 * 3600},
+    'documents.tasks.process_document_ocr': {'TENTATIVES': 2, 'BASE': 60, 'PLAFOND': 600, 'BUDGET': 3600},
+}
+
+# Réconciliation incrémentale des soldes des cartes
+TRANSACTION_RECONCILIATION = {
+    'TAILLE_BLOC': int(os.getenv('RECONCILIATION_BLOCK_SIZE', '500')),
+    'MARGE_COUPURE': 300,  # Secondes entre la coupure et le lancement, couvre les transactions non commitées
+    'BALAYAGE_COMPLET_JOURS': 7,  # Jours entre deux exécutions sur toutes les cartes
 }
 
 # Configuration Email pour les notifications
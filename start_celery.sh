@@ -8,6 +8,19 @@ echo "🚀 Démarrage des services Celery"
 echo "📦 Démarrage du Celery Worker..."
 celery -A rfid_system worker --loglevel=info --detach
 
+# Démarrage d'un worker par file de transactions (concurrence 1 pour conserver l'ordre par carte)
+TRANSACTION_LANES=${TRANSACTION_LANES:-8}
+echo "🛤️ Démarrage des $TRANSACTION_LANES workers de files de transactions..."
+for lane in $(seq 0 $((TRANSACTION_LANES - 1))); do
+    celery -A rfid_system worker -Q transactions.lane.$lane --concurrency=1 --prefetch-multiplier=1 \
+        -n lane$lane@%h --loglevel=info --detach
+done
+
+# Démarrage du worker d'émission de cartes (pool solo : la tâche tourne dans le processus
+# principal du worker et peut lancer le pool de rendu des planches)
+echo "🪪 Démarrage du worker d'émission de cartes..."
+celery -A rfid_system worker -Q cartes.emission --pool=solo -n emission@%h --loglevel=info --detach
+
 # Démarrage du scheduler Celery Beat en arrière-plan
 echo "⏰ Démarrage du Celery Beat..."
 celery -A rfid_system beat --loglevel=info --detach
@@ -1,5 +1,8 @@
 from django.contrib import admin
-from .models import Transaction, Rechargement
+from .models import (
+    Transaction, Rechargement, CompteurDepensesCarte, PointReconciliationCarte, ExecutionReconciliation,
+    EcartReconciliation, AgregatMarchand, PointAgregation
+)
 
 
 @admin.register(Transaction)
@@ -16,3 +19,49 @@ class RechargementAdmin(admin.ModelAdmin):
     list_filter = ['mode_paiement', 'statut_paiement', 'date_rechargement']
     search_fields = ['recu_numero', 'reference_paiement']
     readonly_fields = ['id', 'date_rechargement']
+
+
+@admin.register(CompteurDepensesCarte)
+class CompteurDepensesCarteAdmin(admin.ModelAdmin):
+    list_display = ['carte', 'periode', 'debut_periode', 'montant_total', 'nombre_transactions']
+    list_filter = ['periode', 'debut_periode']
+    readonly_fields = ['id', 'date_modification']
+
+
+@admin.register(PointReconciliationCarte)
+class PointReconciliationCarteAdmin(admin.ModelAdmin):
+    list_display = ['carte', 'solde_reconcilie', 'date_coupure', 'date_derniere_transaction']
+    search_fields = ['carte__numero_serie']
+    readonly_fields = ['id', 'date_modification']
+
+
+@admin.register(ExecutionReconciliation)
+class ExecutionReconciliationAdmin(admin.ModelAdmin):
+    list_display = ['date_coupure', 'complete', 'statut', 'cartes_traitees', 'ecarts_detectes', 'date_debut', 'date_fin']
+    list_filter = ['statut', 'complete']
+    readonly_fields = ['id', 'date_debut']
+
+
+@admin.register(EcartReconciliation)
+class EcartReconciliationAdmin(admin.ModelAdmin):
+    list_display = ['carte', 'solde_attendu', 'solde_carte', 'ecart', 'statut', 'date_detection']
+    list_filter = ['statut', 'date_detection']
+    search_fields = ['carte__numero_serie']
+    readonly_fields = ['id', 'date_detection']
+
+
+@admin.register(AgregatMarchand)
+class AgregatMarchandAdmin(admin.ModelAdmin):
+    list_display = [
+        'merchant_id', 'terminal_id', 'granularite', 'debut_periode',
+        'nombre_transactions', 'montant_total', 'nombre_echecs',
+    ]
+    list_filter = ['granularite', 'debut_periode']
+    search_fields = ['merchant_id', 'terminal_id']
+    readonly_fields = ['id', 'date_modification']
+
+
+@admin.register(PointAgregation)
+class PointAgregationAdmin(admin.ModelAdmin):
+    list_display = ['date_filigrane', 'date_modification']
+    readonly_fields = ['id', 'date_modification']
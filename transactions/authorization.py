@@ -0,0 +1,320 @@
+import uuid
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from cartes.models import CarteRFID
+from notifications.outbox import publier
+from .models import Transaction, CompteurDepensesCarte
+from .fees import transaction_fee
+from .fraud import flag_for_review, score_transaction
+from .usage import record_usage
+
+# Types de transactions autorisables directement dans la requête du terminal
+TYPES_DEBIT = ['ACHAT', 'RETRAIT']
+TYPES_CREDIT = ['RECHARGE']
+TYPES_INLINE = TYPES_DEBIT + TYPES_CREDIT
+
+# Un transfert débite la carte source (TRANSFERT) et crédite la carte
+# destinataire par une écriture liée (TRANSFERT_RECU), dans la même
+# transaction de base de données.
+TYPES_SORTANTS = TYPES_DEBIT + ['TRANSFERT']
+TYPES_ENTRANTS = TYPES_CREDIT + ['TRANSFERT_RECU']
+
+# Types soumis au scoring de fraude, sur les deux chemins d'autorisation
+TYPES_SCORES = TYPES_SORTANTS
+
+# Débit conditionnel : la vérification du statut et du solde et le débit
+# sont faits par une seule requête, le verrou de ligne n'est tenu que le
+# temps de l'UPDATE. Les compteurs d'utilisation de la carte sont reportés
+# en différé (voir usage.py).
+SQL_DEBIT = f"""
+    UPDATE {CarteRFID._meta.db_table}
+    SET solde = solde - %s
+    WHERE id = %s AND statut = 'ACTIVE' AND solde >= %s
+    RETURNING solde, plafond_quotidien, plafond_mensuel, type_carte
+"""
+
+SQL_CREDIT = f"""
+    UPDATE {CarteRFID._meta.db_table}
+    SET solde = solde + %s
+    WHERE id = %s AND statut = 'ACTIVE'
+    RETURNING solde, plafond_quotidien, plafond_mensuel, type_carte
+"""
+
+# Incrément des compteurs du jour et du mois en une requête ; les totaux
+# retournés sont comparés aux plafonds de la carte.
+SQL_COMPTEURS = """
+    INSERT INTO {table} (id, carte_id, periode, debut_periode, montant_total, nombre_transactions, date_modification)
+    VALUES (%s, %s, 'JOUR', %s, %s, 1, %s), (%s, %s, 'MOIS', %s, %s, 1, %s)
+    ON CONFLICT (carte_id, periode, debut_periode) DO UPDATE
+    SET montant_total = {table}.montant_total + EXCLUDED.montant_total,
+        nombre_transactions = {table}.nombre_transactions + 1,
+        date_modification = EXCLUDED.date_modification
+    RETURNING periode, montant_total
+""".format(table=CompteurDepensesCarte._meta.db_table)
+
+# Journal et notifications d'un lot, publiés par l'outbox après le commit
+TACHE_FINALISATION = 'transactions.tasks.finalize_transactions'
+
+REFUS_PLAFONDS = {
+    'JOUR': ('PLAFOND_QUOTIDIEN_DEPASSE', 'Plafond quotidien dépassé'),
+    'MOIS': ('PLAFOND_MENSUEL_DEPASSE', 'Plafond mensuel dépassé'),
+}
+
+
+def signed_amount(type_transaction, montant):
+    """Effet d'une transaction validée sur le solde de sa carte"""
+    if type_transaction in TYPES_SORTANTS:
+        return -montant
+    if type_transaction in TYPES_ENTRANTS:
+        return montant
+    return 0
+
+
+class PlafondDepasse(Exception):
+    """Levée pour annuler un débit qui dépasse un plafond de la carte"""
+
+    def __init__(self, periode):
+        self.code, self.message = REFUS_PLAFONDS[periode]
+        super().__init__(self.message)
+
+
+def periodes_depenses(now):
+    """Retourne le début des périodes journalière et mensuelle d'un instant"""
+    jour = timezone.localdate(now)
+    return jour, jour.replace(day=1)
+
+
+def increment_spend_counters(cursor, carte_id, montant, now, plafond_quotidien, plafond_mensuel):
+    """Incrémente les compteurs de dépenses d'une carte et vérifie ses plafonds"""
+    jour, mois = periodes_depenses(now)
+    pk_field = CompteurDepensesCarte._meta.pk
+    carte_pk = CarteRFID._meta.pk.get_db_prep_value(carte_id, connection)
+    cursor.execute(SQL_COMPTEURS, [
+        pk_field.get_db_prep_value(uuid.uuid4(), connection), carte_pk, jour, montant, now,
+        pk_field.get_db_prep_value(uuid.uuid4(), connection), carte_pk, mois, montant, now,
+    ])
+    plafonds = {'JOUR': plafond_quotidien, 'MOIS': plafond_mensuel}
+    for periode, total in cursor.fetchall():
+        if total > plafonds[periode]:
+            raise PlafondDepasse(periode)
+
+
+def authorize_inline(trans):
+    """Autorise une transaction de manière synchrone et retourne son statut final.
+
+    Doit être appelée dans un bloc transaction.atomic(). Le journal et les
+    notifications sont différés après le commit.
+    """
+    if trans.type_transaction in TYPES_SCORES:
+        suspicion = score_transaction(trans)
+        if suspicion is not None:
+            flag_for_review(trans, suspicion)
+            trans.save(update_fields=['statut', 'code_erreur', 'message_erreur', 'donnees_brutes'])
+            publier(TACHE_FINALISATION, [[str(trans.id)]])
+            return trans.statut
+
+    now = timezone.now()
+    carte_pk = CarteRFID._meta.pk.get_db_prep_value(trans.carte_id, connection)
+
+    refus = None
+    try:
+        # Point de sauvegarde : un plafond dépassé annule le débit déjà appliqué
+        with transaction.atomic(), connection.cursor() as cursor:
+            if trans.type_transaction in TYPES_DEBIT:
+                cursor.execute(SQL_DEBIT, [trans.montant, carte_pk, trans.montant])
+            else:
+                cursor.execute(SQL_CREDIT, [trans.montant, carte_pk])
+            row = cursor.fetchone()
+
+            if row is not None and trans.type_transaction in TYPES_DEBIT:
+                increment_spend_counters(cursor, trans.carte_id, trans.montant, now, row[1], row[2])
+    except PlafondDepasse as exc:
+        refus = exc
+        row = None
+
+    if row is not None:
+        nouveau_solde = row[0]
+        if trans.type_transaction in TYPES_DEBIT:
+            trans.solde_avant = nouveau_solde + trans.montant
+        else:
+            trans.solde_avant = nouveau_solde - trans.montant
+        trans.solde_apres = nouveau_solde
+        trans.statut = 'VALIDEE'
+        trans.date_validation = now
+        trans.frais_transaction = transaction_fee(trans, row[3])
+    else:
+        # Chemin d'échec : on relit la carte uniquement pour qualifier l'erreur
+        statut_carte, solde = CarteRFID.objects.filter(pk=trans.carte_id).values_list(
+            'statut', 'solde'
+        ).get()
+        trans.solde_avant = solde
+        trans.solde_apres = solde
+        trans.statut = 'ECHOUEE'
+        trans.date_validation = now
+        if refus is not None:
+            trans.code_erreur = refus.code
+            trans.message_erreur = refus.message
+        elif statut_carte != 'ACTIVE':
+            trans.code_erreur = 'CARTE_INACTIVE'
+            trans.message_erreur = 'Carte non active'
+        else:
+            trans.code_erreur = 'SOLDE_INSUFFISANT'
+            trans.message_erreur = 'Solde insuffisant'
+
+    trans.save(update_fields=[
+        'solde_avant', 'solde_apres', 'statut', 'date_validation',
+        'code_erreur', 'message_erreur', 'frais_transaction',
+    ])
+
+    record_usage([trans])
+    publier(TACHE_FINALISATION, [[str(trans.id)]])
+    return trans.statut
+
+
+def apply_transactions(transactions):
+    """Applique un lot de transactions EN_COURS déjà verrouillées par l'appelant.
+
+    Les cartes concernées sont verrouillées une seule fois, dans l'ordre de
+    leur identifiant pour éviter les interblocages entre lots concurrents,
+    puis les transactions sont appliquées en mémoire dans l'ordre fourni
+    (chronologique par carte) et écrites en masse. Un débit au score de
+    fraude trop élevé passe en revue sans mouvement de solde. Un transfert
+    verrouille aussi la carte destinataire et crée son écriture de crédit
+    liée. Doit être appelée dans un bloc transaction.atomic().
+    """
+    if not transactions:
+        return {}
+
+    now = timezone.now()
+    carte_ids = {trans.carte_id for trans in transactions}
+    carte_ids.update(
+        trans.carte_destination_id for trans in transactions
+        if trans.type_transaction == 'TRANSFERT' and trans.carte_destination_id
+    )
+    cartes = {
+        carte.id: carte
+        for carte in CarteRFID.objects.select_for_update().filter(id__in=carte_ids).order_by('id')
+    }
+    soldes_initiaux = {carte_id: carte.solde for carte_id, carte in cartes.items()}
+
+    # Les compteurs sont protégés par le verrou des cartes : lecture simple
+    jour, mois = periodes_depenses(now)
+    compteurs = {
+        (compteur.carte_id, compteur.periode): compteur
+        for compteur in CompteurDepensesCarte.objects.filter(carte_id__in=carte_ids).filter(
+            Q(periode='JOUR', debut_periode=jour) | Q(periode='MOIS', debut_periode=mois)
+        )
+    }
+    compteurs_modifies = {}
+
+    resultats = {}
+    credits_transferts = []
+    for trans in transactions:
+        carte = cartes[trans.carte_id]
+        destination = cartes.get(trans.carte_destination_id) if trans.type_transaction == 'TRANSFERT' else None
+        trans.solde_avant = carte.solde
+
+        # Scoring de fraude avant tout débit
+        suspicion = None
+        if carte.statut == 'ACTIVE' and trans.type_transaction in TYPES_SCORES:
+            suspicion = score_transaction(trans)
+
+        if carte.statut != 'ACTIVE':
+            trans.statut = 'ECHOUEE'
+            trans.code_erreur = 'CARTE_INACTIVE'
+            trans.message_erreur = 'Carte non active'
+        elif suspicion is not None:
+            flag_for_review(trans, suspicion)
+        elif trans.type_transaction == 'TRANSFERT' and (
+            destination is None or destination.id == carte.id or destination.statut != 'ACTIVE'
+        ):
+            trans.statut = 'ECHOUEE'
+            trans.code_erreur = 'CARTE_DESTINATION_INVALIDE'
+            trans.message_erreur = 'Carte destinataire absente ou non active'
+        elif trans.type_transaction in TYPES_SORTANTS and carte.solde < trans.montant:
+            trans.statut = 'ECHOUEE'
+            trans.code_erreur = 'SOLDE_INSUFFISANT'
+            trans.message_erreur = 'Solde insuffisant'
+        elif trans.type_transaction in TYPES_SORTANTS and (
+            _compteur(compteurs, carte, 'JOUR', jour).montant_total + trans.montant > carte.plafond_quotidien
+        ):
+            trans.statut = 'ECHOUEE'
+            trans.code_erreur, trans.message_erreur = REFUS_PLAFONDS['JOUR']
+        elif trans.type_transaction in TYPES_SORTANTS and (
+            _compteur(compteurs, carte, 'MOIS', mois).montant_total + trans.montant > carte.plafond_mensuel
+        ):
+            trans.statut = 'ECHOUEE'
+            trans.code_erreur, trans.message_erreur = REFUS_PLAFONDS['MOIS']
+        else:
+            if trans.type_transaction in TYPES_SORTANTS:
+                carte.solde -= trans.montant
+                for periode in ('JOUR', 'MOIS'):
+                    compteur = compteurs[(carte.id, periode)]
+                    compteur.montant_total += trans.montant
+                    compteur.nombre_transactions += 1
+                    compteurs_modifies[(carte.id, periode)] = compteur
+            elif trans.type_transaction in TYPES_CREDIT:
+                carte.solde += trans.montant
+            if destination is not None:
+                credits_transferts.append(_credit_transfert(trans, destination, now))
+            trans.statut = 'VALIDEE'
+            trans.date_validation = now
+            trans.frais_transaction = transaction_fee(trans, carte.type_carte)
+
+        if trans.statut == 'ECHOUEE':
+            trans.date_validation = now
+        trans.solde_apres = carte.solde
+        resultats[trans.id] = trans.statut
+
+    Transaction.objects.bulk_create(credits_transferts)
+    Transaction.objects.bulk_update(transactions, [
+        'solde_avant', 'solde_apres', 'statut', 'date_validation',
+        'code_erreur', 'message_erreur', 'transaction_liee', 'donnees_brutes',
+        'frais_transaction',
+    ])
+    # Seul le solde est écrit sur la ligne de la carte, et seulement s'il a changé
+    CarteRFID.objects.bulk_update(
+        [carte for carte in cartes.values() if carte.solde != soldes_initiaux[carte.id]], ['solde']
+    )
+    CompteurDepensesCarte.objects.bulk_create(
+        compteurs_modifies.values(),
+        update_conflicts=True,
+        unique_fields=['carte', 'periode', 'debut_periode'],
+        update_fields=['montant_total', 'nombre_transactions', 'date_modification'],
+    )
+
+    record_usage([*transactions, *credits_transferts])
+    transaction_ids = [str(trans.id) for trans in [*transactions, *credits_transferts]]
+    publier(TACHE_FINALISATION, [transaction_ids])
+    return resultats
+
+
+def _credit_transfert(trans, destination, now):
+    """Crédite la carte destinataire d'un transfert et retourne l'écriture liée"""
+    solde_avant = destination.solde
+    destination.solde += trans.montant
+    credit = Transaction(
+        carte=destination,
+        type_transaction='TRANSFERT_RECU',
+        montant=trans.montant,
+        solde_avant=solde_avant,
+        solde_apres=destination.solde,
+        reference_interne=f"TRFR_{trans.id.hex}",
+        description=trans.description,
+        devise=trans.devise,
+        statut='VALIDEE',
+        date_validation=now,
+        agent_validateur_id=trans.agent_validateur_id,
+        transaction_liee=trans,
+    )
+    trans.transaction_liee = credit
+    return credit
+
+
+def _compteur(compteurs, carte, periode, debut_periode):
+    """Retourne le compteur d'une carte pour une période, créé en mémoire si absent"""
+    key = (carte.id, periode)
+    if key not in compteurs:
+        compteurs[key] = CompteurDepensesCarte(carte=carte, periode=periode, debut_periode=debut_periode)
+    return compteurs[key]
@@ -0,0 +1,99 @@
+import csv
+from datetime import date, datetime, timedelta
+from django.utils import timezone
+from openpyxl import Workbook
+from .models import Transaction
+from .periods import day_bounds
+
+# Les exports parcourent la table avec un curseur serveur
+# (.iterator(chunk_size=...)) et n'instancient aucun modèle : la mémoire
+# consommée ne dépend pas du nombre de lignes exportées.
+
+CHUNK_SIZE = 2000
+XLSX_MAX_LIGNES_FEUILLE = 1_000_000  # Limite Excel : 1 048 576 lignes par feuille
+
+EXPORT_FIELDS = [
+    ('reference_interne', 'Référence interne'),
+    ('reference_externe', 'Référence externe'),
+    ('date_transaction', 'Date'),
+    ('date_validation', 'Date de validation'),
+    ('carte__numero_serie', 'Carte'),
+    ('type_transaction', 'Type'),
+    ('statut', 'Statut'),
+    ('montant', 'Montant'),
+    ('frais_transaction', 'Frais'),
+    ('devise', 'Devise'),
+    ('solde_avant', 'Solde avant'),
+    ('solde_apres', 'Solde après'),
+    ('merchant_id', 'Marchand'),
+    ('merchant_nom', 'Nom marchand'),
+    ('terminal_id', 'Terminal'),
+    ('code_erreur', 'Code erreur'),
+]
+
+
+def parse_period(debut, fin):
+    """Convertit deux dates AAAA-MM-JJ (fin incluse) en intervalle [début, fin)"""
+    debut = date.fromisoformat(debut)
+    fin = date.fromisoformat(fin)
+    if fin < debut:
+        raise ValueError('La date de fin précède la date de début')
+    return day_bounds(debut)[0], day_bounds(fin + timedelta(days=1))[0]
+
+
+def export_queryset(debut, fin, statut=None):
+    """Lignes à exporter, sous forme de tuples, triées par date"""
+    queryset = Transaction.objects.filter(date_transaction__gte=debut, date_transaction__lt=fin)
+    if statut:
+        queryset = queryset.filter(statut=statut)
+    return queryset.order_by('date_transaction', 'id').values_list(*[field for field, _ in EXPORT_FIELDS])
+
+
+class Echo:
+    """Pseudo-fichier renvoyant directement ce qui lui est écrit"""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(queryset):
+    """Génère l'export CSV ligne par ligne"""
+    writer = csv.writer(Echo(), delimiter=';')
+    yield '\ufeff'  # BOM pour l'ouverture directe dans Excel
+    yield writer.writerow([label for _, label in EXPORT_FIELDS])
+    for row in queryset.iterator(chunk_size=CHUNK_SIZE):
+        yield writer.writerow([_format(value) for value in row])
+
+
+def write_xlsx(queryset, path):
+    """Écrit l'export XLSX en mode write-only et retourne le nombre de lignes"""
+    workbook = Workbook(write_only=True)
+    entetes = [label for _, label in EXPORT_FIELDS]
+    feuille = None
+    lignes = 0
+    for row in queryset.iterator(chunk_size=CHUNK_SIZE):
+        if lignes % XLSX_MAX_LIGNES_FEUILLE == 0:
+            feuille = workbook.create_sheet(f'Transactions {lignes // XLSX_MAX_LIGNES_FEUILLE + 1}')
+            feuille.append(entetes)
+        feuille.append([_cellule(value) for value in row])
+        lignes += 1
+
+    if feuille is None:
+        workbook.create_sheet('Transactions 1').append(entetes)
+    workbook.save(path)
+    return lignes
+
+
+def _format(value):
+    if value is None:
+        return ''
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+
+def _cellule(value):
+    # Excel ne gère pas les fuseaux horaires
+    if isinstance(value, datetime) and timezone.is_aware(value):
+        return timezone.localtime(value).replace(tzinfo=None)
+    return value
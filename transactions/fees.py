@@ -0,0 +1,142 @@
+import logging
+from bisect import bisect_right
+from decimal import Decimal, ROUND_HALF_UP
+from itertools import product
+from parametres.cache import get_parametres, load_parametres, parametres_version
+
+# Moteur de frais et de commissions. Chaque règle est un paramètre système
+# JSON de la catégorie FRAIS, par exemple :
+#
+#   {"cible": "TRANSACTION", "operation": "ACHAT", "type_carte": "STANDARD",
+#    "partenaire": "*", "priorite": 0, "minimum": "0.05", "maximum": "5",
+#    "tranches": [{"min": "0", "fixe": "0.10", "taux": "0"},
+#                 {"min": "50", "fixe": "0", "taux": "0.005"}]}
+#
+# La cible est TRANSACTION (opération = type de transaction, partenaire =
+# merchant_id) ou RECHARGEMENT (opération = mode de paiement, partenaire =
+# opérateur mobile). "*" accepte toute valeur. Les règles sont compilées une
+# fois par version des paramètres en un dictionnaire indexé par
+# (cible, opération, type de carte, partenaire) ; les tranches de montant
+# sont retrouvées par bisect. Une transaction essaie les huit combinaisons
+# de jokers, de la plus spécifique (le moins de jokers) à la plus générale ;
+# à spécificité égale, l'opération prime sur le type de carte, qui prime
+# sur le partenaire.
+
+logger = logging.getLogger(__name__)
+
+CATEGORIE = 'FRAIS'
+JOKER = '*'
+CENTIME = Decimal('0.01')
+
+# Champs précisés (True) ou remplacés par le joker, pour (opération, type de carte, partenaire)
+ORDRE_RECHERCHE = sorted(
+    product((True, False), repeat=3),
+    key=lambda precises: (-sum(precises), tuple(not precise for precise in precises)),
+)
+
+
+class BaremeFrais:
+    """Barème compilé : tranches de montant triées et bornes du résultat"""
+
+    __slots__ = ('bornes', 'tranches', 'minimum', 'maximum', 'priorite')
+
+    def __init__(self, regle):
+        tranches = sorted(
+            (
+                Decimal(str(tranche.get('min', 0))),
+                Decimal(str(tranche['max'])) if tranche.get('max') is not None else None,
+                Decimal(str(tranche.get('fixe', 0))),
+                Decimal(str(tranche.get('taux', 0))),
+            )
+            for tranche in regle['tranches']
+        )
+        self.bornes = [tranche[0] for tranche in tranches]
+        self.tranches = tranches
+        self.minimum = Decimal(str(regle['minimum'])) if regle.get('minimum') is not None else None
+        self.maximum = Decimal(str(regle['maximum'])) if regle.get('maximum') is not None else None
+        self.priorite = int(regle.get('priorite', 0))
+
+    def calculer(self, montant):
+        position = bisect_right(self.bornes, montant) - 1
+        if position < 0:
+            return None
+        _, borne_haute, fixe, taux = self.tranches[position]
+        if borne_haute is not None and montant >= borne_haute:
+            return None
+
+        frais = fixe + montant * taux
+        if self.minimum is not None:
+            frais = max(frais, self.minimum)
+        if self.maximum is not None:
+            frais = min(frais, self.maximum)
+        return frais.quantize(CENTIME, rounding=ROUND_HALF_UP)
+
+
+def compile_rules(regles):
+    """Compile les règles {clé: dict} en table de recherche"""
+    table = {}
+    for cle, regle in regles.items():
+        try:
+            bareme = BaremeFrais(regle)
+            index = (
+                regle['cible'].upper(),
+                regle.get('operation', JOKER),
+                regle.get('type_carte', JOKER),
+                regle.get('partenaire', JOKER) or JOKER,
+            )
+        except (KeyError, TypeError, ValueError, AttributeError, ArithmeticError) as exc:
+            logger.warning(f"Règle de frais {cle} ignorée: {exc}")
+            continue
+        if index not in table or bareme.priorite > table[index].priorite:
+            table[index] = bareme
+    return table
+
+
+_compilees = {'version': None, 'table': {}}
+
+
+def fee_table():
+    """Table compilée, recompilée quand la version des paramètres change"""
+    try:
+        version = parametres_version()
+    except Exception as exc:
+        # Cache indisponible : la dernière table compilée reste en vigueur
+        logger.warning(f"Version des paramètres indisponible, barème de frais conservé: {exc}")
+        if _compilees['version'] is None:
+            _compilees['table'] = compile_rules(load_parametres(CATEGORIE))
+        return _compilees['table']
+    if _compilees['version'] != version:
+        _compilees['table'] = compile_rules(get_parametres(CATEGORIE))
+        _compilees['version'] = version
+    return _compilees['table']
+
+
+def compute_fee(cible, operation, type_carte, partenaire, montant, table=None):
+    """Frais applicables, de la règle la plus spécifique à la plus générale"""
+    table = fee_table() if table is None else table
+    if not table:
+        return Decimal('0.00')
+    valeurs = (operation, type_carte, partenaire or JOKER)
+    for precises in ORDRE_RECHERCHE:
+        index = (cible,) + tuple(
+            valeur if precise else JOKER for valeur, precise in zip(valeurs, precises)
+        )
+        bareme = table.get(index)
+        if bareme is not None:
+            frais = bareme.calculer(montant)
+            if frais is not None:
+                return frais
+    return Decimal('0.00')
+
+
+def transaction_fee(trans, type_carte, table=None):
+    """Frais d'une transaction"""
+    return compute_fee('TRANSACTION', trans.type_transaction, type_carte, trans.merchant_id, trans.montant, table)
+
+
+def recharge_commission(rechargement, type_carte, table=None):
+    """Commission prélevée sur un rechargement"""
+    return compute_fee(
+        'RECHARGEMENT', rechargement.mode_paiement, type_carte, rechargement.operateur_mobile,
+        rechargement.montant_recharge, table
+    )
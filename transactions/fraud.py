@@ -0,0 +1,190 @@
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+from decimal import Decimal
+from django.conf import settings
+from django.utils.dateparse import parse_datetime
+from parametres.cache import get_parametres
+
+# Score de fraude calculé avant le débit à partir de fenêtres glissantes
+# par carte tenues en mémoire (Redis en production, dictionnaires locaux
+# pour les tests et le développement) : aucune requête sur la table des
+# transactions. Une observation coûte un aller-retour Redis (pipeline).
+
+logger = logging.getLogger(__name__)
+
+CATEGORIE = 'FRAUDE'
+
+# Valeurs par défaut, surchargées par les paramètres système de la catégorie FRAUDE
+REGLES_DEFAUT = {
+    'FRAUDE_ACTIVE': True,
+    'FRAUDE_SEUIL_SCORE': 50,
+    # Passages de carte par minute
+    'FRAUDE_TAPS_MAX': 5,
+    'FRAUDE_TAPS_FENETRE': 60,
+    'FRAUDE_TAPS_POIDS': 50,
+    # Montant anormalement élevé par rapport aux derniers montants de la carte
+    'FRAUDE_MONTANT_MULTIPLICATEUR': Decimal('5'),
+    'FRAUDE_MONTANT_MINIMUM': Decimal('100'),
+    'FRAUDE_MONTANT_HISTORIQUE': 20,
+    'FRAUDE_MONTANT_POIDS': 30,
+    # Terminaux distincts sur une courte période
+    'FRAUDE_TERMINAUX_MAX': 3,
+    'FRAUDE_TERMINAUX_FENETRE': 600,
+    'FRAUDE_TERMINAUX_POIDS': 50,
+}
+
+
+def fraud_rules():
+    """Règles de scoring en vigueur, valeurs par défaut si les paramètres sont indisponibles"""
+    try:
+        return {**REGLES_DEFAUT, **get_parametres(CATEGORIE)}
+    except Exception as exc:
+        # Cache des paramètres indisponible : le scoring ne bloque pas l'autorisation
+        logger.warning(f"Paramètres de fraude indisponibles, règles par défaut: {exc}")
+        return dict(REGLES_DEFAUT)
+
+
+class LocalWindowStore:
+    """Fenêtres glissantes en mémoire du processus (tests, développement)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._taps = defaultdict(deque)
+        self._terminaux = defaultdict(dict)
+        self._montants = defaultdict(deque)
+
+    def observe(self, carte_id, passage_id, terminal_id, montant, instant, regles):
+        """Enregistre un passage et retourne (passages, terminaux distincts, montants précédents)"""
+        with self._lock:
+            taps = self._taps[carte_id]
+            taps.append(instant)
+            while taps and taps[0] <= instant - regles['FRAUDE_TAPS_FENETRE']:
+                taps.popleft()
+
+            terminaux = self._terminaux[carte_id]
+            if terminal_id:
+                terminaux[terminal_id] = instant
+            limite = instant - regles['FRAUDE_TERMINAUX_FENETRE']
+            for terminal, vu_a in list(terminaux.items()):
+                if vu_a <= limite:
+                    del terminaux[terminal]
+
+            montants = self._montants[carte_id]
+            precedents = list(montants)
+            montants.appendleft(float(montant))
+            while len(montants) > regles['FRAUDE_MONTANT_HISTORIQUE']:
+                montants.pop()
+
+            return len(taps), len(terminaux), precedents
+
+
+class RedisWindowStore:
+    """Fenêtres glissantes dans Redis, partagées par tous les workers"""
+
+    def __init__(self, url):
+        import redis
+        self._client = redis.Redis.from_url(url)
+
+    def observe(self, carte_id, passage_id, terminal_id, montant, instant, regles):
+        """Enregistre un passage et retourne (passages, terminaux distincts, montants précédents)"""
+        cle_taps = f'fraude:{carte_id}:taps'
+        cle_terminaux = f'fraude:{carte_id}:terminaux'
+        cle_montants = f'fraude:{carte_id}:montants'
+        fenetre_taps = regles['FRAUDE_TAPS_FENETRE']
+        fenetre_terminaux = regles['FRAUDE_TERMINAUX_FENETRE']
+
+        pipe = self._client.pipeline(transaction=False)
+        pipe.zadd(cle_taps, {passage_id: instant})
+        pipe.zremrangebyscore(cle_taps, '-inf', instant - fenetre_taps)
+        pipe.zcard(cle_taps)
+        pipe.expire(cle_taps, int(fenetre_taps) + 1)
+        if terminal_id:
+            pipe.zadd(cle_terminaux, {terminal_id: instant})
+        pipe.zremrangebyscore(cle_terminaux, '-inf', instant - fenetre_terminaux)
+        pipe.zcard(cle_terminaux)
+        pipe.expire(cle_terminaux, int(fenetre_terminaux) + 1)
+        pipe.lrange(cle_montants, 0, -1)
+        pipe.lpush(cle_montants, str(montant))
+        pipe.ltrim(cle_montants, 0, regles['FRAUDE_MONTANT_HISTORIQUE'] - 1)
+        pipe.expire(cle_montants, 30 * 86400)
+        resultats = pipe.execute()
+
+        decalage = 1 if terminal_id else 0
+        taps = resultats[2]
+        terminaux = resultats[5 + decalage]
+        precedents = [float(valeur) for valeur in resultats[7 + decalage]]
+        return taps, terminaux, precedents
+
+
+_store = None
+
+
+def get_window_store():
+    """Store configuré par settings.FRAUD_DETECTION['STORE'] (REDIS ou LOCAL)"""
+    global _store
+    if _store is None:
+        config = settings.FRAUD_DETECTION
+        if config['STORE'].upper() == 'LOCAL':
+            _store = LocalWindowStore()
+        else:
+            _store = RedisWindowStore(config['REDIS_URL'])
+    return _store
+
+
+def transaction_instant(trans):
+    """Horodatage du passage : celui du terminal pour une transaction bufferisée, sinon maintenant"""
+    horodatage = (trans.donnees_brutes or {}).get('horodatage_terminal')
+    if horodatage:
+        instant = parse_datetime(horodatage)
+        if instant is not None and instant.tzinfo is not None:
+            return instant.timestamp()
+    return time.time()
+
+
+def score_transaction(trans, instant=None):
+    """Calcule le score de fraude d'une transaction de débit.
+
+    Retourne None si la transaction passe, sinon un dictionnaire
+    {'score': ..., 'regles': [...]} décrivant les règles déclenchées.
+    """
+    regles = fraud_rules()
+    if not regles['FRAUDE_ACTIVE']:
+        return None
+    if (trans.donnees_brutes or {}).get('fraude', {}).get('approuvee'):
+        # Transaction déjà revue et approuvée
+        return None
+
+    instant = instant if instant is not None else transaction_instant(trans)
+    try:
+        taps, terminaux, precedents = get_window_store().observe(
+            str(trans.carte_id), str(trans.id), trans.terminal_id, trans.montant, instant, regles
+        )
+    except Exception as exc:
+        # Store indisponible : la transaction n'est pas bloquée
+        logger.warning(f"Scoring de fraude indisponible pour {trans.reference_interne}: {exc}")
+        return None
+
+    declenchees = []
+    if taps > regles['FRAUDE_TAPS_MAX']:
+        declenchees.append(('VELOCITE_TAPS', regles['FRAUDE_TAPS_POIDS']))
+    if terminaux > regles['FRAUDE_TERMINAUX_MAX']:
+        declenchees.append(('TERMINAUX_MULTIPLES', regles['FRAUDE_TERMINAUX_POIDS']))
+    if precedents and trans.montant >= regles['FRAUDE_MONTANT_MINIMUM']:
+        moyenne = sum(precedents) / len(precedents)
+        if float(trans.montant) > moyenne * float(regles['FRAUDE_MONTANT_MULTIPLICATEUR']):
+            declenchees.append(('PIC_MONTANT', regles['FRAUDE_MONTANT_POIDS']))
+
+    score = sum(poids for _, poids in declenchees)
+    if score < regles['FRAUDE_SEUIL_SCORE']:
+        return None
+    return {'score': score, 'regles': [regle for regle, _ in declenchees]}
+
+
+def flag_for_review(trans, resultat):
+    """Place une transaction en revue"""
+    trans.statut = 'EN_REVUE'
+    trans.code_erreur = 'SUSPICION_FRAUDE'
+    trans.message_erreur = f"Transaction en revue (score {resultat['score']}: {', '.join(resultat['regles'])})"
+    trans.donnees_brutes = {**(trans.donnees_brutes or {}), 'fraude': resultat}
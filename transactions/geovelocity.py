@@ -0,0 +1,172 @@
+from datetime import datetime, timedelta
+import numpy as np
+from logs.models import LogSysteme
+from parametres.cache import get_parametres
+from .models import Transaction
+from .periods import day_bounds
+
+# Détection des déplacements impossibles : les passages géolocalisés d'une
+# journée sont chargés en tableaux NumPy, triés par carte puis par instant,
+# et la vitesse entre deux passages consécutifs d'une même carte est
+# calculée en une seule opération vectorisée (formule de haversine).
+
+RAYON_TERRE_KM = 6371.0088
+
+# Valeurs par défaut, surchargées par les paramètres système de la catégorie FRAUDE
+REGLES_DEFAUT = {
+    'FRAUDE_VITESSE_MAX_KMH': 900,
+    'FRAUDE_DISTANCE_MIN_KM': 50,  # Ignore les imprécisions GPS entre passages proches
+    'FRAUDE_RECUL_HEURES': 6,  # Passages de la veille chargés pour comparer le premier passage du jour
+}
+
+
+def geovelocity_rules():
+    """Règles de détection en vigueur"""
+    return {**REGLES_DEFAUT, **get_parametres('FRAUDE')}
+
+
+def parse_coordinates(valeurs):
+    """Convertit des chaînes "lat,lon" en tableaux (lat, lon) ; NaN si invalide"""
+    lat = np.full(len(valeurs), np.nan)
+    lon = np.full(len(valeurs), np.nan)
+    for i, valeur in enumerate(valeurs):
+        try:
+            texte_lat, texte_lon = valeur.split(',')
+            lat[i], lon[i] = float(texte_lat), float(texte_lon)
+        except (AttributeError, ValueError):
+            continue
+    valides = (np.abs(lat) <= 90) & (np.abs(lon) <= 180)
+    lat[~valides] = np.nan
+    lon[~valides] = np.nan
+    return lat, lon
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Distance orthodromique en km entre des tableaux de points en degrés"""
+    lat1, lon1, lat2, lon2 = (np.radians(tableau) for tableau in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * RAYON_TERRE_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def load_taps(debut, fin):
+    """Passages géolocalisés de [debut, fin) sous forme de tableaux"""
+    lignes = Transaction.objects.filter(
+        date_transaction__gte=debut,
+        date_transaction__lt=fin,
+        coordonnees_gps__isnull=False,
+    ).exclude(coordonnees_gps='').values_list(
+        'id', 'carte_id', 'date_transaction', 'coordonnees_gps', 'donnees_brutes__horodatage_terminal'
+    )
+
+    ids, cartes, instants, coordonnees = [], [], [], []
+    index_cartes = {}
+    for trans_id, carte_id, date_transaction, gps, horodatage in lignes.iterator(chunk_size=10000):
+        # Transaction bufferisée hors ligne : l'heure du passage est celle du terminal
+        if horodatage:
+            try:
+                date_transaction = datetime.fromisoformat(horodatage)
+            except (TypeError, ValueError):
+                pass
+        ids.append(trans_id)
+        cartes.append(index_cartes.setdefault(carte_id, len(index_cartes)))
+        instants.append(date_transaction.timestamp())
+        coordonnees.append(gps)
+
+    lat, lon = parse_coordinates(coordonnees)
+    return {
+        'ids': np.array(ids, dtype=object),
+        'cartes': np.array(cartes, dtype=np.int64),
+        'carte_ids': np.array(list(index_cartes), dtype=object),
+        'instants': np.array(instants, dtype=np.float64),
+        'lat': lat,
+        'lon': lon,
+    }
+
+
+def impossible_travels(passages, vitesse_max_kmh, distance_min_km, depuis=None):
+    """Paires de passages consécutifs d'une même carte à vitesse impossible.
+
+    Retourne des tableaux d'indices (précédent, suivant) dans l'ordre trié,
+    avec les distances, délais et vitesses correspondants.
+    """
+    valides = ~np.isnan(passages['lat'])
+    ordre = np.flatnonzero(valides)
+    ordre = ordre[np.lexsort((passages['instants'][ordre], passages['cartes'][ordre]))]
+
+    cartes = passages['cartes'][ordre]
+    instants = passages['instants'][ordre]
+    lat = passages['lat'][ordre]
+    lon = passages['lon'][ordre]
+
+    meme_carte = cartes[1:] == cartes[:-1]
+    distances = haversine_km(lat[:-1], lon[:-1], lat[1:], lon[1:])
+    delais = instants[1:] - instants[:-1]
+    # Délai nul : vitesse infinie dès que la distance dépasse le minimum
+    with np.errstate(divide='ignore', invalid='ignore'):
+        vitesses = np.where(delais > 0, distances / (delais / 3600), np.inf)
+
+    suspects = meme_carte & (distances >= distance_min_km) & (vitesses > vitesse_max_kmh)
+    if depuis is not None:
+        # Seul le second passage doit appartenir à la période analysée
+        suspects &= instants[1:] >= depuis
+    paires = np.flatnonzero(suspects)
+    return {
+        'precedents': ordre[paires],
+        'suivants': ordre[paires + 1],
+        'distances': distances[paires],
+        'delais': delais[paires],
+        'vitesses': vitesses[paires],
+    }
+
+
+def detect_impossible_travel(jour):
+    """Analyse les passages d'une journée et journalise les déplacements impossibles.
+
+    Retourne (passages analysés, déplacements signalés).
+    """
+    regles = geovelocity_rules()
+    debut, fin = day_bounds(jour)
+    passages = load_taps(debut - timedelta(hours=regles['FRAUDE_RECUL_HEURES']), fin)
+    if not len(passages['ids']):
+        return 0, 0
+
+    resultat = impossible_travels(
+        passages,
+        float(regles['FRAUDE_VITESSE_MAX_KMH']),
+        float(regles['FRAUDE_DISTANCE_MIN_KM']),
+        depuis=debut.timestamp(),
+    )
+
+    suivants = passages['ids'][resultat['suivants']]
+    # Une analyse relancée sur la même journée ne duplique pas les signalements
+    deja_signales = set(LogSysteme.objects.filter(
+        action='VOYAGE_IMPOSSIBLE',
+        transaction_concernee_id__in=list(suivants),
+    ).values_list('transaction_concernee_id', flat=True))
+
+    logs = []
+    for i, trans_id in enumerate(suivants):
+        if trans_id in deja_signales:
+            continue
+        precedent = resultat['precedents'][i]
+        vitesse = resultat['vitesses'][i]
+        logs.append(LogSysteme(
+            niveau='WARNING',
+            action='VOYAGE_IMPOSSIBLE',
+            module='transactions',
+            carte_concernee_id=passages['carte_ids'][passages['cartes'][precedent]],
+            transaction_concernee_id=trans_id,
+            message=(
+                f"Déplacement impossible: {resultat['distances'][i]:.0f} km en "
+                f"{resultat['delais'][i] / 60:.0f} min"
+            ),
+            donnees_apres={
+                'transaction_precedente': str(passages['ids'][precedent]),
+                'distance_km': round(float(resultat['distances'][i]), 1),
+                'delai_secondes': round(float(resultat['delais'][i]), 1),
+                'vitesse_kmh': round(float(vitesse), 1) if np.isfinite(vitesse) else None,
+            },
+            code_retour='VOYAGE_IMPOSSIBLE',
+        ))
+    LogSysteme.objects.bulk_create(logs, batch_size=1000)
+    return len(passages['ids']), len(logs)
@@ -0,0 +1,102 @@
+from django.core.cache import cache
+from .models import Transaction
+
+# Une soumission rejouée par un terminal (même terminal_id et même
+# reference_externe) renvoie le résultat d'origine sans retraiter la
+# transaction ni toucher la ligne carte.
+
+CACHE_TTL = 24 * 3600
+STATUTS_FINAUX = ['VALIDEE', 'ECHOUEE', 'ANNULEE']
+
+
+def idempotency_key(terminal_id, reference_externe):
+    """Clé de cache d'une soumission, None si elle n'est pas identifiable"""
+    if not terminal_id or not reference_externe:
+        return None
+    return f'idempotence:{terminal_id}:{reference_externe}'
+
+
+def transaction_result(trans):
+    """Résultat renvoyé au terminal pour une transaction"""
+    return {
+        'transaction_id': str(trans.id),
+        'reference_interne': trans.reference_interne,
+        'status': trans.statut,
+        'code_erreur': trans.code_erreur,
+        'solde_apres': str(trans.solde_apres),
+    }
+
+
+def remember_result(trans):
+    """Met en cache le résultat d'une transaction au statut définitif"""
+    key = idempotency_key(trans.terminal_id, trans.reference_externe)
+    if key and trans.statut in STATUTS_FINAUX:
+        cache.set(key, transaction_result(trans), CACHE_TTL)
+
+
+def find_replay(terminal_id, reference_externe):
+    """Retourne le résultat d'origine d'une soumission déjà reçue, sinon None"""
+    key = idempotency_key(terminal_id, reference_externe)
+    if key is None:
+        return None
+
+    resultat = cache.get(key)
+    if resultat is None:
+        trans = Transaction.objects.filter(
+            terminal_id=terminal_id, reference_externe=reference_externe
+        ).only('id', 'reference_interne', 'statut', 'code_erreur', 'solde_apres', 'terminal_id',
+               'reference_externe').first()
+        if trans is not None:
+            resultat = transaction_result(trans)
+            remember_result(trans)
+
+    _incr_counter('hits' if resultat is not None else 'misses')
+    return resultat
+
+
+def find_replays(couples):
+    """Version groupée de find_replay pour une liste de (terminal_id, reference_externe)"""
+    couples = {couple for couple in couples if idempotency_key(*couple)}
+    if not couples:
+        return {}
+
+    en_cache = cache.get_many([idempotency_key(*couple) for couple in couples])
+    resultats = {
+        couple: en_cache[idempotency_key(*couple)]
+        for couple in couples if idempotency_key(*couple) in en_cache
+    }
+
+    restants = couples - set(resultats)
+    if restants:
+        candidates = Transaction.objects.filter(
+            terminal_id__in={terminal for terminal, _ in restants},
+            reference_externe__in={reference for _, reference in restants},
+        )
+        for trans in candidates:
+            couple = (trans.terminal_id, trans.reference_externe)
+            if couple in restants:
+                resultats[couple] = transaction_result(trans)
+                remember_result(trans)
+
+    _incr_counter('hits', len(resultats))
+    _incr_counter('misses', len(couples) - len(resultats))
+    return resultats
+
+
+def idempotency_stats():
+    """Compteurs de soumissions rejouées (hits) et nouvelles (misses)"""
+    valeurs = cache.get_many(['idempotence:stats:hits', 'idempotence:stats:misses'])
+    hits = valeurs.get('idempotence:stats:hits', 0)
+    misses = valeurs.get('idempotence:stats:misses', 0)
+    return {
+        'hits': hits,
+        'misses': misses,
+        'taux_rejeu': round(hits / (hits + misses), 4) if hits + misses else None,
+    }
+
+
+def _incr_counter(nom, delta=1):
+    if delta:
+        key = f'idempotence:stats:{nom}'
+        cache.add(key, 0, timeout=None)
+        cache.incr(key, delta)
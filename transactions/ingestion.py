@@ -0,0 +1,97 @@
+from django.db import IntegrityError, transaction
+from cartes.models import CarteRFID
+from .authorization import apply_transactions
+from .idempotency import find_replays, idempotency_key, transaction_result
+from .models import Transaction
+
+
+def ingest_transactions(items):
+    """Enregistre et applique un lot de transactions bufferisées par un terminal.
+
+    items est une liste de (index, données validées). Les transactions
+    acceptées sont créées en masse puis appliquées carte par carte dans
+    l'ordre chronologique du terminal, en une seule passe. Retourne un
+    résultat par élément, indexé comme la requête.
+    """
+    try:
+        return _ingest(items)
+    except IntegrityError:
+        # Renvoi concurrent du même buffer inséré entre la recherche des
+        # doublons et l'insertion : le lot, annulé en entier, est reclassé
+        # et les éléments déjà enregistrés sont renvoyés comme rejoués
+        return _ingest(items)
+
+
+def _ingest(items):
+    resultats = {}
+
+    # Résolution groupée des cartes et des références déjà connues
+    carte_ids = {donnees['carte'] for _, donnees in items}
+    cartes_connues = set(CarteRFID.objects.filter(id__in=carte_ids).values_list('id', flat=True))
+    references = [donnees['reference_interne'] for _, donnees in items]
+    references_connues = set(
+        Transaction.objects.filter(reference_interne__in=references).values_list('reference_interne', flat=True)
+    )
+
+    # Soumissions déjà reçues (terminal_id, reference_externe)
+    replays = find_replays(
+        (donnees.get('terminal_id', ''), donnees.get('reference_externe', '')) for _, donnees in items
+    )
+    premiers = {}
+    doublons = []
+
+    acceptees = []
+    for index, donnees in items:
+        reference = donnees['reference_interne']
+        couple = (donnees.get('terminal_id', ''), donnees.get('reference_externe', ''))
+        if couple in replays:
+            resultats[index] = {'index': index, **replays[couple], 'rejoue': True}
+            continue
+        if idempotency_key(*couple):
+            if couple in premiers:
+                doublons.append((index, premiers[couple]))
+                continue
+            premiers[couple] = index
+        if donnees['carte'] not in cartes_connues:
+            resultats[index] = _rejet(index, reference, 'CARTE_INCONNUE', 'Carte inconnue')
+            continue
+        if reference in references_connues:
+            resultats[index] = _rejet(index, reference, 'DOUBLON', 'Référence interne déjà enregistrée')
+            continue
+        references_connues.add(reference)
+
+        donnees = dict(donnees)
+        horodatage = donnees.pop('horodatage_terminal', None)
+        donnees['carte_id'] = donnees.pop('carte')
+        trans = Transaction(statut='EN_COURS', solde_avant=0, solde_apres=0, **donnees)
+        if horodatage is not None:
+            trans.donnees_brutes = {**trans.donnees_brutes, 'horodatage_terminal': horodatage.isoformat()}
+        acceptees.append((horodatage, index, trans))
+
+    # Ordre chronologique du terminal, l'ordre d'envoi départageant les égalités
+    acceptees.sort(key=lambda item: (item[0] is None, item[0] or 0, item[1]))
+    transactions = [trans for _, _, trans in acceptees]
+
+    with transaction.atomic():
+        Transaction.objects.bulk_create(transactions)
+        apply_transactions(transactions)
+
+    for _, index, trans in acceptees:
+        # Même sérialisation que les résultats rejoués
+        resultats[index] = {'index': index, **transaction_result(trans)}
+
+    # Doublons à l'intérieur du lot : résultat de la première occurrence
+    for index, premier in doublons:
+        resultats[index] = {**resultats[premier], 'index': index, 'rejoue': True}
+
+    return [resultats[index] for index in sorted(resultats)]
+
+
+def _rejet(index, reference, code, message):
+    return {
+        'index': index,
+        'reference_interne': reference,
+        'status': 'REJETEE',
+        'code_erreur': code,
+        'message_erreur': message,
+    }
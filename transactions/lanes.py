@@ -0,0 +1,61 @@
+import time
+import zlib
+from django.conf import settings
+from django.core.cache import cache
+
+# Les transactions d'une même carte sont toujours routées vers la même file,
+# consommée par un seul worker (concurrence 1) : elles s'exécutent dans
+# l'ordre, sans attente sur le verrou de la ligne carte.
+
+METRIQUES_TTL = 600  # Conservation des compteurs par minute (secondes)
+
+
+def lane_for_carte(carte_id):
+    """Retourne le numéro de file associé à une carte"""
+    return zlib.crc32(str(carte_id).encode()) % settings.TRANSACTION_LANES['NOMBRE']
+
+
+def lane_queue(lane):
+    """Nom de la file Celery d'un numéro de file"""
+    return f"{settings.TRANSACTION_LANES['PREFIXE_FILE']}.{lane}"
+
+
+def record_lane_metrics(lane, statut, duree_ms):
+    """Met à jour les compteurs de débit d'une file"""
+    minute = int(time.time() // 60)
+    compteurs = [f'lanes:{lane}:traitees', f'lanes:{lane}:duree_ms', f'lanes:{lane}:minute:{minute}']
+    if statut != 'VALIDEE':
+        compteurs.append(f'lanes:{lane}:echecs')
+
+    for key in compteurs:
+        timeout = METRIQUES_TTL if ':minute:' in key else None
+        cache.add(key, 0, timeout=timeout)
+    cache.incr(f'lanes:{lane}:traitees')
+    cache.incr(f'lanes:{lane}:duree_ms', int(duree_ms))
+    cache.incr(f'lanes:{lane}:minute:{minute}')
+    if statut != 'VALIDEE':
+        cache.incr(f'lanes:{lane}:echecs')
+
+
+def lane_metrics():
+    """Retourne les métriques de débit de chaque file"""
+    minute_precedente = int(time.time() // 60) - 1
+    metriques = []
+    for lane in range(settings.TRANSACTION_LANES['NOMBRE']):
+        valeurs = cache.get_many([
+            f'lanes:{lane}:traitees',
+            f'lanes:{lane}:echecs',
+            f'lanes:{lane}:duree_ms',
+            f'lanes:{lane}:minute:{minute_precedente}',
+        ])
+        traitees = valeurs.get(f'lanes:{lane}:traitees', 0)
+        duree_ms = valeurs.get(f'lanes:{lane}:duree_ms', 0)
+        metriques.append({
+            'lane': lane,
+            'file': lane_queue(lane),
+            'traitees': traitees,
+            'echecs': valeurs.get(f'lanes:{lane}:echecs', 0),
+            'duree_moyenne_ms': round(duree_ms / traitees, 2) if traitees else None,
+            'debit_par_minute': valeurs.get(f'lanes:{lane}:minute:{minute_precedente}', 0),
+        })
+    return metriques
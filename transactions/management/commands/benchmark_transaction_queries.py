@@ -0,0 +1,176 @@
+import re
+import statistics
+import time
+import uuid
+from datetime import date, timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+from cartes.models import CarteRFID
+from transactions.models import Transaction
+from transactions.partitions import is_partitioned
+from transactions.periods import day_bounds
+from transactions.tasks import pending_transactions_queryset
+
+# Répartition des statuts des transactions générées : quelques transactions
+# en attente et échouées, le reste validé
+PART_EN_COURS = 0.001
+PART_ECHOUEES = 0.03
+
+
+class Command(BaseCommand):
+    help = (
+        'Mesure les requêtes de la table des transactions qui filtrent sur date_transaction '
+        '(reprise par lot, surveillance, rapport quotidien), avant et après partitionnement. '
+        'Avec --generer, insère d\'abord des transactions synthétiques : à lancer sur un environnement de recette.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--generer', type=int, default=0, help='Transactions synthétiques à insérer avant la mesure')
+        parser.add_argument('--mois', type=int, default=12, help='Ancienneté maximale des transactions générées, en mois')
+        parser.add_argument('--tranche', type=int, default=500000, help='Transactions insérées par instruction')
+        parser.add_argument('--repetitions', type=int, default=20, help='Exécutions de chaque requête (médiane retenue)')
+        parser.add_argument('--insertions', type=int, default=500, help='Transactions créées pour mesurer l\'insertion')
+        parser.add_argument('--jour', help='Jour du rapport quotidien (AAAA-MM-JJ). Par défaut: la veille')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('La mesure nécessite PostgreSQL')
+
+        if options['generer']:
+            self.generate(options['generer'], options['mois'], options['tranche'])
+
+        if options['jour']:
+            try:
+                jour = date.fromisoformat(options['jour'])
+            except ValueError:
+                raise CommandError('Format de date invalide, attendu AAAA-MM-JJ')
+        else:
+            jour = timezone.now().date() - timedelta(days=1)
+
+        total = Transaction.objects.count()
+        partitionnee = is_partitioned()
+        self.stdout.write(
+            f"⏱️ {total} transactions, table {'partitionnée' if partitionnee else 'non partitionnée'}, "
+            f"médiane sur {options['repetitions']} exécutions"
+        )
+
+        reference = Transaction.objects.order_by('date_transaction').values_list('pk', 'reference_interne').first()
+        debut, fin = day_bounds(jour)
+        taille_lot = settings.TRANSACTION_BATCH['TAILLE_LOT']
+
+        def reserver():
+            with transaction.atomic():
+                return list(
+                    pending_transactions_queryset()
+                    .select_for_update(skip_locked=True)
+                    .order_by('date_transaction', 'reference_interne')[:taille_lot]
+                )
+
+        requetes = [
+            ('Backlog de reprise', pending_transactions_queryset(), lambda qs: qs.count()),
+            ('Réservation d\'un lot', pending_transactions_queryset().order_by('date_transaction', 'reference_interne')[:taille_lot],
+             lambda qs: reserver()),
+            ('Échecs de la dernière heure', Transaction.objects.filter(
+                statut='ECHOUEE', date_transaction__gte=timezone.now() - timedelta(hours=1)
+            ), lambda qs: qs.count()),
+            (f'Rapport du {jour}', Transaction.objects.filter(date_transaction__gte=debut, date_transaction__lt=fin),
+             lambda qs: qs.aggregate(
+                 total_count=Count('id'),
+                 validated_count=Count('id', filter=Q(statut='VALIDEE')),
+                 failed_count=Count('id', filter=Q(statut='ECHOUEE')),
+             )),
+        ]
+        if reference:
+            # Lectures sans la clé de partition : toutes les partitions sont parcourues
+            requetes += [
+                ('Lecture par identifiant', Transaction.objects.filter(pk=reference[0]), lambda qs: list(qs)),
+                ('Lecture par référence interne', Transaction.objects.filter(reference_interne=reference[1]),
+                 lambda qs: list(qs)),
+            ]
+
+        for libelle, queryset, executer in requetes:
+            duree = self.measure(lambda: executer(queryset.all()), options['repetitions'])
+            partitions = len(set(re.findall(r'transactions_(?:\d{4}_\d{2}|defaut)', queryset.explain())))
+            detail = f', {partitions} partitions lues' if partitionnee else ''
+            self.stdout.write(f'  {libelle} : {duree:.2f} ms{detail}')
+
+        if options['insertions']:
+            duree = self.measure_inserts(options['insertions'])
+            self.stdout.write(f"  Insertion : {duree:.3f} ms par transaction")
+
+        self.stdout.write(self.style.SUCCESS('✅ Mesure terminée'))
+
+    def measure(self, executer, repetitions):
+        """Durée médiane d'exécution, en millisecondes (une exécution de chauffe)"""
+        executer()
+        durees = []
+        for _ in range(repetitions):
+            debut = time.perf_counter()
+            executer()
+            durees.append((time.perf_counter() - debut) * 1000)
+        return statistics.median(durees)
+
+    def measure_inserts(self, nombre):
+        """Durée moyenne d'une insertion unitaire, en millisecondes (insertions annulées)"""
+        carte = CarteRFID.objects.first()
+        if carte is None:
+            return 0
+        debut = time.perf_counter()
+        with transaction.atomic():
+            for _ in range(nombre):
+                Transaction.objects.create(
+                    carte=carte, type_transaction='ACHAT', montant=1, solde_avant=0, solde_apres=0,
+                    statut='VALIDEE', reference_interne=f'BENCH_{uuid.uuid4().hex}',
+                )
+            transaction.set_rollback(True)
+        return (time.perf_counter() - debut) * 1000 / nombre
+
+    def generate(self, nombre, mois, tranche):
+        """Insère des transactions synthétiques réparties sur les derniers mois"""
+        cartes = [str(pk) for pk in CarteRFID.objects.values_list('pk', flat=True)[:1000]]
+        if not cartes:
+            raise CommandError('Aucune carte : la génération répartit les transactions sur les cartes existantes')
+
+        lot = uuid.uuid4().hex[:8]
+        self.stdout.write(f'🧪 Génération de {nombre} transactions sur {mois} mois...')
+        for depart in range(0, nombre, tranche):
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    """
+                    INSERT INTO transactions (
+                        id, carte_id, type_transaction, montant, solde_avant, solde_apres,
+                        merchant_id, merchant_nom, terminal_id, reference_externe, reference_interne,
+                        description, categorie, localisation, statut, code_erreur, message_erreur,
+                        frais_transaction, taux_change, devise, date_transaction, date_validation,
+                        donnees_brutes, signature_transaction
+                    )
+                    SELECT
+                        gen_random_uuid(), (%(cartes)s::uuid[])[1 + i %% cardinality(%(cartes)s::uuid[])],
+                        'ACHAT', 10, 100, 90, 'M' || (i %% 500), '', '', '', %(prefixe)s || i,
+                        '', '', '', statut, '', '', 0, 1, 'EUR', date,
+                        CASE WHEN statut = 'EN_COURS' THEN NULL ELSE date END,
+                        '{}', ''
+                    FROM (
+                        SELECT
+                            i,
+                            now() - random() * %(mois)s * interval '30 days' AS date,
+                            CASE
+                                WHEN tirage < %(en_cours)s THEN 'EN_COURS'
+                                WHEN tirage < %(en_cours)s + %(echouees)s THEN 'ECHOUEE'
+                                ELSE 'VALIDEE'
+                            END AS statut
+                        FROM (SELECT i, random() AS tirage FROM generate_series(%(debut)s, %(fin)s) AS i) AS serie
+                    ) AS generees
+                    """,
+                    {
+                        'cartes': cartes, 'prefixe': f'BENCH_{lot}_', 'mois': mois,
+                        'debut': depart, 'fin': min(depart + tranche, nombre) - 1,
+                        'en_cours': PART_EN_COURS, 'echouees': PART_ECHOUEES,
+                    }
+                )
+            self.stdout.write(f'  {min(depart + tranche, nombre)}/{nombre}')
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE transactions')
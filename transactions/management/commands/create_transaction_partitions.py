@@ -0,0 +1,35 @@
+from datetime import date
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from transactions.partitions import TABLE, ensure_partitions, is_partitioned
+
+
+class Command(BaseCommand):
+    help = 'Crée à l\'avance les partitions mensuelles de la table des transactions'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--mois', type=int, default=None,
+            help='Nombre de mois à créer après le mois courant (défaut: TRANSACTION_PARTITIONS[\'MOIS_AVANCE\'])'
+        )
+        parser.add_argument('--depuis', help='Premier mois à vérifier (AAAA-MM-JJ). Par défaut: mois courant')
+
+    def handle(self, *args, **options):
+        if not is_partitioned():
+            raise CommandError(
+                f'La table {TABLE} n\'est pas partitionnée (commande partition_transactions)'
+            )
+
+        depuis = None
+        if options['depuis']:
+            try:
+                depuis = date.fromisoformat(options['depuis'])
+            except ValueError:
+                raise CommandError('Format de date invalide, attendu AAAA-MM-JJ')
+
+        mois = options['mois'] if options['mois'] is not None else settings.TRANSACTION_PARTITIONS['MOIS_AVANCE']
+        creees = ensure_partitions(mois, depuis)
+
+        for nom in creees:
+            self.stdout.write(f'  + {nom}')
+        self.stdout.write(self.style.SUCCESS(f'✅ {len(creees)} partitions créées'))
@@ -0,0 +1,30 @@
+import time
+from datetime import date, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from transactions.geovelocity import detect_impossible_travel
+
+
+class Command(BaseCommand):
+    help = "Détecte les déplacements impossibles entre passages consécutifs d'une même carte"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--jour', help='Jour analysé (AAAA-MM-JJ, défaut: veille)')
+        parser.add_argument('--jours', type=int, default=1, help='Nombre de jours analysés à partir de --jour')
+
+    def handle(self, *args, **options):
+        try:
+            jour = date.fromisoformat(options['jour']) if options['jour'] else timezone.localdate() - timedelta(days=1)
+        except ValueError:
+            raise CommandError('Format de jour invalide, attendu AAAA-MM-JJ')
+
+        for decalage in range(options['jours']):
+            courant = jour + timedelta(days=decalage)
+            debut = time.monotonic()
+            passages, signales = detect_impossible_travel(courant)
+            self.stdout.write(
+                f'  {courant}: {passages} passages, {signales} déplacements impossibles '
+                f'({time.monotonic() - debut:.1f}s)'
+            )
+
+        self.stdout.write(self.style.SUCCESS('✅ Analyse de géovélocité terminée'))
@@ -0,0 +1,70 @@
+import json
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        'Lance un faux fournisseur de paiement local pour tester la vérification des rechargements. '
+        'Les références préfixées par ECHEC sont refusées, celles préfixées par ATTENTE restent en attente.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--port', type=int, default=8099, help="Port d'écoute")
+        parser.add_argument('--latence-ms', type=int, default=50, help='Latence simulée par appel')
+        parser.add_argument('--taux-erreur', type=float, default=0.0, help="Proportion d'appels en erreur 503")
+
+    def handle(self, *args, **options):
+        latence = options['latence_ms'] / 1000
+        taux_erreur = options['taux_erreur']
+        stdout = self.stdout
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # Connexions persistantes, comme un vrai fournisseur
+
+            def do_POST(self):
+                corps = self.rfile.read(int(self.headers.get('Content-Length', 0)) or 0)
+                time.sleep(latence)
+
+                if self.path.rstrip('/') != '/verifications':
+                    return self.repondre(404, {'erreur': 'Ressource inconnue'})
+                if random.random() < taux_erreur:
+                    return self.repondre(503, {'erreur': 'Service indisponible'})
+                try:
+                    references = json.loads(corps)['references']
+                except (ValueError, KeyError, TypeError):
+                    return self.repondre(400, {'erreur': 'Corps invalide'})
+
+                resultats = {}
+                for reference in references:
+                    if reference.startswith('ECHEC'):
+                        resultats[reference] = 'ECHEC'
+                    elif reference.startswith('ATTENTE'):
+                        resultats[reference] = 'EN_ATTENTE'
+                    else:
+                        resultats[reference] = 'CONFIRME'
+                self.repondre(200, {'resultats': resultats})
+
+            def repondre(self, code, donnees):
+                corps = json.dumps(donnees).encode()
+                self.send_response(code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(corps)))
+                self.end_headers()
+                self.wfile.write(corps)
+
+            def log_message(self, format, *args):
+                stdout.write(f'  {self.address_string()} {format % args}')
+
+        serveur = ThreadingHTTPServer(('127.0.0.1', options['port']), Handler)
+        self.stdout.write(self.style.SUCCESS(
+            f"💳 Faux fournisseur de paiement sur http://127.0.0.1:{options['port']} (Ctrl+C pour arrêter)"
+        ))
+        try:
+            serveur.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            serveur.server_close()
@@ -0,0 +1,31 @@
+from datetime import date
+from django.core.management.base import BaseCommand, CommandError
+from transactions.statements import generate_statements
+
+
+class Command(BaseCommand):
+    help = 'Génère les relevés PDF mensuels des cartes, avec reprise après interruption'
+
+    def add_arguments(self, parser):
+        parser.add_argument('mois', help='Mois du relevé (AAAA-MM)')
+        parser.add_argument('--workers', type=int, default=None, help='Processus de rendu (défaut: nombre de CPU)')
+        parser.add_argument('--taille-bloc', type=int, default=500, help='Cartes chargées par requête')
+        parser.add_argument('--recommencer', action='store_true', help='Ignore le point de reprise existant')
+
+    def handle(self, *args, **options):
+        try:
+            mois = date.fromisoformat(f"{options['mois']}-01")
+        except ValueError:
+            raise CommandError('Format de mois invalide, attendu AAAA-MM')
+
+        self.stdout.write(f'📄 Génération des relevés de {mois:%m/%Y}...')
+
+        total = generate_statements(
+            mois,
+            workers=options['workers'],
+            taille_bloc=options['taille_bloc'],
+            recommencer=options['recommencer'],
+            progression=lambda checkpoint: self.stdout.write(f"  {checkpoint['generes']} relevés générés")
+        )
+
+        self.stdout.write(self.style.SUCCESS(f'✅ {total} relevés générés pour {mois:%m/%Y}'))
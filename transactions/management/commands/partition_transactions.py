@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from transactions.partitions import TABLE, conversion_statements, convert_table, is_partitioned
+
+
+class Command(BaseCommand):
+    help = (
+        'Convertit la table des transactions en partitions mensuelles (PostgreSQL). '
+        'Opération unique, sous verrou exclusif de la table : à lancer pendant une fenêtre de maintenance.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mois', type=int, default=3, help='Partitions créées après le mois courant')
+        parser.add_argument('--sql', action='store_true', help='Affiche les instructions sans les exécuter')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Le partitionnement nécessite PostgreSQL')
+        if is_partitioned():
+            raise CommandError(f'La table {TABLE} est déjà partitionnée')
+
+        if options['sql']:
+            for instruction in conversion_statements(options['mois']):
+                self.stdout.write(f'{instruction};')
+            return
+
+        self.stdout.write(f'🗂️ Conversion de la table {TABLE} en partitions mensuelles...')
+        partitions = convert_table(options['mois'])
+        for nom in partitions:
+            self.stdout.write(f'  {nom}')
+        self.stdout.write(self.style.SUCCESS(f'✅ {len(partitions)} partitions'))
@@ -0,0 +1,28 @@
+from datetime import date, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from transactions.periods import day_bounds
+from transactions.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = 'Recalcule les agrégats marchands horaires et journaliers sur une période'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--depuis', required=True, help='Premier jour recalculé (AAAA-MM-JJ)')
+        parser.add_argument('--jusqu-a', default=None, help='Dernier jour recalculé, inclus (défaut: aujourd\'hui)')
+
+    def handle(self, *args, **options):
+        try:
+            jour = date.fromisoformat(options['depuis'])
+            dernier_jour = date.fromisoformat(options['jusqu_a']) if options['jusqu_a'] else date.today()
+        except ValueError:
+            raise CommandError('Format de date invalide, attendu AAAA-MM-JJ')
+
+        # Une journée à la fois : la mémoire ne dépend pas de la longueur de la période
+        while jour <= dernier_jour:
+            debut, fin = day_bounds(jour)
+            horaires, journaliers = rebuild_rollups(debut, fin)
+            self.stdout.write(f'  {jour}: {horaires} agrégats horaires, {journaliers} journaliers')
+            jour += timedelta(days=1)
+
+        self.stdout.write(self.style.SUCCESS('✅ Agrégats marchands recalculés'))
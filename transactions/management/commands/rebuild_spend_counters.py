@@ -0,0 +1,72 @@
+from datetime import date, datetime, time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, DateField, Sum
+from django.db.models.functions import TruncDate, TruncMonth
+from django.utils import timezone
+from transactions.authorization import TYPES_SORTANTS
+from transactions.models import Transaction, CompteurDepensesCarte
+
+
+class Command(BaseCommand):
+    help = "Recalcule les compteurs de dépenses des cartes à partir de l'historique des transactions"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--depuis',
+            help='Date de début (AAAA-MM-JJ), ramenée au premier jour du mois. Par défaut: mois courant'
+        )
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        if options['depuis']:
+            try:
+                depuis = date.fromisoformat(options['depuis'])
+            except ValueError:
+                raise CommandError('Format de date invalide, attendu AAAA-MM-JJ')
+        else:
+            depuis = timezone.localdate()
+        depuis = depuis.replace(day=1)
+
+        # Mêmes types que le chemin d'autorisation : les transferts sortants comptent dans les plafonds
+        debits = Transaction.objects.filter(
+            statut='VALIDEE',
+            type_transaction__in=TYPES_SORTANTS,
+            date_validation__gte=timezone.make_aware(datetime.combine(depuis, time.min))
+        )
+
+        self.stdout.write(f'Recalcul des compteurs depuis le {depuis}...')
+
+        with transaction.atomic():
+            supprimes, _ = CompteurDepensesCarte.objects.filter(debut_periode__gte=depuis).delete()
+
+            total = 0
+            for periode, troncature in (('JOUR', TruncDate), ('MOIS', TruncMonth)):
+                agregats = (
+                    debits
+                    .annotate(debut=troncature('date_validation', output_field=DateField()))
+                    .values('carte_id', 'debut')
+                    .annotate(montant_total=Sum('montant'), nombre=Count('id'))
+                    .order_by()
+                )
+
+                compteurs = []
+                for ligne in agregats.iterator(chunk_size=options['batch_size']):
+                    compteurs.append(CompteurDepensesCarte(
+                        carte_id=ligne['carte_id'],
+                        periode=periode,
+                        debut_periode=ligne['debut'],
+                        montant_total=ligne['montant_total'],
+                        nombre_transactions=ligne['nombre']
+                    ))
+                    if len(compteurs) >= options['batch_size']:
+                        CompteurDepensesCarte.objects.bulk_create(compteurs)
+                        total += len(compteurs)
+                        compteurs = []
+
+                CompteurDepensesCarte.objects.bulk_create(compteurs)
+                total += len(compteurs)
+
+        self.stdout.write(
+            self.style.SUCCESS(f'✅ {total} compteurs recalculés ({supprimes} anciens supprimés)')
+        )
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from transactions.reconciliation import reconcile_balances
+
+
+class Command(BaseCommand):
+    help = 'Réconcilie les soldes des cartes avec les transactions validées depuis le dernier point'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None, help='Processus de réconciliation (défaut: nombre de CPU)')
+        parser.add_argument('--taille-bloc', type=int, default=None, help='Cartes réconciliées par bloc')
+        parser.add_argument(
+            '--complete', action='store_true', default=None,
+            help='Balayage de toutes les cartes (défaut: si le dernier date de plus de BALAYAGE_COMPLET_JOURS jours)'
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write('🔎 Réconciliation des soldes...')
+
+        execution = reconcile_balances(
+            workers=options['workers'],
+            taille_bloc=options['taille_bloc'],
+            complete=options['complete'],
+            progression=lambda traitees, ecarts: self.stdout.write(f'  {traitees} cartes, {ecarts} écarts')
+        )
+
+        style = self.style.WARNING if execution.ecarts_detectes else self.style.SUCCESS
+        self.stdout.write(style(
+            f'✅ {execution.cartes_traitees} cartes réconciliées, {execution.ecarts_detectes} écarts détectés'
+        ))
@@ -0,0 +1,88 @@
+from datetime import date
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Q
+from transactions.exports import parse_period
+from transactions.fees import compute_fee, fee_table
+from transactions.models import Rechargement, Transaction
+
+
+class Command(BaseCommand):
+    help = 'Recalcule les frais des transactions et les commissions des rechargements avec les règles en vigueur'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--depuis', required=True, help='Premier jour recalculé (AAAA-MM-JJ)')
+        parser.add_argument('--jusqu-a', default=None, help='Dernier jour recalculé, inclus (défaut: aujourd\'hui)')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Lignes lues et mises à jour par lot')
+        parser.add_argument(
+            '--cible', choices=['TRANSACTION', 'RECHARGEMENT', 'TOUT'], default='TOUT',
+            help='Lignes recalculées'
+        )
+        parser.add_argument('--dry-run', action='store_true', help='Compte les lignes modifiées sans les écrire')
+
+    def handle(self, *args, **options):
+        try:
+            debut, fin = parse_period(options['depuis'], options['jusqu_a'] or date.today().isoformat())
+        except ValueError as exc:
+            raise CommandError(f'Période invalide: {exc}')
+
+        # Une seule compilation pour tout le recalcul
+        table = fee_table()
+
+        if options['cible'] in ('TRANSACTION', 'TOUT'):
+            modifiees = self.reprice(
+                Transaction.objects.filter(
+                    statut='VALIDEE', date_transaction__gte=debut, date_transaction__lt=fin
+                ),
+                'date_transaction',
+                ['type_transaction', 'carte__type_carte', 'merchant_id', 'montant', 'frais_transaction'],
+                lambda ligne: compute_fee('TRANSACTION', *ligne[:4], table=table),
+                lambda pk, frais: Transaction(id=pk, frais_transaction=frais),
+                'frais_transaction',
+                options,
+            )
+            self.stdout.write(f'  Transactions: {modifiees} frais modifiés')
+
+        if options['cible'] in ('RECHARGEMENT', 'TOUT'):
+            modifies = self.reprice(
+                Rechargement.objects.filter(
+                    statut_paiement='CONFIRME', date_rechargement__gte=debut, date_rechargement__lt=fin
+                ),
+                'date_rechargement',
+                ['mode_paiement', 'carte__type_carte', 'operateur_mobile', 'montant_recharge', 'commission_prelevee'],
+                lambda ligne: compute_fee('RECHARGEMENT', *ligne[:4], table=table),
+                lambda pk, commission: Rechargement(id=pk, commission_prelevee=commission),
+                'commission_prelevee',
+                options,
+            )
+            self.stdout.write(f'  Rechargements: {modifies} commissions modifiées')
+
+        self.stdout.write(self.style.SUCCESS('✅ Recalcul des frais terminé'))
+
+    def reprice(self, queryset, champ_date, champs, calculer, construire, champ_frais, options):
+        """Parcourt le queryset par curseur (date, id) et met à jour les lignes dont le montant change"""
+        modifiees = 0
+        position = None
+        while True:
+            lot = queryset.order_by(champ_date, 'id')
+            if position is not None:
+                lot = lot.filter(
+                    Q(**{f'{champ_date}__gt': position[0]}) | Q(**{champ_date: position[0], 'id__gt': position[1]})
+                )
+            lignes = list(lot.values_list(champ_date, 'id', *champs)[:options['batch_size']])
+            if not lignes:
+                return modifiees
+
+            a_modifier = []
+            for ligne in lignes:
+                actuel = ligne[-1]
+                nouveau = calculer(ligne[2:])
+                if nouveau != actuel:
+                    a_modifier.append(construire(ligne[1], nouveau))
+
+            if a_modifier and not options['dry_run']:
+                with transaction.atomic():
+                    queryset.model.objects.bulk_update(a_modifier, [champ_frais])
+            modifiees += len(a_modifier)
+            position = (lignes[-1][0], lignes[-1][1])
+            self.stdout.write(f'  ... {modifiees} modifiés', ending='\r')
@@ -0,0 +1,96 @@
+import threading
+import time
+import uuid
+from decimal import Decimal
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection, transaction
+from cartes.models import CarteRFID
+from transactions.authorization import apply_transactions
+from transactions.models import Transaction
+
+
+class Command(BaseCommand):
+    help = (
+        'Test de charge des transferts opposés entre deux cartes (A→B et B→A en parallèle). '
+        'Compte les interblocages et mesure le débit ; à lancer sur un environnement de recette. '
+        'Le scoring de fraude s\'applique : au-delà de la vélocité autorisée, les transferts passent en revue '
+        '(les deux cartes sont tout de même verrouillées) ; le paramètre système FRAUDE_ACTIVE le désactive.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('carte_a', help='Identifiant de la première carte')
+        parser.add_argument('carte_b', help='Identifiant de la seconde carte')
+        parser.add_argument('--threads', type=int, default=8, help='Threads concurrents, moitié dans chaque sens')
+        parser.add_argument('--transferts', type=int, default=200, help='Transferts par thread')
+        parser.add_argument('--montant', type=Decimal, default=Decimal('0.01'), help='Montant de chaque transfert')
+
+    def handle(self, *args, **options):
+        cartes = {
+            carte.pk: carte for carte in CarteRFID.objects.filter(pk__in=[options['carte_a'], options['carte_b']])
+        }
+        if len(cartes) != 2:
+            raise CommandError('Les deux cartes doivent exister et être différentes')
+        carte_a, carte_b = (CarteRFID._meta.pk.to_python(options[nom]) for nom in ('carte_a', 'carte_b'))
+        soldes_avant = {pk: carte.solde for pk, carte in cartes.items()}
+
+        resultats = {'VALIDEE': 0, 'ECHOUEE': 0, 'EN_REVUE': 0, 'interblocages': 0, 'erreurs': 0}
+        verrou = threading.Lock()
+
+        def travailleur(source, destination):
+            local = {'VALIDEE': 0, 'ECHOUEE': 0, 'EN_REVUE': 0, 'interblocages': 0, 'erreurs': 0}
+            try:
+                for _ in range(options['transferts']):
+                    try:
+                        with transaction.atomic():
+                            debit = Transaction.objects.create(
+                                carte_id=source,
+                                carte_destination_id=destination,
+                                type_transaction='TRANSFERT',
+                                montant=options['montant'],
+                                solde_avant=0,
+                                solde_apres=0,
+                                reference_interne=f"STRESS_{uuid.uuid4().hex}",
+                                description='Test de charge des transferts',
+                            )
+                            apply_transactions([debit])
+                        local[debit.statut] += 1
+                    except OperationalError as exc:
+                        # PostgreSQL : deadlock detected (SQLSTATE 40P01)
+                        if getattr(exc.__cause__, 'pgcode', None) == '40P01':
+                            local['interblocages'] += 1
+                        else:
+                            local['erreurs'] += 1
+            finally:
+                connection.close()
+                with verrou:
+                    for cle, valeur in local.items():
+                        resultats[cle] += valeur
+
+        threads = [
+            threading.Thread(target=travailleur, args=(carte_a, carte_b) if i % 2 == 0 else (carte_b, carte_a))
+            for i in range(options['threads'])
+        ]
+        self.stdout.write(
+            f"🔁 {options['threads']} threads × {options['transferts']} transferts opposés..."
+        )
+        debut = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        duree = time.monotonic() - debut
+
+        total = sum(resultats[cle] for cle in ('VALIDEE', 'ECHOUEE', 'EN_REVUE'))
+        soldes_apres = dict(CarteRFID.objects.filter(pk__in=cartes).values_list('pk', 'solde'))
+        conservation = sum(soldes_apres.values()) == sum(soldes_avant.values())
+
+        self.stdout.write(f"  Transferts validés : {resultats['VALIDEE']}")
+        self.stdout.write(f"  Transferts refusés : {resultats['ECHOUEE']}")
+        self.stdout.write(f"  Transferts en revue (fraude) : {resultats['EN_REVUE']}")
+        self.stdout.write(f"  Erreurs : {resultats['erreurs']}")
+        self.stdout.write(f"  Durée : {duree:.2f}s, débit : {total / duree:.1f} transferts/s")
+        self.stdout.write(f"  Somme des soldes conservée : {'oui' if conservation else 'NON'}")
+
+        if resultats['interblocages'] or not conservation:
+            raise CommandError(f"{resultats['interblocages']} interblocages détectés")
+        self.stdout.write(self.style.SUCCESS('✅ Aucun interblocage'))
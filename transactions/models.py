@@ -1,6 +1,7 @@
 import uuid
 from django.db import models
 from django.db.models import JSONField
+from django.utils import timezone
 from cartes.models import CarteRFID
 from identites.models import Utilisateur
 
@@ -11,10 +12,12 @@ class Transaction(models.Model):
         ('RETRAIT', 'Retrait'),
         ('RECHARGE', 'Recharge'),
         ('TRANSFERT', 'Transfert'),
+        ('TRANSFERT_RECU', 'Transfert reçu'),
     ]
     
     STATUT_CHOICES = [
         ('EN_COURS', 'En cours'),
+        ('EN_REVUE', 'En revue'),
         ('VALIDEE', 'Validée'),
         ('ECHOUEE', 'Échouée'),
         ('ANNULEE', 'Annulée'),
@@ -42,15 +45,52 @@ class Transaction(models.Model):
     taux_change = models.DecimalField(max_digits=10, decimal_places=6, default=1)
     devise = models.CharField(max_length=3, default='EUR')
     date_transaction = models.DateTimeField(auto_now_add=True)
+    # Date de finalisation : validation, ou échec (agrégats marchands)
     date_validation = models.DateTimeField(null=True, blank=True)
     agent_validateur = models.ForeignKey(Utilisateur, on_delete=models.SET_NULL, null=True, blank=True)
     donnees_brutes = JSONField(default=dict, blank=True)
     signature_transaction = models.CharField(max_length=255, blank=True)
+    # Transfert : carte créditée par la transaction source, et écriture liée
+    # (crédit TRANSFERT_RECU pour le débit TRANSFERT et inversement)
+    carte_destination = models.ForeignKey(
+        CarteRFID, on_delete=models.PROTECT, null=True, blank=True, related_name='transferts_recus'
+    )
+    transaction_liee = models.OneToOneField(
+        'self', on_delete=models.SET_NULL, null=True, blank=True, related_name='+'
+    )
 
     class Meta:
+        # Sous PostgreSQL, la table peut être partitionnée par mois (commande
+        # partition_transactions) : l'unicité des références est alors portée
+        # par la table transactions_cles (voir partitions.py)
         db_table = 'transactions'
         verbose_name = 'Transaction'
         verbose_name_plural = 'Transactions'
+        indexes = [
+            models.Index(fields=['statut', 'date_transaction']),
+            # Pagination par curseur (date_transaction, id)
+            models.Index(fields=['date_transaction', 'id']),
+            # Réconciliation incrémentale : activité validée depuis la dernière exécution,
+            # puis mouvements d'un bloc de cartes depuis leur point de réconciliation
+            models.Index(
+                fields=['date_validation', 'carte'], condition=models.Q(statut='VALIDEE'),
+                name='transactions_validees_date_idx',
+            ),
+            models.Index(
+                fields=['carte', 'date_validation'], condition=models.Q(statut='VALIDEE'),
+                name='transactions_validees_carte_idx',
+            ),
+            # Agrégats marchands : transactions finalisées depuis le dernier rafraîchissement
+            models.Index(fields=['date_validation', 'statut']),
+        ]
+        constraints = [
+            # Idempotence des soumissions de terminal
+            models.UniqueConstraint(
+                fields=['terminal_id', 'reference_externe'],
+                condition=~models.Q(terminal_id='') & ~models.Q(reference_externe=''),
+                name='transactions_terminal_reference_unique',
+            ),
+        ]
 
     def __str__(self):
         return f"Transaction {self.reference_interne}"
@@ -88,6 +128,8 @@ class Rechargement(models.Model):
     statut_paiement = models.CharField(max_length=20, choices=STATUT_PAIEMENT_CHOICES, default='EN_ATTENTE')
     date_rechargement = models.DateTimeField(auto_now_add=True)
     date_confirmation = models.DateTimeField(null=True, blank=True)
+    # Prochaine vérification auprès du fournisseur (repoussée après chaque vérification sans réponse définitive)
+    prochaine_verification = models.DateTimeField(default=timezone.now)
     recu_numero = models.CharField(max_length=100, unique=True)
     donnees_paiement = JSONField(default=dict, blank=True)
 
@@ -95,6 +137,155 @@ class Rechargement(models.Model):
         db_table = 'rechargements'
         verbose_name = 'Rechargement'
         verbose_name_plural = 'Rechargements'
+        indexes = [
+            # Cycle de vérification des paiements en attente
+            models.Index(fields=['statut_paiement', 'prochaine_verification']),
+        ]
 
     def __str__(self):
         return f"Rechargement {self.recu_numero}"
+
+
+class CompteurDepensesCarte(models.Model):
+    PERIODE_CHOICES = [
+        ('JOUR', 'Jour'),
+        ('MOIS', 'Mois'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    carte = models.ForeignKey(CarteRFID, on_delete=models.CASCADE, related_name='compteurs_depenses')
+    periode = models.CharField(max_length=10, choices=PERIODE_CHOICES)
+    debut_periode = models.DateField()
+    montant_total = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    nombre_transactions = models.IntegerField(default=0)
+    date_modification = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'compteurs_depenses_cartes'
+        verbose_name = 'Compteur de dépenses'
+        verbose_name_plural = 'Compteurs de dépenses'
+        unique_together = [('carte', 'periode', 'debut_periode')]
+
+    def __str__(self):
+        return f"{self.carte} {self.periode} {self.debut_periode}: {self.montant_total}"
+
+
+class PointReconciliationCarte(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    carte = models.OneToOneField(CarteRFID, on_delete=models.CASCADE, related_name='point_reconciliation')
+    solde_reconcilie = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    date_coupure = models.DateTimeField()
+    derniere_transaction_id = models.UUIDField(null=True, blank=True)
+    date_derniere_transaction = models.DateTimeField(null=True, blank=True)
+    date_modification = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'points_reconciliation_cartes'
+        verbose_name = 'Point de réconciliation'
+        verbose_name_plural = 'Points de réconciliation'
+
+    def __str__(self):
+        return f"{self.carte} réconciliée au {self.date_coupure}"
+
+
+class ExecutionReconciliation(models.Model):
+    STATUT_CHOICES = [
+        ('EN_COURS', 'En cours'),
+        ('TERMINEE', 'Terminée'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    date_coupure = models.DateTimeField()
+    # Balayage de toutes les cartes (cartes jamais réconciliées, soldes modifiés hors transaction)
+    complete = models.BooleanField(default=False)
+    statut = models.CharField(max_length=20, choices=STATUT_CHOICES, default='EN_COURS')
+    cartes_traitees = models.IntegerField(default=0)
+    ecarts_detectes = models.IntegerField(default=0)
+    date_debut = models.DateTimeField(auto_now_add=True)
+    date_fin = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'executions_reconciliation'
+        verbose_name = 'Exécution de réconciliation'
+        verbose_name_plural = 'Exécutions de réconciliation'
+
+    def __str__(self):
+        return f"Réconciliation du {self.date_coupure} ({self.statut})"
+
+
+class EcartReconciliation(models.Model):
+    STATUT_CHOICES = [
+        ('OUVERT', 'Ouvert'),
+        ('RESOLU', 'Résolu'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    execution = models.ForeignKey(ExecutionReconciliation, on_delete=models.SET_NULL, null=True, blank=True)
+    carte = models.ForeignKey(CarteRFID, on_delete=models.CASCADE)
+    solde_attendu = models.DecimalField(max_digits=15, decimal_places=2)
+    solde_carte = models.DecimalField(max_digits=15, decimal_places=2)
+    ecart = models.DecimalField(max_digits=15, decimal_places=2)
+    nombre_transactions = models.IntegerField(default=0)
+    depuis = models.DateTimeField(null=True, blank=True)
+    statut = models.CharField(max_length=20, choices=STATUT_CHOICES, default='OUVERT')
+    commentaire = models.TextField(blank=True)
+    date_detection = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'ecarts_reconciliation'
+        verbose_name = 'Écart de réconciliation'
+        verbose_name_plural = 'Écarts de réconciliation'
+        indexes = [
+            models.Index(fields=['statut', 'date_detection']),
+        ]
+
+    def __str__(self):
+        return f"Écart {self.ecart} sur {self.carte}"
+
+
+class AgregatMarchand(models.Model):
+    GRANULARITE_CHOICES = [
+        ('HEURE', 'Heure'),
+        ('JOUR', 'Jour'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    granularite = models.CharField(max_length=10, choices=GRANULARITE_CHOICES)
+    debut_periode = models.DateTimeField()
+    merchant_id = models.CharField(max_length=100, blank=True)
+    terminal_id = models.CharField(max_length=100, blank=True)
+    nombre_transactions = models.IntegerField(default=0)
+    nombre_validees = models.IntegerField(default=0)
+    nombre_echecs = models.IntegerField(default=0)
+    montant_total = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+    frais_total = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+    echecs_par_code = JSONField(default=dict, blank=True)
+    date_modification = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'agregats_marchands'
+        verbose_name = 'Agrégat marchand'
+        verbose_name_plural = 'Agrégats marchands'
+        unique_together = ['granularite', 'debut_periode', 'merchant_id', 'terminal_id']
+        indexes = [
+            models.Index(fields=['merchant_id', 'granularite', 'debut_periode']),
+            models.Index(fields=['terminal_id', 'granularite', 'debut_periode']),
+        ]
+
+    def __str__(self):
+        return f"{self.merchant_id or '-'} / {self.terminal_id or '-'} {self.granularite} {self.debut_periode}"
+
+
+class PointAgregation(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    # Transactions finalisées avant cette date intégrées aux agrégats marchands
+    date_filigrane = models.DateTimeField()
+    date_modification = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'points_agregation'
+        verbose_name = "Point d'agrégation"
+        verbose_name_plural = "Points d'agrégation"
+
+    def __str__(self):
+        return f"Agrégats à jour au {self.date_filigrane}"
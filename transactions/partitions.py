@@ -0,0 +1,236 @@
+from datetime import datetime, time, timezone as dt_timezone
+from django.db import connection, transaction
+from django.utils import timezone
+from .models import Transaction
+from .periods import next_month
+
+# Partitionnement mensuel de la table des transactions (PostgreSQL,
+# PARTITION BY RANGE (date_transaction)), mis en place une fois par la
+# commande partition_transactions puis entretenu par
+# create_transaction_partitions et la tâche ensure_transaction_partitions.
+#
+# Une contrainte d'unicité sur une table partitionnée doit contenir la clé
+# de partition : la clé primaire devient (id, date_transaction), et
+# reference_interne ou (terminal_id, reference_externe) ne seraient plus
+# uniques que par mois. Les clés globales sont donc portées par une table
+# non partitionnée, transactions_cles (id, date_transaction,
+# reference_interne, terminal_id, reference_externe), tenue à jour par
+# trigger dans la même instruction : un doublon lève toujours une
+# IntegrityError à l'insertion (idempotence des soumissions de terminal).
+#
+# Les clés étrangères vers transactions.id (rechargements.transaction_id,
+# logs_systeme.transaction_concernee_id, transactions.transaction_liee_id)
+# référencent transactions_cles(id) : l'intégrité référentielle est
+# conservée sans ajouter date_transaction aux tables qui pointent vers une
+# transaction. L'unicité de transaction_liee_id n'est plus vérifiée en base
+# (elle est garantie par la création des transferts).
+#
+# Les requêtes bornées sur date_transaction (reprise par lot, rapports) ne
+# lisent que les partitions concernées ; les lectures par id ou par
+# référence seules parcourent l'index de chaque partition.
+#
+# Une partition par défaut reçoit les lignes hors des mois créés ; elle
+# reste vide tant que les partitions sont créées à l'avance.
+
+TABLE = Transaction._meta.db_table
+TABLE_CLES = f'{TABLE}_cles'
+PARTITION_DEFAUT = f'{TABLE}_defaut'
+COLONNES_CLES = ['id', 'date_transaction', 'reference_interne', 'terminal_id', 'reference_externe']
+
+
+def partition_name(debut_mois):
+    """Nom de la partition d'un mois"""
+    return f'{TABLE}_{debut_mois.year}_{debut_mois.month:02d}'
+
+
+def partition_bounds(debut_mois):
+    """Bornes [début, fin) d'une partition mensuelle, en UTC (la colonne est un timestamptz)"""
+    return (
+        datetime.combine(debut_mois, time.min, tzinfo=dt_timezone.utc),
+        datetime.combine(next_month(debut_mois), time.min, tzinfo=dt_timezone.utc),
+    )
+
+
+def is_partitioned():
+    """Indique si la table des transactions est partitionnée"""
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT 1 FROM pg_partitioned_table p
+            JOIN pg_class c ON c.oid = p.partrelid
+            WHERE c.relname = %s AND c.relnamespace = current_schema()::regnamespace
+            """,
+            [TABLE]
+        )
+        return cursor.fetchone() is not None
+
+
+def existing_partitions():
+    """Noms des partitions existantes"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT child.relname FROM pg_inherits i
+            JOIN pg_class parent ON parent.oid = i.inhparent
+            JOIN pg_class child ON child.oid = i.inhrelid
+            WHERE parent.relname = %s AND parent.relnamespace = current_schema()::regnamespace
+            """,
+            [TABLE]
+        )
+        return {row[0] for row in cursor.fetchall()}
+
+
+def months_between(premier_mois, dernier_mois):
+    """Premiers jours des mois de premier_mois à dernier_mois inclus"""
+    mois = premier_mois.replace(day=1)
+    while mois <= dernier_mois:
+        yield mois
+        mois = next_month(mois)
+
+
+def partition_statement(debut_mois, table=TABLE):
+    """Instruction de création de la partition d'un mois"""
+    debut, fin = partition_bounds(debut_mois)
+    return (
+        f'CREATE TABLE IF NOT EXISTS "{partition_name(debut_mois)}" PARTITION OF "{table}" '
+        f"FOR VALUES FROM ('{debut.isoformat()}') TO ('{fin.isoformat()}')"
+    )
+
+
+def ensure_partitions(mois_a_venir=3, depuis=None):
+    """Crée les partitions mensuelles manquantes jusqu'à mois_a_venir mois après le mois courant.
+
+    Retourne la liste des partitions créées. La création échoue si la
+    partition par défaut contient déjà des lignes du mois.
+    """
+    premier = (depuis or timezone.now().date()).replace(day=1)
+    dernier = premier
+    for _ in range(mois_a_venir):
+        dernier = next_month(dernier)
+
+    existantes = existing_partitions()
+    creees = []
+    with connection.cursor() as cursor:
+        for debut_mois in months_between(premier, dernier):
+            nom = partition_name(debut_mois)
+            if nom not in existantes:
+                cursor.execute(partition_statement(debut_mois))
+                creees.append(nom)
+    return creees
+
+
+def conversion_statements(mois_a_venir=3):
+    """Instructions SQL de conversion de la table existante en table partitionnée.
+
+    Les index et clés étrangères sont relus dans le catalogue : ceux de la
+    table d'origine sont recréés sur la table partitionnée (les index
+    uniques sans la clé de partition deviennent de simples index de
+    recherche), les clés étrangères entrantes sont reportées sur
+    transactions_cles.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT indexname, indexdef FROM pg_indexes WHERE schemaname = current_schema() AND tablename = %s",
+            [TABLE]
+        )
+        index = [
+            (nom, definition) for nom, definition in cursor.fetchall()
+            if nom != f'{TABLE}_pkey'
+        ]
+        cursor.execute(
+            """
+            SELECT conrelid::regclass::text, conname, pg_get_constraintdef(oid) FROM pg_constraint
+            WHERE contype = 'f' AND (conrelid = %s::regclass OR confrelid = %s::regclass)
+            """,
+            [TABLE, TABLE]
+        )
+        cles_etrangeres = cursor.fetchall()
+        cursor.execute(f'SELECT min(date_transaction) FROM "{TABLE}"')
+        plus_ancienne = cursor.fetchone()[0]
+
+    # Mois en UTC, comme les bornes des partitions
+    premier = (plus_ancienne or timezone.now()).astimezone(dt_timezone.utc).date()
+    dernier = timezone.now().date().replace(day=1)
+    for _ in range(mois_a_venir):
+        dernier = next_month(dernier)
+
+    nouvelle = f'{TABLE}_partitionnee'
+    instructions = [
+        # Les vérifications différées en attente empêcheraient la suppression de la table
+        'SET CONSTRAINTS ALL IMMEDIATE',
+        f'LOCK TABLE "{TABLE}" IN ACCESS EXCLUSIVE MODE',
+        f'CREATE TABLE "{nouvelle}" (LIKE "{TABLE}" INCLUDING DEFAULTS INCLUDING STORAGE) '
+        f'PARTITION BY RANGE (date_transaction)',
+        *(partition_statement(debut_mois, nouvelle) for debut_mois in months_between(premier, dernier)),
+        f'CREATE TABLE "{PARTITION_DEFAUT}" PARTITION OF "{nouvelle}" DEFAULT',
+        f'INSERT INTO "{nouvelle}" SELECT * FROM "{TABLE}"',
+
+        # Clés globales
+        f'''CREATE TABLE "{TABLE_CLES}" (
+            id uuid NOT NULL,
+            date_transaction timestamp with time zone NOT NULL,
+            reference_interne varchar(100) NOT NULL,
+            terminal_id varchar(100) NOT NULL,
+            reference_externe varchar(100) NOT NULL
+        )''',
+        f'INSERT INTO "{TABLE_CLES}" SELECT {", ".join(COLONNES_CLES)} FROM "{TABLE}"',
+        f'ALTER TABLE "{TABLE_CLES}" ADD CONSTRAINT "{TABLE_CLES}_pkey" PRIMARY KEY (id)',
+        f'ALTER TABLE "{TABLE_CLES}" ADD CONSTRAINT "{TABLE_CLES}_reference_interne_key" UNIQUE (reference_interne)',
+        f'CREATE UNIQUE INDEX "{TABLE_CLES}_terminal_reference_unique" ON "{TABLE_CLES}" '
+        f"(terminal_id, reference_externe) WHERE terminal_id <> '' AND reference_externe <> ''",
+
+        # Remplacement de la table
+        f'DROP TABLE "{TABLE}" CASCADE',
+        f'ALTER TABLE "{nouvelle}" RENAME TO "{TABLE}"',
+        f'ALTER TABLE "{TABLE}" ADD CONSTRAINT "{TABLE}_pkey" PRIMARY KEY (id, date_transaction)',
+        *(definition.replace('CREATE UNIQUE INDEX', 'CREATE INDEX') for _, definition in index),
+    ]
+
+    for table, nom, definition in cles_etrangeres:
+        if f'REFERENCES {TABLE}(' in definition:
+            definition = definition.replace(f'REFERENCES {TABLE}(', f'REFERENCES {TABLE_CLES}(')
+        instructions.append(f'ALTER TABLE {table} ADD CONSTRAINT "{nom}" {definition}')
+
+    colonnes = ', '.join(COLONNES_CLES)
+    valeurs = ', '.join(f'NEW.{colonne}' for colonne in COLONNES_CLES)
+    instructions += [
+        f'''CREATE OR REPLACE FUNCTION "{TABLE_CLES}_maj"() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                INSERT INTO "{TABLE_CLES}" ({colonnes}) VALUES ({valeurs});
+            ELSIF TG_OP = 'UPDATE' THEN
+                UPDATE "{TABLE_CLES}" SET ({colonnes}) = ({valeurs}) WHERE id = OLD.id;
+            ELSE
+                DELETE FROM "{TABLE_CLES}" WHERE id = OLD.id;
+            END IF;
+            RETURN NULL;
+        END
+        $$''',
+        f'''CREATE OR REPLACE FUNCTION "{TABLE_CLES}_vider"() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            DELETE FROM "{TABLE_CLES}";
+            RETURN NULL;
+        END
+        $$''',
+        f'CREATE TRIGGER "{TABLE_CLES}_maj" AFTER INSERT OR DELETE OR UPDATE OF {colonnes} ON "{TABLE}" '
+        f'FOR EACH ROW EXECUTE FUNCTION "{TABLE_CLES}_maj"()',
+        f'CREATE TRIGGER "{TABLE_CLES}_vider" AFTER TRUNCATE ON "{TABLE}" '
+        f'FOR EACH STATEMENT EXECUTE FUNCTION "{TABLE_CLES}_vider"()',
+        f'ANALYZE "{TABLE}"',
+        f'ANALYZE "{TABLE_CLES}"',
+        'SET CONSTRAINTS ALL DEFERRED',
+    ]
+    return instructions
+
+
+def convert_table(mois_a_venir=3):
+    """Convertit la table des transactions en table partitionnée, en une transaction.
+
+    Retourne les noms des partitions créées.
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        for instruction in conversion_statements(mois_a_venir):
+            cursor.execute(instruction)
+    return sorted(existing_partitions())
@@ -0,0 +1,198 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from .fees import recharge_commission
+from .models import Rechargement, Transaction
+
+# Vérification des paiements de rechargement auprès des fournisseurs
+# (Mobile Money, banque). Les appels réseau sont faits hors de toute
+# transaction de base de données, groupés par fournisseur et exécutés en
+# parallèle sur une session HTTP partagée ; les résultats sont ensuite
+# écrits en masse sous verrou, en ne retenant que les rechargements
+# toujours en attente. Un rechargement resté en attente (ou dont le
+# fournisseur n'a pas répondu) voit sa prochaine vérification repoussée :
+# chaque cycle prend les vérifications les plus anciennement dues, et les
+# paiements bloqués chez le fournisseur ne monopolisent pas le cycle.
+#
+# Contrat d'API attendu d'un fournisseur :
+#   POST {URL}/verifications  {"references": ["...", ...]}
+#   -> {"resultats": {"<reference>": "CONFIRME" | "ECHEC" | "EN_ATTENTE"}}
+
+logger = logging.getLogger(__name__)
+
+STATUTS_FOURNISSEUR = ['CONFIRME', 'ECHEC', 'EN_ATTENTE']
+
+_session = None
+
+
+def get_session():
+    """Session HTTP partagée : connexions réutilisées (keep-alive) par fournisseur"""
+    global _session
+    if _session is None:
+        config = settings.PAYMENT_VERIFICATION
+        adapter = HTTPAdapter(
+            pool_connections=len(settings.PAYMENT_PROVIDERS) or 1,
+            pool_maxsize=config['WORKERS'],
+            max_retries=Retry(total=2, backoff_factor=0.2, allowed_methods=None, status_forcelist=[502, 503, 504]),
+        )
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        _session = session
+    return _session
+
+
+def payment_reference(rechargement):
+    """Référence transmise au fournisseur"""
+    return rechargement['reference_paiement'] or rechargement['recu_numero']
+
+
+def query_provider(mode_paiement, references):
+    """Interroge un fournisseur pour un lot de références et retourne {référence: statut}"""
+    config = settings.PAYMENT_PROVIDERS.get(mode_paiement)
+    if not config or not config.get('URL'):
+        # Pas de fournisseur (espèces) ou fournisseur non configuré : paiement accepté
+        return {reference: 'CONFIRME' for reference in references}
+
+    reponse = get_session().post(
+        f"{config['URL'].rstrip('/')}/verifications",
+        json={'references': references},
+        headers={'Authorization': f"Bearer {config.get('CLE_API', '')}"},
+        timeout=config.get('TIMEOUT', 5),
+    )
+    reponse.raise_for_status()
+    resultats = reponse.json().get('resultats', {})
+    return {
+        reference: resultats.get(reference) if resultats.get(reference) in STATUTS_FOURNISSEUR else 'EN_ATTENTE'
+        for reference in references
+    }
+
+
+def verify_with_providers(rechargements):
+    """Vérifie des rechargements en parallèle, un appel par lot et par fournisseur.
+
+    Retourne ({id: statut}, erreurs) ; un lot dont l'appel échoue reste
+    EN_ATTENTE et son exception est ajoutée aux erreurs.
+    """
+    lots = []
+    par_mode = {}
+    for rechargement in rechargements:
+        par_mode.setdefault(rechargement['mode_paiement'], []).append(rechargement)
+    for mode_paiement, groupe in par_mode.items():
+        taille = settings.PAYMENT_PROVIDERS.get(mode_paiement, {}).get('TAILLE_LOT', 100)
+        for i in range(0, len(groupe), taille):
+            lots.append((mode_paiement, groupe[i:i + taille]))
+
+    def verifier(lot):
+        mode_paiement, groupe = lot
+        references = {payment_reference(rechargement): rechargement['id'] for rechargement in groupe}
+        try:
+            resultats = query_provider(mode_paiement, list(references))
+        except (requests.RequestException, ValueError) as exc:
+            logger.warning(f"Vérification {mode_paiement} indisponible pour {len(groupe)} rechargements: {exc}")
+            return {}, exc
+        return {references[reference]: statut for reference, statut in resultats.items()}, None
+
+    statuts = {}
+    erreurs = []
+    if not lots:
+        return statuts, erreurs
+    with ThreadPoolExecutor(max_workers=min(settings.PAYMENT_VERIFICATION['WORKERS'], len(lots))) as pool:
+        for resultat, erreur in pool.map(verifier, lots):
+            statuts.update(resultat)
+            if erreur is not None:
+                erreurs.append(erreur)
+    return statuts, erreurs
+
+
+def apply_verifications(statuts):
+    """Écrit en masse les résultats de vérification.
+
+    Retourne les transactions de rechargement créées et le nombre de
+    paiements refusés ; l'appelant envoie les transactions en traitement
+    après le commit.
+    """
+    decides = [rechargement_id for rechargement_id, statut in statuts.items() if statut != 'EN_ATTENTE']
+    if not decides:
+        return [], 0
+
+    now = timezone.now()
+    with transaction.atomic():
+        # Un rechargement déjà traité ou verrouillé par un autre vérificateur est ignoré
+        rechargements = list(
+            Rechargement.objects.select_for_update(skip_locked=True, of=('self',)).select_related('carte').filter(
+                id__in=decides, statut_paiement='EN_ATTENTE'
+            )
+        )
+
+        transactions = []
+        for rechargement in rechargements:
+            if statuts[rechargement.id] == 'CONFIRME':
+                trans = Transaction(
+                    carte=rechargement.carte,
+                    type_transaction='RECHARGE',
+                    montant=rechargement.montant_recharge,
+                    solde_avant=rechargement.carte.solde,
+                    solde_apres=rechargement.carte.solde,
+                    reference_interne=f"RECH_{rechargement.recu_numero}",
+                    description=f"Rechargement via {rechargement.mode_paiement}",
+                    statut='EN_COURS',
+                )
+                transactions.append(trans)
+                rechargement.transaction = trans
+                rechargement.commission_prelevee = recharge_commission(rechargement, rechargement.carte.type_carte)
+                rechargement.statut_paiement = 'CONFIRME'
+                rechargement.date_confirmation = now
+            else:
+                rechargement.statut_paiement = 'ECHEC'
+
+        Transaction.objects.bulk_create(transactions)
+        Rechargement.objects.bulk_update(rechargements, [
+            'transaction', 'commission_prelevee', 'statut_paiement', 'date_confirmation',
+        ])
+
+    return transactions, len(rechargements) - len(transactions)
+
+
+def pending_recharges(limit, ids=None):
+    """Rechargements en attente à vérifier, sans verrou : vérifications dues les plus anciennes d'abord"""
+    queryset = Rechargement.objects.filter(statut_paiement='EN_ATTENTE')
+    if ids is not None:
+        queryset = queryset.filter(id__in=ids)
+    else:
+        queryset = queryset.filter(prochaine_verification__lte=timezone.now())
+    return list(queryset.order_by('prochaine_verification', 'id').values(
+        'id', 'mode_paiement', 'reference_paiement', 'recu_numero'
+    )[:limit])
+
+
+def postpone_verifications(ids):
+    """Repousse la prochaine vérification des rechargements restés en attente"""
+    if not ids:
+        return 0
+    prochaine = timezone.now() + timedelta(seconds=settings.PAYMENT_VERIFICATION['INTERVALLE_RELANCE'])
+    return Rechargement.objects.filter(id__in=ids, statut_paiement='EN_ATTENTE').update(
+        prochaine_verification=prochaine
+    )
+
+
+def verify_recharges(ids=None, limit=None):
+    """Cycle complet : lecture, vérification hors verrou, écriture en masse.
+
+    Retourne (rechargements vérifiés, transactions de rechargement créées,
+    paiements refusés, erreurs des fournisseurs injoignables).
+    """
+    rechargements = pending_recharges(limit or settings.PAYMENT_VERIFICATION['TAILLE_CYCLE'], ids)
+    statuts, erreurs = verify_with_providers(rechargements)
+    transactions, echecs = apply_verifications(statuts)
+    postpone_verifications([
+        rechargement['id'] for rechargement in rechargements
+        if statuts.get(rechargement['id'], 'EN_ATTENTE') == 'EN_ATTENTE'
+    ])
+    return len(rechargements), transactions, echecs, erreurs
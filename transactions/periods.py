@@ -0,0 +1,19 @@
+from datetime import datetime, time, timedelta
+from django.utils import timezone
+
+# Bornes de périodes pour les requêtes sur la table des transactions. Les
+# filtres sur date_transaction sont des intervalles semi-ouverts [début,
+# fin) sur la colonne brute : un filtre du type date_transaction__date=...
+# applique une conversion sur la colonne et empêche l'usage de l'index, et
+# l'élagage des partitions mensuelles quand la table est partitionnée.
+
+
+def day_bounds(jour):
+    """Intervalle [début, fin) d'une journée, dans le fuseau courant"""
+    debut = timezone.make_aware(datetime.combine(jour, time.min))
+    return debut, debut + timedelta(days=1)
+
+
+def next_month(debut_mois):
+    """Premier jour du mois suivant"""
+    return (debut_mois + timedelta(days=32)).replace(day=1)
@@ -0,0 +1,175 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from cartes.models import CarteRFID
+from .authorization import signed_amount
+from . import reconciliation_worker
+from .models import EcartReconciliation, ExecutionReconciliation, PointReconciliationCarte, Transaction
+
+# Réconciliation incrémentale des soldes. Chaque carte garde un point de
+# réconciliation (solde attendu à une date de coupure) : une exécution ne
+# relit que les transactions validées depuis la coupure précédente de la
+# carte et ne traite que les cartes ayant eu une activité, trouvées par
+# l'index partiel des transactions validées. Les cartes jamais réconciliées
+# et les soldes modifiés hors transaction sont couverts par un balayage
+# complet de toutes les cartes, au plus tous les BALAYAGE_COMPLET_JOURS
+# jours. Chaque bloc de cartes est lu dans
+# un instantané REPEATABLE READ : soldes des cartes et transactions y sont
+# cohérents entre eux, y compris pendant l'autorisation en continu.
+
+
+def start_execution(complete=None):
+    """Ouvre une exécution avec sa date de coupure.
+
+    complete=None lance un balayage complet si aucun n'a abouti depuis
+    BALAYAGE_COMPLET_JOURS jours, sinon une exécution incrémentale.
+    """
+    config = settings.TRANSACTION_RECONCILIATION
+    maintenant = timezone.now()
+    if complete is None:
+        complete = not ExecutionReconciliation.objects.filter(
+            complete=True, statut='TERMINEE',
+            date_coupure__gte=maintenant - timedelta(days=config['BALAYAGE_COMPLET_JOURS'])
+        ).exists()
+    return ExecutionReconciliation.objects.create(
+        date_coupure=maintenant - timedelta(seconds=config['MARGE_COUPURE']),
+        complete=complete,
+    )
+
+
+def finish_execution(execution_id):
+    """Clôture une exécution"""
+    ExecutionReconciliation.objects.filter(id=execution_id).update(statut='TERMINEE', date_fin=timezone.now())
+
+
+def candidate_cards(depuis):
+    """Identifiants triés des cartes ayant une transaction validée depuis la dernière exécution terminée"""
+    activite = Transaction.objects.filter(statut='VALIDEE', date_validation__gte=depuis)
+    return sorted(activite.order_by().values_list('carte_id', flat=True).distinct())
+
+
+def all_cards():
+    """Identifiants triés de toutes les cartes (balayage complet)"""
+    return list(CarteRFID.objects.order_by('id').values_list('id', flat=True).iterator(chunk_size=10000))
+
+
+def reconcile_block(carte_ids, date_coupure, execution_id=None):
+    """Réconcilie un bloc de cartes et retourne (cartes traitées, écarts)"""
+    with transaction.atomic():
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+
+        soldes = dict(CarteRFID.objects.filter(id__in=carte_ids).values_list('id', 'solde'))
+        points = {
+            point.carte_id: point
+            for point in PointReconciliationCarte.objects.filter(carte_id__in=soldes)
+        }
+
+        # Une requête par date de coupure précédente : les cartes d'un bloc
+        # ont presque toutes été réconciliées lors de la même exécution
+        groupes = {}
+        for carte_id in soldes:
+            point = points.get(carte_id)
+            groupes.setdefault(point.date_coupure if point else None, []).append(carte_id)
+
+        mouvements = {carte_id: [] for carte_id in soldes}
+        for depuis, ids in groupes.items():
+            queryset = Transaction.objects.filter(carte_id__in=ids, statut='VALIDEE')
+            if depuis is not None:
+                queryset = queryset.filter(date_validation__gte=depuis)
+            for ligne in queryset.order_by('carte_id', 'date_validation', 'id').values_list(
+                'carte_id', 'id', 'date_validation', 'type_transaction', 'montant'
+            ).iterator(chunk_size=5000):
+                mouvements[ligne[0]].append(ligne[1:])
+
+        nouveaux, modifies, ecarts = [], [], []
+        for carte_id, solde_carte in soldes.items():
+            point = points.get(carte_id)
+            solde_attendu = point.solde_reconcilie if point else Decimal('0')
+            solde_coupure = solde_attendu
+            derniere = None
+            for trans_id, date_validation, type_transaction, montant in mouvements[carte_id]:
+                delta = signed_amount(type_transaction, montant)
+                solde_attendu += delta
+                if date_validation < date_coupure:
+                    solde_coupure += delta
+                    derniere = (trans_id, date_validation)
+
+            if solde_attendu != solde_carte:
+                ecarts.append(EcartReconciliation(
+                    execution_id=execution_id,
+                    carte_id=carte_id,
+                    solde_attendu=solde_attendu,
+                    solde_carte=solde_carte,
+                    ecart=solde_carte - solde_attendu,
+                    nombre_transactions=len(mouvements[carte_id]),
+                    depuis=point.date_coupure if point else None,
+                ))
+                # Le point repart du solde réel : seul un nouvel écart sera signalé
+                solde_coupure += solde_carte - solde_attendu
+
+            if point is None:
+                point = PointReconciliationCarte(carte_id=carte_id)
+                nouveaux.append(point)
+            else:
+                modifies.append(point)
+            point.solde_reconcilie = solde_coupure
+            point.date_coupure = date_coupure
+            if derniere:
+                point.derniere_transaction_id, point.date_derniere_transaction = derniere
+
+        PointReconciliationCarte.objects.bulk_create(nouveaux)
+        PointReconciliationCarte.objects.bulk_update(
+            modifies,
+            ['solde_reconcilie', 'date_coupure', 'derniere_transaction_id', 'date_derniere_transaction']
+        )
+        EcartReconciliation.objects.bulk_create(ecarts)
+
+        if execution_id:
+            ExecutionReconciliation.objects.filter(id=execution_id).update(
+                cartes_traitees=F('cartes_traitees') + len(soldes),
+                ecarts_detectes=F('ecarts_detectes') + len(ecarts),
+            )
+
+    return len(soldes), len(ecarts)
+
+
+def card_blocks(execution, taille_bloc):
+    """Découpe les cartes candidates d'une exécution en blocs"""
+    precedente = ExecutionReconciliation.objects.filter(
+        statut='TERMINEE', date_coupure__lt=execution.date_coupure
+    ).order_by('-date_coupure').first()
+    if execution.complete or precedente is None:
+        cartes = all_cards()
+    else:
+        cartes = candidate_cards(precedente.date_coupure)
+    return [cartes[i:i + taille_bloc] for i in range(0, len(cartes), taille_bloc)]
+
+
+def reconcile_balances(workers=None, taille_bloc=None, complete=None, progression=None):
+    """Exécute une réconciliation en répartissant les blocs sur un pool de processus"""
+    taille_bloc = taille_bloc or settings.TRANSACTION_RECONCILIATION['TAILLE_BLOC']
+    execution = start_execution(complete)
+    blocs = card_blocks(execution, taille_bloc)
+    # Chaque processus ouvre sa propre connexion à la base
+    connection.close()
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=reconciliation_worker.init_worker,
+    ) as pool:
+        taches = [(bloc, execution.date_coupure, execution.id) for bloc in blocs]
+        for traitees, ecarts in pool.map(reconciliation_worker.reconcile_block, taches):
+            if progression:
+                progression(traitees, ecarts)
+
+    finish_execution(execution.id)
+    execution.refresh_from_db()
+    return execution
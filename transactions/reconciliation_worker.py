@@ -0,0 +1,13 @@
+# Point d'entrée des processus du pool de réconciliation. Ce module est
+# importé avant django.setup() dans les processus lancés en mode spawn :
+# il ne doit importer aucun modèle au chargement.
+
+
+def init_worker():
+    import django
+    django.setup()
+
+
+def reconcile_block(args):
+    from .reconciliation import reconcile_block
+    return reconcile_block(*args)
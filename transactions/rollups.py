@@ -0,0 +1,214 @@
+from collections import Counter
+from datetime import timedelta
+from decimal import Decimal
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+from .models import AgregatMarchand, PointAgregation, Transaction
+from .periods import day_bounds
+
+# Agrégats par marchand et terminal, à l'heure et au jour. Un créneau est
+# toujours recalculé en entier depuis la table des transactions puis
+# remplacé : le recalcul est idempotent et peut être relancé sur n'importe
+# quelle période. Le rafraîchissement périodique ne recalcule que les
+# heures (de date_transaction) des transactions finalisées depuis le
+# dernier rafraîchissement, quelle que soit leur ancienneté : validations
+# après revue, retraitements, lots en attente depuis des jours. Les
+# tableaux de bord ne lisent que les agrégats.
+
+STATUTS_AGREGES = ['VALIDEE', 'ECHOUEE']
+
+
+def hour_start(instant):
+    """Début de l'heure (locale) contenant un instant"""
+    return timezone.localtime(instant).replace(minute=0, second=0, microsecond=0)
+
+
+def _bucket(buckets, granularite, debut_periode, merchant_id, terminal_id):
+    key = (debut_periode, merchant_id, terminal_id)
+    if key not in buckets:
+        buckets[key] = AgregatMarchand(
+            granularite=granularite,
+            debut_periode=debut_periode,
+            merchant_id=merchant_id,
+            terminal_id=terminal_id,
+            montant_total=Decimal('0'),
+            frais_total=Decimal('0'),
+            echecs_par_code={},
+        )
+    return buckets[key]
+
+
+def rebuild_hours(debut, fin):
+    """Recalcule les agrégats horaires de [debut, fin), bornes alignées sur l'heure"""
+    lignes = Transaction.objects.filter(
+        date_transaction__gte=debut,
+        date_transaction__lt=fin,
+        statut__in=STATUTS_AGREGES,
+    ).annotate(heure=TruncHour('date_transaction')).values(
+        'heure', 'merchant_id', 'terminal_id', 'statut', 'code_erreur'
+    ).annotate(
+        nombre=Count('id'),
+        montant=Sum('montant'),
+        frais=Sum('frais_transaction'),
+    ).order_by()
+
+    buckets = {}
+    for ligne in lignes:
+        agregat = _bucket(buckets, 'HEURE', ligne['heure'], ligne['merchant_id'], ligne['terminal_id'])
+        agregat.nombre_transactions += ligne['nombre']
+        if ligne['statut'] == 'VALIDEE':
+            agregat.nombre_validees += ligne['nombre']
+            agregat.montant_total += ligne['montant']
+            agregat.frais_total += ligne['frais']
+        else:
+            agregat.nombre_echecs += ligne['nombre']
+            code = ligne['code_erreur'] or 'INCONNU'
+            agregat.echecs_par_code[code] = agregat.echecs_par_code.get(code, 0) + ligne['nombre']
+
+    with transaction.atomic():
+        AgregatMarchand.objects.filter(
+            granularite='HEURE', debut_periode__gte=debut, debut_periode__lt=fin
+        ).delete()
+        AgregatMarchand.objects.bulk_create(buckets.values(), batch_size=1000)
+    return len(buckets)
+
+
+def rebuild_day(jour):
+    """Recalcule les agrégats d'une journée à partir des agrégats horaires"""
+    debut, fin = day_bounds(jour)
+    buckets = {}
+    for horaire in AgregatMarchand.objects.filter(
+        granularite='HEURE', debut_periode__gte=debut, debut_periode__lt=fin
+    ).iterator(chunk_size=2000):
+        agregat = _bucket(buckets, 'JOUR', debut, horaire.merchant_id, horaire.terminal_id)
+        agregat.nombre_transactions += horaire.nombre_transactions
+        agregat.nombre_validees += horaire.nombre_validees
+        agregat.nombre_echecs += horaire.nombre_echecs
+        agregat.montant_total += horaire.montant_total
+        agregat.frais_total += horaire.frais_total
+        for code, nombre in horaire.echecs_par_code.items():
+            agregat.echecs_par_code[code] = agregat.echecs_par_code.get(code, 0) + nombre
+
+    with transaction.atomic():
+        AgregatMarchand.objects.filter(granularite='JOUR', debut_periode=debut).delete()
+        AgregatMarchand.objects.bulk_create(buckets.values(), batch_size=1000)
+    return len(buckets)
+
+
+def rebuild_rollups(debut, fin):
+    """Recalcule les agrégats horaires puis journaliers couvrant [debut, fin)"""
+    debut = hour_start(debut)
+    horaires = rebuild_hours(debut, fin)
+    jour = timezone.localdate(debut)
+    dernier_jour = timezone.localdate(fin - timedelta(microseconds=1))
+    journaliers = 0
+    while jour <= dernier_jour:
+        journaliers += rebuild_day(jour)
+        jour += timedelta(days=1)
+    return horaires, journaliers
+
+
+def finalized_hours(depuis, jusqua):
+    """Heures (de date_transaction) des transactions finalisées dans [depuis, jusqua), triées"""
+    return sorted(Transaction.objects.filter(
+        date_validation__gte=depuis,
+        date_validation__lt=jusqua,
+        statut__in=STATUTS_AGREGES,
+    ).annotate(heure=TruncHour('date_transaction')).values_list('heure', flat=True).distinct().order_by())
+
+
+def rebuild_hour_list(heures):
+    """Recalcule une liste triée d'heures, par plages d'heures consécutives, puis leurs journées"""
+    horaires = 0
+    jours = set()
+    i = 0
+    while i < len(heures):
+        j = i
+        while j + 1 < len(heures) and heures[j + 1] - heures[j] == timedelta(hours=1):
+            j += 1
+        horaires += rebuild_hours(heures[i], heures[j] + timedelta(hours=1))
+        jours.update(timezone.localdate(heure) for heure in heures[i:j + 1])
+        i = j + 1
+    journaliers = sum(rebuild_day(jour) for jour in sorted(jours))
+    return horaires, journaliers
+
+
+def refresh_rollups(now=None):
+    """Rafraîchissement incrémental : recalcule les heures touchées par les transactions finalisées depuis le filigrane"""
+    now = now or timezone.now()
+    config = settings.TRANSACTION_ROLLUPS
+    with transaction.atomic():
+        # Le point verrouillé sérialise les rafraîchissements concurrents
+        point = PointAgregation.objects.select_for_update().order_by('date_modification').first()
+        if point is None:
+            debut = hour_start(now) - timedelta(hours=config['HEURES_INITIALES'])
+            resultat = rebuild_rollups(debut, hour_start(now) + timedelta(hours=1))
+            PointAgregation.objects.create(date_filigrane=now)
+            return resultat
+
+        depuis = point.date_filigrane - timedelta(seconds=config['RECOUVREMENT'])
+        resultat = rebuild_hour_list(finalized_hours(depuis, now))
+        point.date_filigrane = now
+        point.save(update_fields=['date_filigrane', 'date_modification'])
+    return resultat
+
+
+REGROUPEMENTS = {
+    'jour': 'debut_periode',
+    'heure': 'debut_periode',
+    'marchand': 'merchant_id',
+    'terminal': 'terminal_id',
+}
+
+
+def rollup_summary(debut, fin, merchant_id=None, terminal_id=None, par=None):
+    """Totaux d'une période [debut, fin) par somme des agrégats, éventuellement ventilés"""
+    queryset = AgregatMarchand.objects.filter(
+        granularite='HEURE' if par == 'heure' else 'JOUR',
+        debut_periode__gte=debut,
+        debut_periode__lt=fin,
+    )
+    if merchant_id is not None:
+        queryset = queryset.filter(merchant_id=merchant_id)
+    if terminal_id is not None:
+        queryset = queryset.filter(terminal_id=terminal_id)
+
+    def vide():
+        return {
+            'nombre_transactions': 0, 'nombre_validees': 0, 'nombre_echecs': 0,
+            'montant_total': Decimal('0'), 'frais_total': Decimal('0'), 'echecs_par_code': Counter(),
+        }
+
+    totaux = vide()
+    series = {}
+    for agregat in queryset.order_by('debut_periode').iterator(chunk_size=2000):
+        cibles = [totaux]
+        if par:
+            cibles.append(series.setdefault(getattr(agregat, REGROUPEMENTS[par]), vide()))
+        for cible in cibles:
+            cible['nombre_transactions'] += agregat.nombre_transactions
+            cible['nombre_validees'] += agregat.nombre_validees
+            cible['nombre_echecs'] += agregat.nombre_echecs
+            cible['montant_total'] += agregat.montant_total
+            cible['frais_total'] += agregat.frais_total
+            cible['echecs_par_code'].update(agregat.echecs_par_code)
+
+    resultat = {'totaux': _serialize(totaux)}
+    if par:
+        resultat['series'] = [
+            {par: cle.isoformat() if hasattr(cle, 'isoformat') else cle, **_serialize(valeurs)}
+            for cle, valeurs in series.items()
+        ]
+    return resultat
+
+
+def _serialize(valeurs):
+    return {
+        **valeurs,
+        'montant_total': str(valeurs['montant_total']),
+        'frais_total': str(valeurs['frais_total']),
+        'echecs_par_code': dict(valeurs['echecs_par_code']),
+    }
@@ -1,11 +1,103 @@
+from decimal import Decimal
 from rest_framework import serializers
+from cartes.cache import lookup_card
+from cartes.models import CarteRFID
 from .models import Transaction, Rechargement
 
 
 class TransactionSerializer(serializers.ModelSerializer):
+    # Passage sur terminal : la carte peut être désignée par son code_uid, résolu par le cache des cartes
+    code_uid = serializers.CharField(max_length=100, write_only=True, required=False)
+
     class Meta:
         model = Transaction
         fields = '__all__'
+        extra_kwargs = {
+            'solde_avant': {'required': False},
+            'solde_apres': {'required': False},
+            'transaction_liee': {'read_only': True},
+            # Seules les colonnes utiles sont lues (pas de clé de chiffrement)
+            'carte': {'required': False, 'queryset': CarteRFID.objects.only('id', 'solde')},
+        }
+
+    def validate(self, attrs):
+        code_uid = attrs.pop('code_uid', None)
+        if attrs.get('carte') is None:
+            if not code_uid:
+                raise serializers.ValidationError({'carte': 'Carte ou code_uid requis'})
+            projection = lookup_card(code_uid)
+            if projection is None:
+                raise serializers.ValidationError({'code_uid': 'Carte inconnue'})
+            attrs['carte_id'] = projection['id']
+            # Solde non mis en cache : valeur initiale neutre, recalculée au traitement
+            attrs.setdefault('solde_avant', Decimal('0'))
+            attrs.setdefault('solde_apres', Decimal('0'))
+
+        type_transaction = attrs.get('type_transaction')
+        if type_transaction == 'TRANSFERT_RECU':
+            raise serializers.ValidationError(
+                {'type_transaction': 'Les crédits de transfert sont créés par le transfert source'}
+            )
+        if type_transaction == 'TRANSFERT':
+            validate_transfer_cards(attrs.get('carte'), attrs.get('carte_destination'))
+
+        # Les soldes sont recalculés au traitement ; le solde courant sert de valeur initiale
+        carte = attrs.get('carte')
+        if carte is not None:
+            attrs.setdefault('solde_avant', carte.solde)
+            attrs.setdefault('solde_apres', carte.solde)
+        return attrs
+
+
+class TransactionIngestionSerializer(serializers.ModelSerializer):
+    """Transaction bufferisée par un terminal hors ligne.
+
+    La carte et l'unicité de la référence sont vérifiées en masse lors de
+    l'ingestion plutôt qu'élément par élément.
+    """
+    carte = serializers.UUIDField()
+    reference_interne = serializers.CharField(max_length=100)
+    horodatage_terminal = serializers.DateTimeField(required=False)
+
+    class Meta:
+        model = Transaction
+        fields = [
+            'carte', 'type_transaction', 'montant', 'merchant_id', 'merchant_nom',
+            'terminal_id', 'reference_externe', 'reference_interne', 'description',
+            'categorie', 'localisation', 'coordonnees_gps', 'devise', 'donnees_brutes',
+            'horodatage_terminal',
+        ]
+
+    def validate_type_transaction(self, value):
+        if value in ('TRANSFERT', 'TRANSFERT_RECU'):
+            raise serializers.ValidationError('Les transferts ne sont pas acceptés en ingestion hors ligne')
+        return value
+
+
+class TransfertSerializer(serializers.Serializer):
+    """Transfert d'une carte vers une autre"""
+    carte = serializers.PrimaryKeyRelatedField(queryset=CarteRFID.objects.all())
+    carte_destination = serializers.PrimaryKeyRelatedField(queryset=CarteRFID.objects.all())
+    montant = serializers.DecimalField(max_digits=15, decimal_places=2, min_value=Decimal('0.01'))
+    reference_interne = serializers.CharField(max_length=100, required=False)
+    description = serializers.CharField(required=False, allow_blank=True)
+
+    def validate_reference_interne(self, value):
+        if Transaction.objects.filter(reference_interne=value).exists():
+            raise serializers.ValidationError('Référence interne déjà utilisée')
+        return value
+
+    def validate(self, attrs):
+        validate_transfer_cards(attrs['carte'], attrs['carte_destination'])
+        return attrs
+
+
+def validate_transfer_cards(carte, carte_destination):
+    """Vérifie les cartes source et destinataire d'un transfert"""
+    if carte_destination is None:
+        raise serializers.ValidationError({'carte_destination': 'Carte destinataire requise pour un transfert'})
+    if carte is not None and carte.pk == carte_destination.pk:
+        raise serializers.ValidationError({'carte_destination': 'La carte destinataire doit être différente'})
 
 
 class RechargementSerializer(serializers.ModelSerializer):
@@ -0,0 +1,48 @@
+import os
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import mm
+from reportlab.pdfgen import canvas
+
+# Rendu PDF des relevés, sans dépendance à Django : ce module est importé
+# par les processus du pool de génération.
+
+
+def render_statement(releve):
+    """Rend le relevé PDF d'une carte (exécuté dans un processus du pool)"""
+    os.makedirs(os.path.dirname(releve['chemin']), exist_ok=True)
+    pdf = canvas.Canvas(releve['chemin'], pagesize=A4)
+    hauteur = A4[1]
+    colonnes = [15 * mm, 50 * mm, 90 * mm, 115 * mm, 160 * mm, 185 * mm]
+
+    def entete():
+        pdf.setFont('Helvetica-Bold', 14)
+        pdf.drawString(15 * mm, hauteur - 20 * mm, f"Relevé de carte - {releve['mois']}")
+        pdf.setFont('Helvetica', 10)
+        pdf.drawString(15 * mm, hauteur - 28 * mm, f"Carte {releve['numero_serie']} ({releve['type_carte']})")
+        pdf.drawString(15 * mm, hauteur - 34 * mm, f"Titulaire: {releve['titulaire']}")
+        pdf.setFont('Helvetica-Bold', 9)
+        for x, titre in zip(colonnes, ['Date', 'Référence', 'Type', 'Marchand', 'Montant', 'Solde']):
+            pdf.drawString(x, hauteur - 46 * mm, titre)
+        pdf.setFont('Helvetica', 9)
+        return hauteur - 52 * mm
+
+    y = entete()
+    pdf.drawString(colonnes[0], y, "Solde d'ouverture")
+    pdf.drawRightString(200 * mm, y, releve['solde_ouverture'])
+    y -= 6 * mm
+
+    for ligne in releve['lignes']:
+        if y < 20 * mm:
+            pdf.showPage()
+            y = entete()
+        for x, valeur in zip(colonnes[:4], ligne[:4]):
+            pdf.drawString(x, y, valeur[:28])
+        pdf.drawRightString(colonnes[5] - 3 * mm, y, ligne[4])
+        pdf.drawRightString(200 * mm, y, ligne[5])
+        y -= 5 * mm
+
+    pdf.setFont('Helvetica-Bold', 10)
+    pdf.drawString(colonnes[0], max(y - 4 * mm, 12 * mm), 'Solde de clôture')
+    pdf.drawRightString(200 * mm, max(y - 4 * mm, 12 * mm), releve['solde_cloture'])
+    pdf.save()
+    return releve['chemin']
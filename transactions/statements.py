@@ -0,0 +1,155 @@
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from django.conf import settings
+from django.utils import timezone
+from cartes.models import CarteRFID
+from .models import Transaction
+from .periods import day_bounds, next_month
+from .statement_pdf import render_statement
+
+# Relevés mensuels par carte. Les cartes sont traitées par blocs dans
+# l'ordre de leur identifiant : une requête charge les transactions de
+# tout le bloc, le rendu PDF est réparti sur un pool de processus et un
+# point de reprise est écrit après chaque bloc terminé. Les processus du
+# pool sont lancés en mode spawn et n'ouvrent aucune connexion à la base.
+
+
+def statements_directory(mois):
+    """Répertoire des relevés d'un mois"""
+    return os.path.join(settings.MEDIA_ROOT, 'releves', f'{mois:%Y-%m}')
+
+
+def statement_path(mois, carte_id):
+    """Chemin réparti sur deux niveaux de sous-répertoires (ab/cd/<carte>.pdf)"""
+    cle = carte_id.replace('-', '')
+    return os.path.join(statements_directory(mois), cle[:2], cle[2:4], f'{carte_id}.pdf')
+
+
+def load_checkpoint(mois):
+    """Point de reprise de la génération d'un mois"""
+    chemin = os.path.join(statements_directory(mois), 'checkpoint.json')
+    if not os.path.exists(chemin):
+        return {'derniere_carte': None, 'generes': 0}
+    with open(chemin) as fichier:
+        return json.load(fichier)
+
+
+def save_checkpoint(mois, checkpoint):
+    """Enregistre le point de reprise après un bloc terminé"""
+    # Écriture atomique : un arrêt brutal laisse l'ancien point de reprise intact
+    chemin = os.path.join(statements_directory(mois), 'checkpoint.json')
+    temporaire = f'{chemin}.tmp'
+    with open(temporaire, 'w') as fichier:
+        json.dump(checkpoint, fichier)
+    os.replace(temporaire, chemin)
+
+
+def fetch_block(mois, derniere_carte, taille_bloc):
+    """Charge un bloc de cartes et toutes leurs transactions du mois"""
+    debut, _ = day_bounds(mois)
+    fin, _ = day_bounds(next_month(mois))
+
+    cartes = CarteRFID.objects.order_by('id')
+    if derniere_carte:
+        cartes = cartes.filter(id__gt=derniere_carte)
+    cartes = list(cartes.values(
+        'id', 'numero_serie', 'type_carte', 'solde',
+        'personne__nom', 'personne__prenom', 'entreprise__raison_sociale',
+    )[:taille_bloc])
+    if not cartes:
+        return []
+
+    ids = [carte['id'] for carte in cartes]
+    mouvements = {carte_id: [] for carte_id in ids}
+    for ligne in Transaction.objects.filter(
+        carte_id__in=ids,
+        statut='VALIDEE',
+        date_transaction__gte=debut,
+        date_transaction__lt=fin
+    ).order_by('carte_id', 'date_transaction', 'id').values_list(
+        'carte_id', 'date_transaction', 'reference_interne', 'type_transaction',
+        'merchant_nom', 'montant', 'solde_avant', 'solde_apres'
+    ).iterator(chunk_size=5000):
+        mouvements[ligne[0]].append(ligne[1:])
+
+    # Solde des cartes sans mouvement : dernier solde connu avant le mois,
+    # sinon solde avant le premier mouvement après le mois, sinon solde actuel
+    sans_mouvement = [carte_id for carte_id in ids if not mouvements[carte_id]]
+    soldes_precedents = dict(
+        Transaction.objects.filter(
+            carte_id__in=sans_mouvement,
+            statut='VALIDEE',
+            date_transaction__lt=debut
+        ).order_by('carte_id', '-date_transaction').distinct('carte_id').values_list('carte_id', 'solde_apres')
+    ) if sans_mouvement else {}
+    sans_historique = [carte_id for carte_id in sans_mouvement if carte_id not in soldes_precedents]
+    soldes_suivants = dict(
+        Transaction.objects.filter(
+            carte_id__in=sans_historique,
+            statut='VALIDEE',
+            date_transaction__gte=fin
+        ).order_by('carte_id', 'date_transaction').distinct('carte_id').values_list('carte_id', 'solde_avant')
+    ) if sans_historique else {}
+
+    releves = []
+    for carte in cartes:
+        lignes = mouvements[carte['id']]
+        if lignes:
+            solde_ouverture, solde_cloture = lignes[0][5], lignes[-1][6]
+        else:
+            solde_ouverture = solde_cloture = soldes_precedents.get(
+                carte['id'], soldes_suivants.get(carte['id'], carte['solde'])
+            )
+        titulaire = carte['entreprise__raison_sociale'] or (
+            f"{carte['personne__prenom'] or ''} {carte['personne__nom'] or ''}".strip()
+        )
+        releves.append({
+            'carte_id': str(carte['id']),
+            'numero_serie': carte['numero_serie'],
+            'type_carte': carte['type_carte'],
+            'titulaire': titulaire,
+            'mois': f'{mois:%m/%Y}',
+            'chemin': statement_path(mois, str(carte['id'])),
+            'solde_ouverture': str(solde_ouverture),
+            'solde_cloture': str(solde_cloture),
+            'lignes': [
+                (
+                    timezone.localtime(date_transaction).strftime('%d/%m/%Y %H:%M'), reference, type_transaction,
+                    merchant_nom, str(montant), str(solde_apres)
+                )
+                for date_transaction, reference, type_transaction, merchant_nom, montant, _, solde_apres in lignes
+            ],
+        })
+    return releves
+
+
+def generate_statements(mois, workers=None, taille_bloc=500, recommencer=False, progression=None):
+    """Génère les relevés d'un mois, en reprenant au dernier bloc terminé.
+
+    Retourne le nombre total de relevés générés pour le mois.
+    """
+    mois = date(mois.year, mois.month, 1)
+    os.makedirs(statements_directory(mois), exist_ok=True)
+    checkpoint = {'derniere_carte': None, 'generes': 0} if recommencer else load_checkpoint(mois)
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        while True:
+            releves = fetch_block(mois, checkpoint['derniere_carte'], taille_bloc)
+            if not releves:
+                break
+
+            for _ in pool.map(render_statement, releves, chunksize=max(1, len(releves) // 32)):
+                pass
+
+            checkpoint = {
+                'derniere_carte': releves[-1]['carte_id'],
+                'generes': checkpoint['generes'] + len(releves),
+            }
+            save_checkpoint(mois, checkpoint)
+            if progression:
+                progression(checkpoint)
+
+    return checkpoint['generes']
@@ -1,201 +1,430 @@
-from celery import shared_task
+from celery import chord, shared_task
+from django.conf import settings
 from django.utils import timezone
 from django.db import transaction
+from datetime import date, datetime, timedelta
 from decimal import Decimal
 import logging
-from .models import Transaction, Rechargement
+import os
+import time
+import uuid
+from .models import Transaction
+from .authorization import apply_transactions
+from .lanes import lane_for_carte, lane_queue, record_lane_metrics
+from .idempotency import remember_result
+from .exports import export_queryset, parse_period, write_xlsx
+from .geovelocity import detect_impossible_travel
+from .payments import verify_recharges
+from .rollups import refresh_rollups
+from .usage import flush_usage
+from .partitions import ensure_partitions, is_partitioned
+from .reconciliation import card_blocks, finish_execution, reconcile_block, start_execution
 from cartes.models import CarteRFID
 from notifications.models import Notification
+from notifications.outbox import notifier
 from logs.models import LogSysteme
+from logs.retry import retry_or_dead_letter
 
 logger = logging.getLogger(__name__)
 
-@shared_task(bind=True, max_retries=3)
+@shared_task(bind=True)
 def process_transaction(self, transaction_id):
     """Traite une transaction de manière asynchrone"""
     try:
+        debut = time.monotonic()
         with transaction.atomic():
             trans = Transaction.objects.select_for_update().get(id=transaction_id)
             
             if trans.statut != 'EN_COURS':
                 return f"Transaction {transaction_id} déjà traitée"
             
-            carte = trans.carte
-            
-            # Vérifications de sécurité
-            if carte.statut != 'ACTIVE':
-                trans.statut = 'ECHOUEE'
-                trans.code_erreur = 'CARTE_INACTIVE'
-                trans.message_erreur = 'Carte non active'
-                trans.save()
-                return f"Transaction échouée: carte inactive"
-            
-            # Vérification du solde pour les débits
-            if trans.type_transaction in ['ACHAT', 'RETRAIT']:
-                if carte.solde < trans.montant:
-                    trans.statut = 'ECHOUEE'
-                    trans.code_erreur = 'SOLDE_INSUFFISANT'
-                    trans.message_erreur = 'Solde insuffisant'
-                    trans.save()
-                    
-                    # Notification de solde insuffisant
-                    create_notification_task.delay(
-                        str(carte.personne.id if carte.personne else carte.entreprise.id),
-                        'WARNING',
-                        'Solde insuffisant',
-                        f'Tentative de transaction de {trans.montant}€ refusée pour solde insuffisant.',
-                        'EMAIL'
-                    )
-                    return f"Transaction échouée: solde insuffisant"
-                
-                # Débit du compte
-                carte.solde -= trans.montant
-                trans.solde_apres = carte.solde
-            
-            elif trans.type_transaction == 'RECHARGE':
-                # Crédit du compte
-                carte.solde += trans.montant
-                trans.solde_apres = carte.solde
-            
-            # Mise à jour de la carte
-            carte.derniere_utilisation = timezone.now()
-            carte.nombre_transactions += 1
-            carte.save()
+            # Vérifications, débit/crédit et mise à jour de la carte
+            apply_transactions([trans])
+        
+        record_lane_metrics(
+            lane_for_carte(trans.carte_id), trans.statut, (time.monotonic() - debut) * 1000
+        )
+        
+        if trans.statut == 'VALIDEE':
+            logger.info(f"Transaction {transaction_id} traitée avec succès")
+            return f"Transaction {transaction_id} validée"
+        return f"Transaction échouée: {trans.message_erreur.lower()}"
             
-            # Validation de la transaction
-            trans.statut = 'VALIDEE'
+    except Transaction.DoesNotExist:
+        logger.error(f"Transaction {transaction_id} introuvable")
+        return f"Transaction {transaction_id} introuvable"
+    except Exception as exc:
+        logger.error(f"Erreur lors du traitement de la transaction {transaction_id}: {exc}")
+        
+        retry_or_dead_letter(self, exc)
+        # Marquer la transaction comme échouée après épuisement des tentatives
+        try:
+            trans = Transaction.objects.get(id=transaction_id)
+            trans.statut = 'ECHOUEE'
+            trans.code_erreur = 'ERREUR_SYSTEME'
+            trans.message_erreur = str(exc)
             trans.date_validation = timezone.now()
-            trans.save()
-            
-            # Log de la transaction
-            LogSysteme.objects.create(
-                niveau='INFO',
-                action='TRANSACTION_VALIDEE',
-                module='transactions',
-                carte_concernee=carte,
-                transaction_concernee=trans,
-                message=f'Transaction {trans.reference_interne} validée avec succès'
-            )
+            trans.save(update_fields=['statut', 'code_erreur', 'message_erreur', 'date_validation'])
+        except:
+            pass
+        return f"Échec définitif du traitement après {self.request.retries + 1} tentatives"
+
+def enqueue_transaction(trans):
+    """Envoie une transaction dans la file dédiée à sa carte"""
+    process_transaction.apply_async(
+        args=[str(trans.id)],
+        queue=lane_queue(lane_for_carte(trans.carte_id))
+    )
+
+@shared_task
+def finalize_transactions(transaction_ids):
+    """Journalise et notifie des transactions après leur traitement"""
+    try:
+        transactions = list(
+            Transaction.objects.filter(id__in=transaction_ids).select_related('carte')
+        )
+        
+        logs = []
+        for trans in transactions:
+            if trans.statut == 'VALIDEE':
+                logs.append(LogSysteme(
+                    niveau='INFO',
+                    action='TRANSACTION_VALIDEE',
+                    module='transactions',
+                    carte_concernee=trans.carte,
+                    transaction_concernee=trans,
+                    message=f'Transaction {trans.reference_interne} validée avec succès'
+                ))
+            elif trans.statut == 'ECHOUEE':
+                logs.append(LogSysteme(
+                    niveau='WARNING',
+                    action='TRANSACTION_ECHOUEE',
+                    module='transactions',
+                    carte_concernee=trans.carte,
+                    transaction_concernee=trans,
+                    message=f'Transaction {trans.reference_interne} refusée: {trans.code_erreur}',
+                    code_retour=trans.code_erreur
+                ))
+            elif trans.statut == 'EN_REVUE':
+                logs.append(LogSysteme(
+                    niveau='WARNING',
+                    action='TRANSACTION_EN_REVUE',
+                    module='transactions',
+                    carte_concernee=trans.carte,
+                    transaction_concernee=trans,
+                    message=trans.message_erreur,
+                    donnees_apres=trans.donnees_brutes.get('fraude', {}),
+                    code_retour=trans.code_erreur
+                ))
+        LogSysteme.objects.bulk_create(logs)
+        
+        titulaires = {}
+        notifications = []
+        for trans in transactions:
+            remember_result(trans)
             
-            # Notification de succès
-            if trans.type_transaction == 'RECHARGE':
-                create_notification_task.delay(
-                    str(carte.personne.id if carte.personne else carte.entreprise.id),
+            notification = None
+            if trans.code_erreur == 'SOLDE_INSUFFISANT':
+                notification = (
+                    'WARNING',
+                    'Solde insuffisant',
+                    f'Tentative de transaction de {trans.montant}€ refusée pour solde insuffisant.',
+                    'EMAIL'
+                )
+            elif trans.statut == 'VALIDEE' and trans.type_transaction == 'RECHARGE':
+                notification = (
                     'SUCCESS',
                     'Rechargement effectué',
-                    f'Votre carte a été rechargée de {trans.montant}€. Nouveau solde: {carte.solde}€',
+                    f'Votre carte a été rechargée de {trans.montant}€. Nouveau solde: {trans.solde_apres}€',
                     'SMS'
                 )
+            elif trans.statut == 'VALIDEE' and trans.type_transaction == 'TRANSFERT_RECU':
+                notification = (
+                    'SUCCESS',
+                    'Transfert reçu',
+                    f'Vous avez reçu un transfert de {trans.montant}€. Nouveau solde: {trans.solde_apres}€',
+                    'SMS'
+                )
+            if notification is None:
+                continue
             
-            logger.info(f"Transaction {transaction_id} traitée avec succès")
-            return f"Transaction {transaction_id} validée"
-            
-    except Transaction.DoesNotExist:
-        logger.error(f"Transaction {transaction_id} introuvable")
-        return f"Transaction {transaction_id} introuvable"
+            if trans.carte_id not in titulaires:
+                titulaires[trans.carte_id] = get_titulaire_user_id(trans.carte)
+            user_id = titulaires[trans.carte_id]
+            if user_id:
+                type_notif, titre, message, canal = notification
+                notifications.append(Notification(
+                    destinataire_id=user_id,
+                    type_notification=type_notif,
+                    canal=canal,
+                    titre=titre,
+                    message=message,
+                    priorite='NORMALE'
+                ))
+        
+        # Notifications créées et envois publiés en une transaction, relayés par l'outbox
+        with transaction.atomic():
+            notifier(notifications)
+        
+        return f"{len(transactions)} transactions finalisées"
+        
     except Exception as exc:
-        logger.error(f"Erreur lors du traitement de la transaction {transaction_id}: {exc}")
+        logger.error(f"Erreur lors de la finalisation des transactions: {exc}")
+        return f"Erreur: {exc}"
+
+def get_titulaire_user_id(carte):
+    """Retourne l'identifiant de l'utilisateur titulaire d'une carte"""
+    user = None
+    if carte.personne_id:
+        user = carte.personne.utilisateur_set.first()
+    elif carte.entreprise_id:
+        user = carte.entreprise.utilisateur_set.first()
+    return str(user.id) if user else None
+
+def pending_transactions_queryset():
+    """Transactions en attente assez anciennes pour être reprises par lot"""
+    now = timezone.now()
+    seuil = now - timedelta(seconds=settings.TRANSACTION_BATCH['DELAI_MIN'])
+    # Borne basse : la lecture de l'index (statut, date_transaction) se limite aux transactions récentes,
+    # et aux partitions des derniers mois quand la table est partitionnée
+    fenetre = now - timedelta(days=settings.TRANSACTION_BATCH['FENETRE_JOURS'])
+    return Transaction.objects.filter(
+        statut='EN_COURS',
+        date_transaction__gte=fenetre,
+        date_transaction__lt=seuil
+    )
+
+def compute_batch_size(backlog):
+    """Taille de lot adaptée à la profondeur du backlog (mode drain)"""
+    config = settings.TRANSACTION_BATCH
+    taille = config['TAILLE_LOT']
+    while taille < config['TAILLE_LOT_MAX'] and backlog > taille * config['FACTEUR_DRAIN']:
+        taille *= 2
+    return min(taille, config['TAILLE_LOT_MAX'])
+
+def process_transaction_batch(batch_size):
+    """Réserve jusqu'à batch_size transactions en attente et les traite dans une seule transaction DB"""
+    with transaction.atomic():
+        # SKIP LOCKED : les lignes déjà réservées par un autre worker sont ignorées
+        claimed = list(
+            pending_transactions_queryset()
+            .select_for_update(skip_locked=True)
+            .order_by('date_transaction', 'reference_interne')[:batch_size]
+        )
+        apply_transactions(claimed)
+    return len(claimed)
+
+@shared_task
+def drain_pending_transactions(batch_size):
+    """Traite des lots de transactions en attente jusqu'à épuisement ou expiration du délai"""
+    try:
+        deadline = time.monotonic() + settings.TRANSACTION_BATCH['DUREE_MAX']
+        processed = 0
+        while time.monotonic() < deadline:
+            count = process_transaction_batch(batch_size)
+            processed += count
+            if count < batch_size:
+                break
         
-        if self.request.retries < self.max_retries:
-            raise self.retry(countdown=60 * (2 ** self.request.retries), exc=exc)
-        else:
-            # Marquer la transaction comme échouée après épuisement des tentatives
-            try:
-                trans = Transaction.objects.get(id=transaction_id)
-                trans.statut = 'ECHOUEE'
-                trans.code_erreur = 'ERREUR_SYSTEME'
-                trans.message_erreur = str(exc)
-                trans.save()
-            except:
-                pass
-            return f"Échec définitif du traitement après {self.max_retries} tentatives"
+        logger.info(f"{processed} transactions en attente traitées par lots de {batch_size}")
+        return f"{processed} transactions traitées"
+        
+    except Exception as exc:
+        logger.error(f"Erreur lors du traitement par lots des transactions: {exc}")
+        return f"Erreur: {exc}"
 
 @shared_task
 def process_pending_transactions():
     """Traite les transactions en attente"""
     try:
-        pending_transactions = Transaction.objects.filter(
-            statut='EN_COURS',
-            date_transaction__gte=timezone.now() - timezone.timedelta(hours=1)
-        )[:50]
+        config = settings.TRANSACTION_BATCH
+        backlog = pending_transactions_queryset().count()
+        if not backlog:
+            return "Aucune transaction en attente"
         
-        processed = 0
-        for trans in pending_transactions:
-            process_transaction.delay(str(trans.id))
-            processed += 1
+        batch_size = compute_batch_size(backlog)
         
-        logger.info(f"Lancement du traitement de {processed} transactions en attente")
-        return f"Traitement de {processed} transactions lancé"
+        if backlog > config['TAILLE_LOT'] * config['FACTEUR_DRAIN']:
+            # Mode drain : plusieurs workers réservent des lots en parallèle
+            workers = min(config['WORKERS_DRAIN'], -(-backlog // batch_size))
+            for _ in range(workers):
+                drain_pending_transactions.delay(batch_size)
+            logger.info(f"Mode drain: {workers} workers, lots de {batch_size}, backlog {backlog}")
+            return f"Mode drain lancé pour {backlog} transactions"
+        
+        return drain_pending_transactions(batch_size)
         
     except Exception as exc:
         logger.error(f"Erreur lors du traitement des transactions en attente: {exc}")
         return f"Erreur: {exc}"
 
-@shared_task(bind=True, max_retries=3)
+@shared_task
+def export_transactions_xlsx(debut, fin, user_id, statut=None):
+    """Génère un export XLSX des transactions et notifie le demandeur"""
+    try:
+        date_debut, date_fin = parse_period(debut, fin)
+        
+        dossier = os.path.join(settings.MEDIA_ROOT, 'exports')
+        os.makedirs(dossier, exist_ok=True)
+        nom_fichier = f'transactions_{debut}_{fin}_{uuid.uuid4().hex[:8]}.xlsx'
+        
+        lignes = write_xlsx(export_queryset(date_debut, date_fin, statut), os.path.join(dossier, nom_fichier))
+        
+        create_notification_task.delay(
+            user_id,
+            'SUCCESS',
+            'Export des transactions disponible',
+            f'Export du {debut} au {fin} ({lignes} transactions): {settings.MEDIA_URL}exports/{nom_fichier}',
+            'EMAIL'
+        )
+        
+        logger.info(f"Export XLSX des transactions généré: {nom_fichier} ({lignes} lignes)")
+        return f"Export généré: {nom_fichier}"
+        
+    except Exception as exc:
+        logger.error(f"Erreur lors de l'export XLSX des transactions: {exc}")
+        return f"Erreur: {exc}"
+
+@shared_task
+def reconcile_balances():
+    """Lance une réconciliation des soldes (incrémentale, ou balayage complet périodique), un bloc de cartes par tâche"""
+    try:
+        execution = start_execution()
+        blocs = card_blocks(execution, settings.TRANSACTION_RECONCILIATION['TAILLE_BLOC'])
+        if not blocs:
+            finish_execution(execution.id)
+            return "Aucune carte à réconcilier"
+        
+        coupure = execution.date_coupure.isoformat()
+        chord(
+            reconcile_card_block.s([str(carte_id) for carte_id in bloc], coupure, str(execution.id))
+            for bloc in blocs
+        )(finish_reconciliation.si(str(execution.id)))
+        
+        logger.info(f"Réconciliation {execution.id}: {len(blocs)} blocs de cartes lancés")
+        return f"Réconciliation lancée sur {len(blocs)} blocs"
+        
+    except Exception as exc:
+        logger.error(f"Erreur lors du lancement de la réconciliation: {exc}")
+        return f"Erreur: {exc}"
+
+@shared_task
+def reconcile_card_block(carte_ids, date_coupure, execution_id):
+    """Réconcilie un bloc de cartes"""
+    traitees, ecarts = reconcile_block(carte_ids, datetime.fromisoformat(date_coupure), execution_id)
+    if ecarts:
+        logger.warning(f"Réconciliation {execution_id}: {ecarts} écarts sur {traitees} cartes")
+    return ecarts
+
+@shared_task
+def finish_reconciliation(execution_id):
+    """Clôture une exécution de réconciliation"""
+    finish_execution(execution_id)
+    return f"Réconciliation {execution_id} terminée"
+
+@shared_task
+def detect_impossible_travel_task(jour=None):
+    """Détecte les déplacements impossibles de la veille, ou d'un jour donné (AAAA-MM-JJ)"""
+    try:
+        jour = date.fromisoformat(jour) if jour else timezone.localdate() - timedelta(days=1)
+        debut = time.monotonic()
+        passages, signales = detect_impossible_travel(jour)
+        
+        logger.info(
+            f"Géovélocité {jour}: {passages} passages analysés, {signales} déplacements impossibles "
+            f"({time.monotonic() - debut:.1f}s)"
+        )
+        return f"{signales} déplacements impossibles signalés"
+        
+    except Exception as exc:
+        logger.error(f"Erreur lors de la détection des déplacements impossibles: {exc}")
+        return f"Erreur: {exc}"
+
+@shared_task
+def refresh_merchant_rollups():
+    """Rafraîchit les agrégats marchands des dernières heures"""
+    try:
+        horaires, journaliers = refresh_rollups()
+        return f"{horaires} agrégats horaires, {journaliers} agrégats journaliers recalculés"
+        
+    except Exception as exc:
+        logger.error(f"Erreur lors du rafraîchissement des agrégats marchands: {exc}")
+        return f"Erreur: {exc}"
+
+@shared_task
+def flush_card_usage():
+    """Reporte en base les compteurs d'utilisation des cartes cumulés depuis le dernier report"""
+    try:
+        cartes = flush_usage()
+        return f"Compteurs d'utilisation reportés sur {cartes} cartes"
+        
+    except Exception as exc:
+        logger.error(f"Erreur lors du report des compteurs d'utilisation: {exc}")
+        return f"Erreur: {exc}"
+
+@shared_task
+def ensure_transaction_partitions():
+    """Crée à l'avance les partitions mensuelles de la table des transactions"""
+    try:
+        if not is_partitioned():
+            return "Table des transactions non partitionnée"
+        creees = ensure_partitions(settings.TRANSACTION_PARTITIONS['MOIS_AVANCE'])
+        return f"{len(creees)} partitions créées"
+        
+    except Exception as exc:
+        logger.error(f"Erreur lors de la création des partitions de transactions: {exc}")
+        return f"Erreur: {exc}"
+
+@shared_task(bind=True)
 def process_rechargement(self, rechargement_id):
-    """Traite un rechargement de manière asynchrone"""
+    """Vérifie le paiement d'un rechargement puis crédite la carte"""
     try:
-        with transaction.atomic():
-            rechargement = Rechargement.objects.select_for_update().get(id=rechargement_id)
-            
-            if rechargement.statut_paiement != 'EN_ATTENTE':
-                return f"Rechargement {rechargement_id} déjà traité"
-            
-            # Simulation de la vérification du paiement
-            # Ici vous intégreriez avec votre système de paiement
-            payment_verified = verify_payment(rechargement)
-            
-            if payment_verified:
-                # Création de la transaction de rechargement
-                trans = Transaction.objects.create(
-                    carte=rechargement.carte,
-                    type_transaction='RECHARGE',
-                    montant=rechargement.montant_recharge,
-                    solde_avant=rechargement.carte.solde,
-                    reference_interne=f"RECH_{rechargement.recu_numero}",
-                    description=f"Rechargement via {rechargement.mode_paiement}",
-                    statut='EN_COURS'
-                )
-                
-                rechargement.transaction = trans
-                rechargement.statut_paiement = 'CONFIRME'
-                rechargement.date_confirmation = timezone.now()
-                rechargement.save()
-                
-                # Traitement de la transaction
-                process_transaction.delay(str(trans.id))
-                
-                logger.info(f"Rechargement {rechargement_id} confirmé")
-                return f"Rechargement {rechargement_id} confirmé"
-            else:
-                rechargement.statut_paiement = 'ECHEC'
-                rechargement.save()
-                
-                logger.warning(f"Rechargement {rechargement_id} échoué - paiement non vérifié")
-                return f"Rechargement {rechargement_id} échoué"
+        # L'appel au fournisseur est fait hors verrou ; seule l'écriture du résultat verrouille la ligne
+        _, transactions, echecs, erreurs = verify_recharges(ids=[rechargement_id])
+        
+        for trans in transactions:
+            enqueue_transaction(trans)
+        
+        if erreurs:
+            # Fournisseur injoignable : nouvelle tentative de la tâche
+            raise erreurs[0]
+        
+        if transactions:
+            logger.info(f"Rechargement {rechargement_id} confirmé")
+            return f"Rechargement {rechargement_id} confirmé"
+        if echecs:
+            logger.warning(f"Rechargement {rechargement_id} échoué - paiement non vérifié")
+            return f"Rechargement {rechargement_id} échoué"
+        return f"Rechargement {rechargement_id} en attente de confirmation du fournisseur"
                 
     except Exception as exc:
         logger.error(f"Erreur lors du traitement du rechargement {rechargement_id}: {exc}")
         
-        if self.request.retries < self.max_retries:
-            raise self.retry(countdown=60 * (2 ** self.request.retries), exc=exc)
-        else:
-            return f"Échec définitif du traitement après {self.max_retries} tentatives"
-
-def verify_payment(rechargement):
-    """Vérifie le paiement selon le mode de paiement"""
-    # Simulation - à remplacer par l'intégration réelle
-    if rechargement.mode_paiement == 'MOBILE_MONEY':
-        # Vérification avec l'API Mobile Money
-        return True
-    elif rechargement.mode_paiement == 'CARTE_BANCAIRE':
-        # Vérification avec l'API bancaire
-        return True
-    elif rechargement.mode_paiement == 'VIREMENT':
-        # Vérification du virement
-        return True
-    else:
-        return True
+        retry_or_dead_letter(self, exc)
+        return f"Échec définitif du traitement après {self.request.retries + 1} tentatives"
+
+@shared_task
+def verify_pending_recharges():
+    """Interroge les fournisseurs pour les rechargements en attente, par lots"""
+    try:
+        verifies, transactions, echecs, erreurs = verify_recharges()
+        
+        for trans in transactions:
+            enqueue_transaction(trans)
+        
+        if verifies:
+            logger.info(
+                f"Vérification des paiements: {verifies} rechargements, "
+                f"{len(transactions)} confirmés, {echecs} échoués"
+            )
+        if erreurs:
+            # Les rechargements concernés sont revérifiés au cycle suivant
+            logger.warning(f"Vérification des paiements: {len(erreurs)} appels fournisseur en échec")
+        return f"{len(transactions)} rechargements confirmés, {echecs} échoués"
+        
+    except Exception as exc:
+        logger.error(f"Erreur lors de la vérification des rechargements en attente: {exc}")
+        return f"Erreur: {exc}"
 
 @shared_task
 def create_notification_task(user_id, type_notif, titre, message, canal='EMAIL'):
@@ -0,0 +1,601 @@
+import io
+import re
+import threading
+import uuid
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock, skipUnless
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError, connection, transaction
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+from cartes.models import CarteRFID
+from identites.models import Utilisateur
+from parametres.cache import invalidate_parametres
+from parametres.models import ParametreSysteme
+from . import fraud, usage
+from .authorization import apply_transactions, authorize_inline
+from .fees import ORDRE_RECHERCHE, compile_rules, compute_fee
+from .ingestion import ingest_transactions
+from .models import CompteurDepensesCarte, EcartReconciliation, Rechargement, Transaction
+from .partitions import TABLE_CLES, convert_table, ensure_partitions, is_partitioned, months_between, partition_name
+from .periods import day_bounds, next_month
+from .reconciliation import card_blocks, finish_execution, reconcile_block, start_execution
+from .statements import fetch_block
+from .tasks import pending_transactions_queryset
+from .views import TransactionViewSet
+
+
+def regle(operation='*', type_carte='*', partenaire='*', fixe='0', priorite=0):
+    return {
+        'cible': 'TRANSACTION', 'operation': operation, 'type_carte': type_carte,
+        'partenaire': partenaire, 'priorite': priorite,
+        'tranches': [{'min': '0', 'fixe': fixe, 'taux': '0'}],
+    }
+
+
+class ComputeFeeTests(SimpleTestCase):
+    def test_ordre_recherche_couvre_les_huit_combinaisons(self):
+        self.assertEqual(len(set(ORDRE_RECHERCHE)), 8)
+        self.assertEqual(ORDRE_RECHERCHE[0], (True, True, True))
+        self.assertEqual(ORDRE_RECHERCHE[-1], (False, False, False))
+
+    def test_regle_partenaire_sur_toute_operation(self):
+        table = compile_rules({
+            'FRAIS_GENERAL': regle(fixe='1.00'),
+            'FRAIS_ACHAT': regle(operation='ACHAT', fixe='0.50'),
+            'FRAIS_PARTENAIRE': regle(partenaire='M42', fixe='0.10'),
+        })
+        # Règle partenaire sans opération : plus spécifique que la règle générale
+        self.assertEqual(compute_fee('TRANSACTION', 'RETRAIT', 'STANDARD', 'M42', Decimal('20'), table), Decimal('0.10'))
+        # L'opération prime sur le partenaire à spécificité égale
+        self.assertEqual(compute_fee('TRANSACTION', 'ACHAT', 'STANDARD', 'M42', Decimal('20'), table), Decimal('0.50'))
+        self.assertEqual(compute_fee('TRANSACTION', 'RETRAIT', 'STANDARD', 'M7', Decimal('20'), table), Decimal('1.00'))
+
+    def test_regle_partenaire_par_type_de_carte(self):
+        table = compile_rules({
+            'FRAIS_GENERAL': regle(fixe='1.00'),
+            'FRAIS_PARTENAIRE_PREMIUM': regle(type_carte='PREMIUM', partenaire='M42', fixe='0.00'),
+        })
+        self.assertEqual(compute_fee('TRANSACTION', 'ACHAT', 'PREMIUM', 'M42', Decimal('20'), table), Decimal('0.00'))
+        self.assertEqual(compute_fee('TRANSACTION', 'ACHAT', 'STANDARD', 'M42', Decimal('20'), table), Decimal('1.00'))
+
+
+def creer_carte(solde='100', statut='ACTIVE', **kwargs):
+    champs = {
+        'code_uid': uuid.uuid4().hex, 'numero_serie': uuid.uuid4().hex[:20], 'type_carte': 'STANDARD',
+        'solde': Decimal(solde), 'plafond_quotidien': Decimal('1000'), 'plafond_mensuel': Decimal('5000'),
+        'solde_maximum': Decimal('10000'), 'statut': statut, 'date_expiration': date(2099, 1, 1),
+        'lieu_emission': 'Test', 'version_securite': '1', 'cle_chiffrement': 'cle',
+    }
+    champs.update(kwargs)
+    return CarteRFID.objects.create(**champs)
+
+
+# Stores en mémoire et cache local : les tests ne dépendent pas de Redis
+STORES_LOCAUX = override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    FRAUD_DETECTION={**settings.FRAUD_DETECTION, 'STORE': 'LOCAL'},
+    CARD_USAGE={**settings.CARD_USAGE, 'STORE': 'LOCAL'},
+)
+
+
+class StoresLocauxMixin:
+    def setUp(self):
+        super().setUp()
+        # Le cache local survit aux tests : vidé, et paramètres relus en base
+        cache.clear()
+        invalidate_parametres()
+        # Stores recréés à chaque test
+        for module in (fraud, usage):
+            patcher = mock.patch.object(module, '_store', None)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+@STORES_LOCAUX
+class TransactionDBTestCase(StoresLocauxMixin, TestCase):
+    pass
+
+
+@STORES_LOCAUX
+class CommittedDBTestCase(StoresLocauxMixin, TransactionTestCase):
+    """Pour le code qui ouvre ses propres transactions (isolation, verrous entre connexions)"""
+
+
+class IngestionTests(TransactionDBTestCase):
+    def test_resultat_rejoue_identique_au_resultat_d_origine(self):
+        carte = creer_carte('100')
+        items = [(0, {
+            'carte': carte.id, 'type_transaction': 'ACHAT', 'montant': Decimal('12.50'),
+            'reference_interne': 'ING-1', 'terminal_id': 'T1', 'reference_externe': 'R1',
+        })]
+
+        premier, = ingest_transactions(items)
+        rejoue, = ingest_transactions(items)
+
+        self.assertEqual(premier['status'], 'VALIDEE')
+        self.assertEqual(premier['solde_apres'], '87.50')
+        self.assertTrue(rejoue.pop('rejoue'))
+        self.assertEqual(rejoue, premier)
+
+
+def creer_transaction(carte, type_transaction='ACHAT', montant='10', statut='VALIDEE', **kwargs):
+    champs = {
+        'carte': carte, 'type_transaction': type_transaction, 'montant': Decimal(montant),
+        'solde_avant': carte.solde, 'solde_apres': carte.solde, 'statut': statut,
+        'reference_interne': uuid.uuid4().hex,
+    }
+    champs.update(kwargs)
+    date_transaction = champs.pop('date_transaction', None)
+    trans = Transaction.objects.create(**champs)
+    if date_transaction is not None:
+        # date_transaction est renseignée à la création (auto_now_add)
+        Transaction.objects.filter(pk=trans.pk).update(date_transaction=date_transaction)
+    return trans
+
+
+class StatementTests(TransactionDBTestCase):
+    def test_solde_d_ouverture_sans_historique_avant_le_mois(self):
+        carte = creer_carte('50')
+        creer_transaction(
+            carte, montant='30', solde_avant=Decimal('80'), solde_apres=Decimal('50'),
+            date_transaction=timezone.make_aware(datetime(2026, 4, 3, 12)),
+        )
+        carte_sans_mouvement = creer_carte('20')
+
+        releves = {releve['carte_id']: releve for releve in fetch_block(date(2026, 3, 1), None, 10)}
+
+        # Solde avant le premier mouvement postérieur au mois, pas le solde actuel
+        self.assertEqual(releves[str(carte.id)]['solde_ouverture'], '80.00')
+        self.assertEqual(releves[str(carte.id)]['solde_cloture'], '80.00')
+        self.assertEqual(releves[str(carte_sans_mouvement.id)]['solde_ouverture'], '20.00')
+
+
+class ReconciliationTests(CommittedDBTestCase):
+    def executer(self, complete=None):
+        execution = start_execution(complete)
+        cartes = []
+        for bloc in card_blocks(execution, 100):
+            reconcile_block(bloc, execution.date_coupure, execution.id)
+            cartes.extend(bloc)
+        finish_execution(execution.id)
+        return execution, cartes
+
+    def valider(self, carte, montant, solde_avant, solde_apres, anciennete=timedelta(hours=1)):
+        trans = creer_transaction(
+            carte, type_transaction='RECHARGE', montant=montant,
+            solde_avant=Decimal(solde_avant), solde_apres=Decimal(solde_apres),
+        )
+        Transaction.objects.filter(pk=trans.pk).update(date_validation=timezone.now() - anciennete)
+
+    def test_execution_incrementale_limitee_aux_cartes_actives(self):
+        active = creer_carte('100')
+        inactive = creer_carte('0')
+        self.valider(active, '100', '0', '100')
+
+        execution, cartes = self.executer()
+        self.assertTrue(execution.complete)
+        self.assertEqual(sorted(cartes), sorted([active.id, inactive.id]))
+
+        # Solde modifié hors transaction sur une carte sans activité
+        CarteRFID.objects.filter(pk=inactive.pk).update(solde=Decimal('5'))
+        # Transaction validée après la coupure de l'exécution précédente
+        self.valider(active, '10', '100', '110', anciennete=timedelta(0))
+        CarteRFID.objects.filter(pk=active.pk).update(solde=Decimal('110'))
+
+        execution, cartes = self.executer()
+        self.assertFalse(execution.complete)
+        self.assertEqual(cartes, [active.id])
+        self.assertFalse(EcartReconciliation.objects.exists())
+
+        # L'écart est détecté par le balayage complet suivant
+        execution, cartes = self.executer(complete=True)
+        self.assertEqual(len(cartes), 2)
+        ecart = EcartReconciliation.objects.get()
+        self.assertEqual((ecart.carte_id, ecart.ecart), (inactive.id, Decimal('5')))
+
+
+class FraudScoringTests(TransactionDBTestCase):
+    def passage(self, carte, montant='10', terminal_id='T1', instant=1000.0):
+        trans = Transaction(
+            carte=carte, type_transaction='ACHAT', montant=Decimal(montant), terminal_id=terminal_id,
+            reference_interne=uuid.uuid4().hex,
+        )
+        return fraud.score_transaction(trans, instant=instant)
+
+    def test_velocite_des_passages(self):
+        carte = creer_carte()
+        resultats = [self.passage(carte, instant=1000.0 + i) for i in range(6)]
+        self.assertEqual(resultats[:5], [None] * 5)
+        self.assertEqual(resultats[5]['regles'], ['VELOCITE_TAPS'])
+        # Hors de la fenêtre d'une minute, le compteur repart
+        self.assertIsNone(self.passage(carte, instant=1000.0 + 5 + 60))
+
+    def test_pic_de_montant(self):
+        ParametreSysteme.objects.create(
+            cle='FRAUDE_SEUIL_SCORE', valeur='30', type_valeur='INTEGER', categorie=fraud.CATEGORIE
+        )
+        carte = creer_carte()
+        for i in range(3):
+            self.assertIsNone(self.passage(carte, montant='10', instant=1000.0 + 100 * i))
+        self.assertEqual(self.passage(carte, montant='200', instant=1400.0)['regles'], ['PIC_MONTANT'])
+
+    def test_terminaux_multiples(self):
+        carte = creer_carte()
+        resultats = [self.passage(carte, terminal_id=f'T{i}', instant=1000.0 + 30 * i) for i in range(4)]
+        self.assertEqual(resultats[:3], [None] * 3)
+        self.assertEqual(resultats[3]['regles'], ['TERMINAUX_MULTIPLES'])
+
+    def test_en_revue_sur_le_chemin_inline(self):
+        carte = creer_carte('100')
+        statuts = []
+        for _ in range(6):
+            statuts.append(authorize_inline(creer_transaction(carte, statut='EN_COURS')))
+
+        self.assertEqual(statuts, ['VALIDEE'] * 5 + ['EN_REVUE'])
+        carte.refresh_from_db()
+        self.assertEqual(carte.solde, Decimal('50'))
+
+    def test_en_revue_sur_le_chemin_par_lots(self):
+        carte = creer_carte('100')
+        transactions = [creer_transaction(carte, statut='EN_COURS') for _ in range(6)]
+
+        resultats = apply_transactions(transactions)
+
+        self.assertEqual([resultats[trans.id] for trans in transactions], ['VALIDEE'] * 5 + ['EN_REVUE'])
+        self.assertEqual(transactions[5].code_erreur, 'SUSPICION_FRAUDE')
+        carte.refresh_from_db()
+        self.assertEqual(carte.solde, Decimal('50'))
+
+    def test_transfert_score_sur_le_chemin_par_lots(self):
+        carte, destination = creer_carte('100'), creer_carte('0')
+        # Cinq passages dans la minute : le transfert est le sixième
+        for i in range(5):
+            fraud.score_transaction(Transaction(carte=carte, montant=Decimal('1'), reference_interne=str(i)))
+        transfert = creer_transaction(
+            carte, type_transaction='TRANSFERT', statut='EN_COURS', carte_destination=destination
+        )
+        self.assertEqual(apply_transactions([transfert])[transfert.id], 'EN_REVUE')
+        self.assertIsNone(transfert.transaction_liee_id)
+
+
+class RevueTests(TransactionDBTestCase):
+    def setUp(self):
+        super().setUp()
+        self.agent = Utilisateur.objects.create(username='agent', role='AGENT')
+        self.carte = creer_carte('100')
+        self.trans = creer_transaction(self.carte, montant='30', statut='EN_COURS')
+        fraud.flag_for_review(self.trans, {'score': 50, 'regles': ['VELOCITE_TAPS']})
+        self.trans.save()
+
+    def decider(self, decision):
+        requete = APIRequestFactory().post('/', {'decision': decision}, format='json')
+        force_authenticate(requete, self.agent)
+        with mock.patch('transactions.views.enqueue_transaction') as enqueue:
+            with self.captureOnCommitCallbacks(execute=True):
+                reponse = TransactionViewSet.as_view({'post': 'revue'})(requete, pk=self.trans.pk)
+        self.trans.refresh_from_db()
+        return reponse, enqueue
+
+    def test_approbation_relance_sans_nouveau_scoring(self):
+        reponse, enqueue = self.decider('approuver')
+
+        self.assertEqual(reponse.status_code, 200)
+        self.assertEqual(self.trans.statut, 'EN_COURS')
+        self.assertTrue(self.trans.donnees_brutes['fraude']['approuvee'])
+        enqueue.assert_called_once()
+
+        # Le retraitement ne repasse pas par le scoring
+        with mock.patch.object(fraud, 'get_window_store') as store:
+            apply_transactions([self.trans])
+        store.assert_not_called()
+        self.assertEqual(self.trans.statut, 'VALIDEE')
+
+    def test_rejet(self):
+        reponse, enqueue = self.decider('REJETER')
+
+        self.assertEqual(reponse.status_code, 200)
+        self.assertEqual(self.trans.statut, 'ANNULEE')
+        self.assertEqual(self.trans.agent_validateur, self.agent)
+        enqueue.assert_not_called()
+        self.carte.refresh_from_db()
+        self.assertEqual(self.carte.solde, Decimal('100'))
+
+    def test_transaction_hors_revue(self):
+        self.decider('REJETER')
+        reponse, _ = self.decider('APPROUVER')
+        self.assertEqual(reponse.status_code, 400)
+
+
+class AuthorizeInlineTests(TransactionDBTestCase):
+    def test_solde_insuffisant_laisse_la_carte_intacte(self):
+        carte = creer_carte('20')
+        trans = creer_transaction(carte, montant='30', statut='EN_COURS')
+
+        self.assertEqual(authorize_inline(trans), 'ECHOUEE')
+
+        trans.refresh_from_db()
+        self.assertEqual((trans.code_erreur, trans.solde_avant, trans.solde_apres), ('SOLDE_INSUFFISANT', 20, 20))
+        self.assertIsNotNone(trans.date_validation)
+        carte.refresh_from_db()
+        self.assertEqual(carte.solde, Decimal('20'))
+        self.assertFalse(CompteurDepensesCarte.objects.filter(carte=carte).exists())
+
+    def test_carte_bloquee(self):
+        carte = creer_carte('100', statut='BLOQUEE')
+        trans = creer_transaction(carte, montant='10', statut='EN_COURS')
+
+        self.assertEqual(authorize_inline(trans), 'ECHOUEE')
+
+        self.assertEqual(trans.code_erreur, 'CARTE_INACTIVE')
+        carte.refresh_from_db()
+        self.assertEqual(carte.solde, Decimal('100'))
+
+    def test_credit(self):
+        carte = creer_carte('100')
+        trans = creer_transaction(carte, type_transaction='RECHARGE', montant='25', statut='EN_COURS')
+
+        self.assertEqual(authorize_inline(trans), 'VALIDEE')
+
+        trans.refresh_from_db()
+        self.assertEqual((trans.solde_avant, trans.solde_apres), (Decimal('100'), Decimal('125')))
+        carte.refresh_from_db()
+        self.assertEqual(carte.solde, Decimal('125'))
+        # Un crédit ne compte pas dans les dépenses
+        self.assertFalse(CompteurDepensesCarte.objects.filter(carte=carte).exists())
+
+    def test_reponse_validee(self):
+        agent = Utilisateur.objects.create(username='terminal', role='AGENT')
+        carte = creer_carte('100')
+        requete = APIRequestFactory().post('/?mode=inline', {
+            'carte': str(carte.id), 'type_transaction': 'ACHAT', 'montant': '12.50',
+            'reference_interne': 'INL-1', 'terminal_id': 'T1', 'reference_externe': 'R1',
+        }, format='json')
+        force_authenticate(requete, agent)
+
+        reponse = TransactionViewSet.as_view({'post': 'create'})(requete)
+
+        self.assertEqual(reponse.status_code, 201)
+        trans = Transaction.objects.get(reference_interne='INL-1')
+        self.assertEqual(reponse.data, {
+            'message': 'Transaction validée',
+            'transaction_id': str(trans.id),
+            'status': 'VALIDEE',
+            'solde_apres': '87.50',
+            'code_erreur': '',
+        })
+        self.assertEqual((trans.statut, trans.solde_avant, trans.solde_apres), ('VALIDEE', 100, Decimal('87.50')))
+        self.assertIsNotNone(trans.date_validation)
+        carte.refresh_from_db()
+        self.assertEqual(carte.solde, Decimal('87.50'))
+
+
+class SpendCounterTests(TransactionDBTestCase):
+    MONTANTS = ['40', '20', '5']  # Plafond quotidien de 50 : le second débit est refusé
+
+    def compteurs(self, carte):
+        return {
+            compteur.periode: (compteur.debut_periode, compteur.montant_total, compteur.nombre_transactions)
+            for compteur in CompteurDepensesCarte.objects.filter(carte=carte)
+        }
+
+    def test_plafond_quotidien_annule_le_debit_inline(self):
+        carte = creer_carte('100', plafond_quotidien=Decimal('50'))
+        authorize_inline(creer_transaction(carte, montant='40', statut='EN_COURS'))
+        avant = self.compteurs(carte)
+
+        trans = creer_transaction(carte, montant='20', statut='EN_COURS')
+        self.assertEqual(authorize_inline(trans), 'ECHOUEE')
+
+        self.assertEqual(trans.code_erreur, 'PLAFOND_QUOTIDIEN_DEPASSE')
+        self.assertEqual((trans.solde_avant, trans.solde_apres), (Decimal('60'), Decimal('60')))
+        carte.refresh_from_db()
+        self.assertEqual(carte.solde, Decimal('60'))
+        self.assertEqual(self.compteurs(carte), avant)
+
+    def test_plafond_mensuel_inline(self):
+        carte = creer_carte('100', plafond_mensuel=Decimal('30'))
+        trans = creer_transaction(carte, montant='40', statut='EN_COURS')
+
+        self.assertEqual(authorize_inline(trans), 'ECHOUEE')
+
+        self.assertEqual(trans.code_erreur, 'PLAFOND_MENSUEL_DEPASSE')
+        carte.refresh_from_db()
+        self.assertEqual(carte.solde, Decimal('100'))
+        self.assertEqual(self.compteurs(carte), {})
+
+    def test_plafond_quotidien_par_lots(self):
+        carte = creer_carte('100', plafond_quotidien=Decimal('50'))
+        apply_transactions([creer_transaction(carte, montant='40', statut='EN_COURS')])
+        avant = self.compteurs(carte)
+
+        trans = creer_transaction(carte, montant='20', statut='EN_COURS')
+        self.assertEqual(apply_transactions([trans])[trans.id], 'ECHOUEE')
+
+        self.assertEqual(trans.code_erreur, 'PLAFOND_QUOTIDIEN_DEPASSE')
+        carte.refresh_from_db()
+        self.assertEqual(carte.solde, Decimal('60'))
+        self.assertEqual(self.compteurs(carte), avant)
+
+    def test_memes_compteurs_sur_les_deux_chemins(self):
+        carte_inline = creer_carte('100', plafond_quotidien=Decimal('50'))
+        carte_lot = creer_carte('100', plafond_quotidien=Decimal('50'))
+
+        statuts_inline = [
+            authorize_inline(creer_transaction(carte_inline, montant=montant, statut='EN_COURS'))
+            for montant in self.MONTANTS
+        ]
+        lot = [creer_transaction(carte_lot, montant=montant, statut='EN_COURS') for montant in self.MONTANTS]
+        resultats = apply_transactions(lot)
+
+        self.assertEqual(statuts_inline, ['VALIDEE', 'ECHOUEE', 'VALIDEE'])
+        self.assertEqual([resultats[trans.id] for trans in lot], statuts_inline)
+        self.assertEqual(self.compteurs(carte_inline), self.compteurs(carte_lot))
+        self.assertEqual(self.compteurs(carte_lot)['JOUR'][1:], (Decimal('45'), 2))
+
+    def test_reconstruction_depuis_l_historique(self):
+        carte = creer_carte('100', plafond_quotidien=Decimal('50'))
+        for montant in self.MONTANTS:
+            authorize_inline(creer_transaction(carte, montant=montant, statut='EN_COURS'))
+        transfert = creer_transaction(
+            carte, type_transaction='TRANSFERT', montant='3', statut='EN_COURS', carte_destination=creer_carte('0')
+        )
+        apply_transactions([transfert])
+        attendus = self.compteurs(carte)
+        CompteurDepensesCarte.objects.all().delete()
+
+        call_command('rebuild_spend_counters', stdout=io.StringIO())
+
+        self.assertEqual(self.compteurs(carte), attendus)
+        self.assertEqual(attendus['MOIS'][1:], (Decimal('48'), 3))
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Verrous de ligne et interblocages PostgreSQL')
+class OpposingTransferTests(CommittedDBTestCase):
+    THREADS = 8
+    TRANSFERTS = 25
+
+    def test_transferts_opposes_sans_interblocage(self):
+        # Scoring désactivé par son paramètre : la vélocité du test placerait les transferts en revue
+        ParametreSysteme.objects.create(
+            cle='FRAUDE_ACTIVE', valeur='false', type_valeur='BOOLEAN', categorie=fraud.CATEGORIE
+        )
+        carte_a, carte_b = creer_carte('1000'), creer_carte('1000')
+        erreurs = []
+        depart = threading.Barrier(self.THREADS)
+
+        def transferer(source, destination):
+            try:
+                depart.wait()
+                for _ in range(self.TRANSFERTS):
+                    with transaction.atomic():
+                        debit = creer_transaction(
+                            source, type_transaction='TRANSFERT', montant='1', statut='EN_COURS',
+                            carte_destination=destination,
+                        )
+                        apply_transactions([debit])
+            except Exception as exc:
+                erreurs.append(exc)
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=transferer, args=(carte_a, carte_b) if i % 2 else (carte_b, carte_a))
+            for i in range(self.THREADS)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Aucune erreur, donc en particulier aucun interblocage (SQLSTATE 40P01)
+        self.assertEqual([getattr(exc.__cause__, 'pgcode', exc) for exc in erreurs], [])
+        carte_a.refresh_from_db()
+        carte_b.refresh_from_db()
+        self.assertEqual(carte_a.solde + carte_b.solde, Decimal('2000'))
+
+        debits = Transaction.objects.filter(type_transaction='TRANSFERT')
+        self.assertEqual(debits.count(), self.THREADS * self.TRANSFERTS)
+        self.assertFalse(debits.exclude(statut='VALIDEE').exists())
+        credits = {trans.id: trans for trans in Transaction.objects.filter(type_transaction='TRANSFERT_RECU')}
+        self.assertEqual(len(credits), debits.count())
+        for debit in debits:
+            credit = credits[debit.transaction_liee_id]
+            self.assertEqual(credit.transaction_liee_id, debit.id)
+            self.assertEqual((credit.carte_id, credit.montant, credit.statut), (debit.carte_destination_id, debit.montant, 'VALIDEE'))
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Partitionnement déclaratif PostgreSQL')
+class PartitionTests(TransactionDBTestCase):
+    """La conversion est faite dans la transaction du test, annulée à la fin"""
+
+    def setUp(self):
+        super().setUp()
+        mois_courant = timezone.now().astimezone(dt_timezone.utc).date().replace(day=1)
+        self.mois = [(mois_courant - timedelta(days=45)).replace(day=1), mois_courant]
+        self.mois.insert(1, next_month(self.mois[0]))
+        if is_partitioned():
+            ensure_partitions(3, depuis=self.mois[0])
+
+        self.carte = creer_carte('100')
+        self.transactions = [
+            creer_transaction(self.carte, date_transaction=datetime(m.year, m.month, 15, 12, tzinfo=dt_timezone.utc))
+            for m in self.mois
+        ]
+        if not is_partitioned():
+            convert_table()
+
+    def partitions_lues(self, queryset):
+        return set(re.findall(r'transactions_(?:\d{4}_\d{2}|defaut)', queryset.explain()))
+
+    def test_lignes_reparties_par_mois(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT id, tableoid::regclass::text FROM transactions')
+            partitions = dict(cursor.fetchall())
+            cursor.execute(f'SELECT count(*) FROM {TABLE_CLES}')
+            cles = cursor.fetchone()[0]
+
+        self.assertEqual(
+            [partitions[trans.id] for trans in self.transactions],
+            [partition_name(m) for m in self.mois]
+        )
+        self.assertEqual(cles, Transaction.objects.count())
+
+    def test_reference_interne_unique_entre_partitions(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            creer_transaction(self.carte, reference_interne=self.transactions[0].reference_interne)
+
+    def test_reference_terminal_unique_entre_partitions(self):
+        Transaction.objects.filter(pk=self.transactions[0].pk).update(terminal_id='T1', reference_externe='R1')
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            creer_transaction(self.carte, terminal_id='T1', reference_externe='R1')
+
+    def test_changement_de_mois_deplace_la_ligne(self):
+        trans = self.transactions[0]
+        Transaction.objects.filter(pk=trans.pk).update(date_transaction=timezone.now())
+
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT tableoid::regclass::text FROM transactions WHERE id = %s', [trans.id])
+            self.assertEqual(cursor.fetchone()[0], partition_name(self.mois[-1]))
+            cursor.execute(f'SELECT date_transaction FROM {TABLE_CLES} WHERE id = %s', [trans.id])
+            self.assertEqual(cursor.fetchone()[0], Transaction.objects.get(pk=trans.pk).date_transaction)
+
+    def test_cle_etrangere_vers_transactions_cles(self):
+        champs = {'carte': self.carte, 'montant_recharge': Decimal('10'), 'mode_paiement': 'ESPECES', 'point_recharge': 'Test'}
+        Rechargement.objects.create(transaction=self.transactions[0], **champs)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Rechargement.objects.create(transaction_id=uuid.uuid4(), **champs)
+            # Contraintes différées : vérifiées ici plutôt qu'au commit
+            with connection.cursor() as cursor:
+                cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+
+    def test_partitions_creees_a_l_avance(self):
+        creees = ensure_partitions(5)
+        self.assertEqual(len(creees), 2)
+        self.assertEqual(ensure_partitions(5), [])
+
+        out = io.StringIO()
+        call_command('create_transaction_partitions', '--mois', '6', stdout=out)
+        self.assertIn('1 partitions créées', out.getvalue())
+
+    def test_conversion_refusee_sur_table_partitionnee(self):
+        with self.assertRaises(CommandError):
+            call_command('partition_transactions', stdout=io.StringIO())
+
+    def test_elagage_des_partitions(self):
+        debut, fin = day_bounds(date(self.mois[1].year, self.mois[1].month, 15))
+        journee = Transaction.objects.filter(date_transaction__gte=debut, date_transaction__lt=fin)
+        self.assertEqual(self.partitions_lues(journee), {partition_name(self.mois[1])})
+
+        # Fenêtre de reprise : les mois qu'elle recouvre seulement
+        maintenant = timezone.now().astimezone(dt_timezone.utc)
+        fenetre = maintenant - timedelta(days=settings.TRANSACTION_BATCH['FENETRE_JOURS'])
+        self.assertEqual(
+            self.partitions_lues(pending_transactions_queryset()),
+            {partition_name(m) for m in months_between(fenetre.date(), maintenant.date())}
+        )
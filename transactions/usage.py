@@ -0,0 +1,177 @@
+import logging
+import threading
+from datetime import datetime, timezone as dt_timezone
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.db.models.functions import Coalesce, Greatest
+from cartes.models import CarteRFID
+
+# Compteurs d'utilisation des cartes (nombre_transactions,
+# derniere_utilisation) en écriture différée : le moteur d'autorisation
+# n'écrit que le solde sur la ligne de la carte, les compteurs sont cumulés
+# dans un store rapide (Redis en production, mémoire locale pour les tests
+# et le développement) après le commit, puis reportés périodiquement en
+# base par lots d'UPDATE. Les compteurs affichés peuvent donc avoir
+# jusqu'à un intervalle de report de retard.
+
+logger = logging.getLogger(__name__)
+
+
+class LocalUsageStore:
+    """Compteurs en mémoire du processus (tests, développement)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._compteurs = {}
+
+    def record(self, usages):
+        """Cumule {carte_id: (nombre, horodatage)}"""
+        with self._lock:
+            for carte_id, (nombre, instant) in usages.items():
+                cumul, derniere = self._compteurs.get(carte_id, (0, instant))
+                self._compteurs[carte_id] = (cumul + nombre, max(derniere, instant))
+
+    def drain(self):
+        """Retourne et vide les compteurs cumulés"""
+        with self._lock:
+            compteurs, self._compteurs = self._compteurs, {}
+        return compteurs
+
+
+class RedisUsageStore:
+    """Compteurs dans Redis, partagés par tous les workers"""
+
+    CLE_NOMBRES = 'usage_cartes:nombres'
+    CLE_DERNIERES = 'usage_cartes:dernieres'
+
+    def __init__(self, url):
+        import redis
+        self._client = redis.Redis.from_url(url)
+
+    def record(self, usages):
+        """Cumule {carte_id: (nombre, horodatage)} en un aller-retour"""
+        pipe = self._client.pipeline(transaction=False)
+        for carte_id, (nombre, instant) in usages.items():
+            pipe.hincrby(self.CLE_NOMBRES, carte_id, nombre)
+            # GT : l'horodatage n'est remplacé que par un plus récent
+            pipe.zadd(self.CLE_DERNIERES, {carte_id: instant}, gt=True)
+        pipe.execute()
+
+    def drain(self):
+        """Retourne et vide les compteurs cumulés (MULTI/EXEC : aucun incrément perdu)"""
+        pipe = self._client.pipeline(transaction=True)
+        pipe.hgetall(self.CLE_NOMBRES)
+        pipe.zrange(self.CLE_DERNIERES, 0, -1, withscores=True)
+        pipe.delete(self.CLE_NOMBRES, self.CLE_DERNIERES)
+        nombres, dernieres, _ = pipe.execute()
+        dernieres = {carte_id.decode(): instant for carte_id, instant in dernieres}
+        return {
+            carte_id.decode(): (int(nombre), dernieres.get(carte_id.decode(), 0))
+            for carte_id, nombre in nombres.items()
+        }
+
+
+_store = None
+
+
+def get_usage_store():
+    """Store configuré par settings.CARD_USAGE['STORE'] (REDIS ou LOCAL)"""
+    global _store
+    if _store is None:
+        config = settings.CARD_USAGE
+        if config['STORE'].upper() == 'LOCAL':
+            _store = LocalUsageStore()
+        else:
+            _store = RedisUsageStore(config['REDIS_URL'])
+    return _store
+
+
+def usage_increments(transactions):
+    """Compteurs d'utilisation des transactions validées d'un lot : {carte_id: (nombre, horodatage)}"""
+    usages = {}
+    for trans in transactions:
+        if trans.statut != 'VALIDEE':
+            continue
+        carte_id = str(trans.carte_id)
+        nombre, derniere = usages.get(carte_id, (0, 0))
+        usages[carte_id] = (nombre + 1, max(derniere, trans.date_validation.timestamp()))
+    return usages
+
+
+def record_usage(transactions):
+    """Enregistre l'utilisation des cartes après le commit du lot.
+
+    Doit être appelée dans le bloc transaction.atomic() de l'autorisation :
+    un lot annulé ne compte pas. Si le store est indisponible, les
+    compteurs sont écrits directement en base.
+    """
+    usages = usage_increments(transactions)
+    if not usages:
+        return
+
+    def enregistrer():
+        try:
+            get_usage_store().record(usages)
+        except Exception as exc:
+            logger.warning(f"Store des compteurs d'utilisation indisponible, écriture directe: {exc}")
+            write_usage(usages)
+
+    transaction.on_commit(enregistrer)
+
+
+def write_usage(usages, non_reportes=None):
+    """Reporte des compteurs en base, un UPDATE par lot de cartes.
+
+    Les cartes sont verrouillées dans l'ordre de leur identifiant, comme
+    dans apply_transactions, avant chaque UPDATE : un report ne peut pas
+    s'interbloquer avec l'autorisation. Chaque lot est validé séparément ;
+    en cas d'erreur, les compteurs des lots non reportés sont ajoutés à
+    non_reportes.
+    """
+    taille = settings.CARD_USAGE['TAILLE_LOT']
+    items = sorted(usages.items())
+    cartes = 0
+    for i in range(0, len(items), taille):
+        lot = items[i:i + taille]
+        increment = Case(
+            *[When(id=carte_id, then=Value(nombre)) for carte_id, (nombre, _) in lot],
+            default=Value(0),
+            output_field=IntegerField(),
+        )
+        derniere = Case(
+            *[
+                When(id=carte_id, then=Value(datetime.fromtimestamp(instant, tz=dt_timezone.utc)))
+                for carte_id, (_, instant) in lot
+            ],
+            output_field=CarteRFID._meta.get_field('derniere_utilisation'),
+        )
+        ids = [carte_id for carte_id, _ in lot]
+        try:
+            with transaction.atomic():
+                list(CarteRFID.objects.select_for_update().filter(id__in=ids).order_by('id').values_list('id', flat=True))
+                # Pas de save() : ni solde ni date_modification ne sont réécrits
+                cartes += CarteRFID.objects.filter(id__in=ids).update(
+                    nombre_transactions=F('nombre_transactions') + increment,
+                    derniere_utilisation=Greatest(Coalesce('derniere_utilisation', derniere), derniere),
+                )
+        except Exception:
+            if non_reportes is not None:
+                non_reportes.update(items[i:])
+            raise
+    return cartes
+
+
+def flush_usage():
+    """Vide le store et reporte les compteurs en base ; retourne le nombre de cartes mises à jour"""
+    store = get_usage_store()
+    usages = store.drain()
+    if not usages:
+        return 0
+    non_reportes = {}
+    try:
+        return write_usage(usages, non_reportes)
+    except Exception:
+        # Les compteurs non reportés sont remis dans le store pour le prochain report
+        store.record(non_reportes)
+        raise
@@ -1,28 +1,62 @@
+import uuid
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.db import IntegrityError, transaction
 from rest_framework import viewsets
 from rest_framework.permissions import IsAuthenticated
 from .models import Transaction, Rechargement
-from .serializers import TransactionSerializer, RechargementSerializer
+from .serializers import (
+    TransactionSerializer, TransactionIngestionSerializer, TransfertSerializer, RechargementSerializer
+)
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework import status
-from .tasks import process_transaction, process_rechargement
+from rfid_system.pagination import KeysetPagination
+from .tasks import enqueue_transaction, process_rechargement, export_transactions_xlsx
+from .authorization import apply_transactions, authorize_inline, TYPES_INLINE
+from .lanes import lane_metrics
+from .ingestion import ingest_transactions
+from .idempotency import find_replay, idempotency_stats
+from .exports import export_queryset, iter_csv, parse_period
+from .rollups import REGROUPEMENTS, rollup_summary
 
 
 class TransactionViewSet(viewsets.ModelViewSet):
     queryset = Transaction.objects.all()
     serializer_class = TransactionSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
+    keyset_field = 'date_transaction'
     
     def create(self, request, *args, **kwargs):
         """Crée une transaction et la traite de manière asynchrone"""
+        # Soumission rejouée par le terminal : on renvoie le résultat d'origine
+        terminal_id = request.data.get('terminal_id', '')
+        reference_externe = request.data.get('reference_externe', '')
+        replay = find_replay(terminal_id, reference_externe)
+        if replay is not None:
+            return self._replay_response(replay)
+        
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         
-        # Création de la transaction
-        transaction_obj = serializer.save()
+        mode = request.query_params.get('mode', settings.TRANSACTION_AUTHORIZATION_MODE)
+        try:
+            if mode.upper() == 'INLINE' and serializer.validated_data['type_transaction'] in TYPES_INLINE:
+                return self._create_inline(serializer)
+            
+            # Création de la transaction
+            with transaction.atomic():
+                transaction_obj = serializer.save()
+        except IntegrityError:
+            # Soumission concurrente insérée entre la recherche et l'insertion
+            replay = find_replay(terminal_id, reference_externe)
+            if replay is None:
+                raise
+            return self._replay_response(replay)
         
-        # Traitement asynchrone
-        process_transaction.delay(str(transaction_obj.id))
+        # Traitement asynchrone dans la file de la carte
+        enqueue_transaction(transaction_obj)
         
         return Response(
             {
@@ -33,13 +67,41 @@ class TransactionViewSet(viewsets.ModelViewSet):
             status=status.HTTP_201_CREATED
         )
     
+    def _create_inline(self, serializer):
+        """Crée et autorise une transaction dans la requête du terminal"""
+        with transaction.atomic():
+            transaction_obj = serializer.save(statut='EN_COURS')
+            statut_final = authorize_inline(transaction_obj)
+        
+        return Response(
+            {
+                'message': 'Transaction validée' if statut_final == 'VALIDEE' else 'Transaction refusée',
+                'transaction_id': str(transaction_obj.id),
+                'status': statut_final,
+                'solde_apres': str(transaction_obj.solde_apres),
+                'code_erreur': transaction_obj.code_erreur,
+            },
+            status=status.HTTP_201_CREATED
+        )
+    
+    def _replay_response(self, replay):
+        """Réponse à une soumission déjà reçue"""
+        return Response(
+            {
+                'message': 'Transaction déjà soumise',
+                **replay,
+                'rejoue': True,
+            },
+            status=status.HTTP_200_OK
+        )
+    
     @action(detail=True, methods=['post'])
     def reprocess(self, request, pk=None):
         """Relance le traitement d'une transaction"""
         transaction_obj = self.get_object()
         
         if transaction_obj.statut in ['ECHOUEE', 'EN_COURS']:
-            process_transaction.delay(str(transaction_obj.id))
+            enqueue_transaction(transaction_obj)
             return Response({'message': 'Retraitement lancé'})
         else:
             return Response(
@@ -47,6 +109,202 @@ class TransactionViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
+    @action(detail=True, methods=['post'])
+    def revue(self, request, pk=None):
+        """Décision sur une transaction placée en revue par le scoring de fraude"""
+        decision = str(request.data.get('decision', '')).upper()
+        if decision not in ('APPROUVER', 'REJETER'):
+            return Response(
+                {'error': 'Décision attendue: APPROUVER ou REJETER'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        with transaction.atomic():
+            transaction_obj = self.get_queryset().select_for_update().get(pk=self.get_object().pk)
+            if transaction_obj.statut != 'EN_REVUE':
+                return Response(
+                    {'error': "La transaction n'est pas en revue"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            
+            fraude = {**transaction_obj.donnees_brutes.get('fraude', {}), 'revue_par': str(request.user.id)}
+            if decision == 'APPROUVER':
+                # Retraitement sans nouveau scoring
+                fraude['approuvee'] = True
+                transaction_obj.statut = 'EN_COURS'
+                transaction_obj.code_erreur = ''
+                transaction_obj.message_erreur = ''
+            else:
+                transaction_obj.statut = 'ANNULEE'
+                transaction_obj.message_erreur = 'Transaction rejetée après revue'
+            transaction_obj.donnees_brutes = {**transaction_obj.donnees_brutes, 'fraude': fraude}
+            transaction_obj.agent_validateur = request.user
+            transaction_obj.save(update_fields=[
+                'statut', 'code_erreur', 'message_erreur', 'donnees_brutes', 'agent_validateur'
+            ])
+            
+            if decision == 'APPROUVER':
+                transaction.on_commit(lambda: enqueue_transaction(transaction_obj))
+        
+        return Response({
+            'message': 'Transaction approuvée' if decision == 'APPROUVER' else 'Transaction rejetée',
+            'transaction_id': str(transaction_obj.id),
+            'status': transaction_obj.statut,
+        })
+
+    @action(detail=False, methods=['post'])
+    def transfert(self, request):
+        """Transfert immédiat entre deux cartes, débit et crédit dans une même transaction"""
+        serializer = TransfertSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        donnees = serializer.validated_data
+        
+        with transaction.atomic():
+            debit = Transaction.objects.create(
+                carte=donnees['carte'],
+                carte_destination=donnees['carte_destination'],
+                type_transaction='TRANSFERT',
+                montant=donnees['montant'],
+                solde_avant=donnees['carte'].solde,
+                solde_apres=donnees['carte'].solde,
+                reference_interne=donnees.get('reference_interne') or f"TRF_{uuid.uuid4().hex}",
+                description=donnees.get('description', ''),
+                agent_validateur=request.user,
+            )
+            apply_transactions([debit])
+        
+        return Response(
+            {
+                'message': 'Transfert effectué' if debit.statut == 'VALIDEE' else 'Transfert refusé',
+                'transaction_id': str(debit.id),
+                'transaction_liee_id': str(debit.transaction_liee_id) if debit.transaction_liee_id else None,
+                'status': debit.statut,
+                'solde_apres': str(debit.solde_apres),
+                'code_erreur': debit.code_erreur,
+            },
+            status=status.HTTP_201_CREATED
+        )
+
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        """Ingestion en masse des transactions bufferisées par un terminal hors ligne"""
+        items = request.data.get('transactions') if isinstance(request.data, dict) else request.data
+        
+        if not isinstance(items, list) or not items:
+            return Response(
+                {'error': 'Une liste de transactions est requise'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(items) > settings.TRANSACTION_INGESTION_MAX:
+            return Response(
+                {'error': f'Maximum {settings.TRANSACTION_INGESTION_MAX} transactions par lot'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        resultats = []
+        valides = []
+        for index, item in enumerate(items):
+            serializer = TransactionIngestionSerializer(data=item)
+            if serializer.is_valid():
+                valides.append((index, serializer.validated_data))
+            else:
+                resultats.append({
+                    'index': index,
+                    'status': 'REJETEE',
+                    'code_erreur': 'DONNEES_INVALIDES',
+                    'erreurs': serializer.errors,
+                })
+        
+        if valides:
+            resultats.extend(ingest_transactions(valides))
+        resultats.sort(key=lambda resultat: resultat['index'])
+        
+        return Response({
+            'total': len(items),
+            'validees': sum(1 for resultat in resultats if resultat['status'] == 'VALIDEE'),
+            'echouees': sum(1 for resultat in resultats if resultat['status'] == 'ECHOUEE'),
+            'rejetees': sum(1 for resultat in resultats if resultat['status'] == 'REJETEE'),
+            'resultats': resultats,
+        })
+    
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """Export CSV en streaming des transactions d'une période (?debut=AAAA-MM-JJ&fin=AAAA-MM-JJ)"""
+        debut = request.query_params.get('debut')
+        fin = request.query_params.get('fin')
+        try:
+            date_debut, date_fin = parse_period(debut, fin)
+        except (TypeError, ValueError):
+            return Response(
+                {'error': 'Paramètres debut et fin requis au format AAAA-MM-JJ'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        queryset = export_queryset(date_debut, date_fin, request.query_params.get('statut'))
+        response = StreamingHttpResponse(iter_csv(queryset), content_type='text/csv; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="transactions_{debut}_{fin}.csv"'
+        return response
+    
+    @action(detail=False, methods=['post'])
+    def export_xlsx(self, request):
+        """Lance la génération asynchrone d'un export XLSX"""
+        debut = request.data.get('debut')
+        fin = request.data.get('fin')
+        try:
+            parse_period(debut, fin)
+        except (TypeError, ValueError):
+            return Response(
+                {'error': 'Paramètres debut et fin requis au format AAAA-MM-JJ'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        export_transactions_xlsx.delay(debut, fin, str(request.user.id), request.data.get('statut'))
+        return Response(
+            {'message': 'Export en cours de génération, vous serez notifié à la fin'},
+            status=status.HTTP_202_ACCEPTED
+        )
+    
+    @action(detail=False, methods=['get'])
+    def agregats(self, request):
+        """Indicateurs marchand/terminal sur une période, lus dans les agrégats"""
+        debut = request.query_params.get('debut')
+        fin = request.query_params.get('fin')
+        try:
+            date_debut, date_fin = parse_period(debut, fin)
+        except (TypeError, ValueError):
+            return Response(
+                {'error': 'Paramètres debut et fin requis au format AAAA-MM-JJ'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        par = request.query_params.get('par')
+        if par is not None and par not in REGROUPEMENTS:
+            return Response(
+                {'error': f"Paramètre par invalide, attendu: {', '.join(REGROUPEMENTS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        return Response({
+            'debut': debut,
+            'fin': fin,
+            **rollup_summary(
+                date_debut, date_fin,
+                merchant_id=request.query_params.get('merchant_id'),
+                terminal_id=request.query_params.get('terminal_id'),
+                par=par,
+            ),
+        })
+    
+    @action(detail=False, methods=['get'])
+    def idempotence(self, request):
+        """Compteurs de soumissions rejouées"""
+        return Response(idempotency_stats())
+    
+    @action(detail=False, methods=['get'])
+    def lanes(self, request):
+        """Métriques de débit des files de traitement par carte"""
+        return Response({'lanes': lane_metrics()})
+
 class RechargementViewSet(viewsets.ModelViewSet):
     queryset = Rechargement.objects.all()
     serializer_class = RechargementSerializer